@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+""" Measure the overhead of ipyexperiments on the cells it measures
+
+Synthetic cells are run in an in-process ipython shell, without any logger and
+then under each CellLogger/IPyExperimentsCPU configuration, measuring:
+
+* cell_time    - median wall time of the whole cell, including the event handlers
+* slowdown     - cell_time relative to the same cell run without any logger
+* pre_latency  - median time spent in the pre_run_cell handlers
+* post_latency - median time spent in the post_run_cell handlers
+* sampler_cpu  - median CPU time used by the peak memory monitor thread per cell
+* finish_time  - time of IPyExperiments.finish() (configs with exp_enable=True)
+
+The results are saved as json, so that runs before and after a change can be compared:
+
+python benchmarks/bench_overhead.py --output before.json
+# make the change
+python benchmarks/bench_overhead.py --output after.json --compare before.json
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# make sure we benchmark the checked out git version of the repo
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from IPython.core.interactiveshell import InteractiveShell
+import ipyexperiments
+from ipyexperiments import IPyExperimentsCPU
+
+# name: (setup code run before the experiment starts, cell code)
+workloads = {
+    'empty':         ("", "pass"),
+    'python_loop':   ("", "s = 0\nfor i in range(2*10**6): s += i"),
+    'numpy_alloc':   ("import numpy as np", "x = np.ones((2**11, 2**11)); y = x * 2; del x, y"),
+    'small_objects': ("", "objs = [{'i': i} for i in range(2*10**5)]; del objs"),
+    # a big heap existing before the experiment makes each gc.collect() slower
+    'big_heap':      ("bench_heap = [[i] for i in range(2*10**6)]", "s = sum(range(10**5))"),
+}
+
+# name: IPyExperimentsCPU kwargs, None is no logger at all
+configs = {
+    'baseline':       None,
+    'cl_default':     dict(exp_enable=False),
+    'cl_compact':     dict(exp_enable=False, cl_compact=True),
+    'cl_no_gc':       dict(exp_enable=False, cl_gc_collect=False),
+    'cl_tracemalloc': dict(exp_enable=False, cl_tracemalloc_frames=1),
+    'cl_threads':     dict(exp_enable=False, cl_threads='name'),
+    'exp_default':    dict(),
+}
+
+def get_shell():
+    shell = InteractiveShell.instance()
+    shell.run_cell("import time as _bench_time", store_history=False)
+    return shell
+
+def run_cell(shell, code):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = shell.run_cell(code, store_history=True)
+    if result.error_in_exec is not None: raise result.error_in_exec
+
+class EventTimer():
+    """ Time the event handlers registered between the first and the last handler of this object """
+    def __init__(self, shell, event):
+        self.shell, self.event = shell, event
+        self.times = []
+    def first(self, *args): self.start = time.perf_counter()
+    def last(self,  *args): self.times.append(time.perf_counter() - self.start)
+    def register_first(self): self.shell.events.register(self.event, self.first)
+    def register_last(self):  self.shell.events.register(self.event, self.last)
+    def unregister(self):
+        self.shell.events.unregister(self.event, self.first)
+        self.shell.events.unregister(self.event, self.last)
+
+def bench(shell, workload, config, repeat, warmup):
+    setup, code = workloads[workload]
+    kwargs = configs[config]
+
+    run_cell(shell, setup)
+
+    timers = [EventTimer(shell, 'pre_run_cell'), EventTimer(shell, 'post_run_cell')]
+    for t in timers: t.register_first()
+    exp = None
+    if kwargs is not None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            exp = IPyExperimentsCPU(**kwargs)
+        shell.user_ns['bench_exp'] = exp
+        if exp.enable: exp.keep_var_names('np')
+    for t in timers: t.register_last()
+
+    cell_times, sampler_cpu = [], []
+    for i in range(warmup + repeat):
+        for t in timers: t.times = []
+        start = time.perf_counter()
+        run_cell(shell, code)
+        cell_time = time.perf_counter() - start
+        if i < warmup: continue
+        cell_times.append(cell_time)
+        if exp is not None and exp.cl is not None:
+            sampler_cpu.append(sum(exp.cl.peak_monitor_usage[:2]))
+    pre_latency  = [t for t in timers[0].times]
+    post_latency = [t for t in timers[1].times]
+
+    finish_time = None
+    for t in timers: t.unregister()
+    if exp is not None:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            exp.finish()
+        if exp.enable: finish_time = time.perf_counter() - start
+        del shell.user_ns['bench_exp']
+    shell.user_ns.pop('bench_heap', None)
+
+    median = lambda x: statistics.median(x) if x else 0
+    return dict(
+        workload     = workload,
+        config       = config,
+        repeat       = repeat,
+        cell_time    = median(cell_times),
+        pre_latency  = median(pre_latency),
+        post_latency = median(post_latency),
+        sampler_cpu  = median(sampler_cpu),
+        finish_time  = finish_time,
+    )
+
+def has_numpy():
+    try:
+        import numpy
+        return True
+    except ImportError:
+        return False
+
+def run(workload_names, config_names, repeat, warmup):
+    shell = get_shell()
+    results = []
+    for workload in workload_names:
+        if workload == 'numpy_alloc' and not has_numpy():
+            print(f"skipping {workload}: numpy is not installed", file=sys.stderr)
+            continue
+        baseline = None
+        for config in config_names:
+            r = bench(shell, workload, config, repeat, warmup)
+            if config == 'baseline': baseline = r['cell_time']
+            r['slowdown'] = r['cell_time'] / baseline if baseline else None
+            results.append(r)
+            print_result(r)
+    return results
+
+def fmt_ms(x): return f"{x*1000:9.2f}" if x is not None else f"{'-':>9}"
+
+def print_header():
+    print(f"{'workload':<14} {'config':<15} {'cell ms':>9} {'slowdown':>8} {'pre ms':>9} {'post ms':>9} {'sampler ms':>10} {'finish ms':>9}")
+
+def print_result(r):
+    slowdown = f"{r['slowdown']:7.2f}x" if r['slowdown'] else f"{'-':>8}"
+    print(f"{r['workload']:<14} {r['config']:<15} {fmt_ms(r['cell_time'])} {slowdown} {fmt_ms(r['pre_latency'])}"
+          f" {fmt_ms(r['post_latency'])} {fmt_ms(r['sampler_cpu']):>10} {fmt_ms(r['finish_time'])}")
+
+def compare(results, prev_path):
+    """ Print the ratio of each metric vs. the same workload/config of a previous run """
+    prev = {(r['workload'], r['config']): r for r in json.loads(Path(prev_path).read_text())['results']}
+    keys = ['cell_time', 'pre_latency', 'post_latency', 'sampler_cpu', 'finish_time']
+    print(f"\nCompared to {prev_path} (new/old):")
+    print(f"{'workload':<14} {'config':<15} " + " ".join(f"{k:>12}" for k in keys))
+    for r in results:
+        p = prev.get((r['workload'], r['config']))
+        if p is None: continue
+        ratios = [f"{r[k]/p[k]:11.2f}x" if r[k] and p.get(k) else f"{'-':>12}" for k in keys]
+        print(f"{r['workload']:<14} {r['config']:<15} " + " ".join(ratios))
+
+def main():
+    parser = argparse.ArgumentParser(description="ipyexperiments overhead benchmarks")
+    parser.add_argument('--repeat',    type=int, default=5, help="measured runs of each cell")
+    parser.add_argument('--warmup',    type=int, default=1, help="unmeasured runs of each cell")
+    parser.add_argument('--workloads', nargs='+', default=list(workloads), choices=list(workloads))
+    parser.add_argument('--configs',   nargs='+', default=list(configs), choices=list(configs))
+    parser.add_argument('--output',    help="save the results to this json file")
+    parser.add_argument('--compare',   help="compare against the results saved in this json file")
+    args = parser.parse_args()
+
+    # slowdown is relative to the baseline, so always run it first
+    config_names = ['baseline'] + [c for c in args.configs if c != 'baseline']
+
+    print_header()
+    results = run(args.workloads, config_names, args.repeat, args.warmup)
+
+    if args.compare: compare(results, args.compare)
+
+    if args.output:
+        meta = dict(
+            ipyexperiments = ipyexperiments.__version__,
+            python         = platform.python_version(),
+            platform       = platform.platform(),
+            cpu_count      = os.cpu_count(),
+            time           = time.strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        Path(args.output).write_text(json.dumps(dict(meta=meta, results=results), indent=2))
+        print(f"\nsaved the results to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,11 @@
 from .ipyexperiments import IPyExperiments, IPyExperimentsCPU, IPyExperimentsGPU, IPyExperimentsPytorch
+from .cell_bench import cell_bench, CellBenchMagics
+from .measure import measure
+from .process_monitor import ProcessMonitor
 from .version import __version__
+__all__ = ['IPyExperiments', 'IPyExperimentsCPU', 'IPyExperimentsGPU', 'IPyExperimentsPytorch', 'cell_bench', 'measure',
+           'ProcessMonitor', '__version__']
+
+def load_ipython_extension(ipython):
+    " %load_ext ipyexperiments - registers the %%ipyexp_bench cell magic "
+    ipython.register_magics(CellBenchMagics)
@@ -0,0 +1,127 @@
+""" Repeat-and-measure benchmarking of a cell or a function """
+
+import statistics
+from collections import namedtuple
+from IPython.core.magic import Magics, magics_class, cell_magic
+from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+from .cell_logger import CellLogger, b2mb, int2width
+
+CellBenchStats  = namedtuple('CellBenchStats', ['min', 'median', 'mean', 'stddev'])
+CellBenchMemory = namedtuple('CellBenchMemory', ['used_delta', 'peaked_delta', 'growth', 'leak'])
+CellBenchData   = namedtuple('CellBenchData', ['cpu', 'gpu', 'time', 'runs'])
+
+def bench_stats(vals):
+    " min/median/mean/stddev of a non-empty sequence of numbers "
+    stddev = statistics.stdev(vals) if len(vals) > 1 else 0
+    return CellBenchStats(min(vals), statistics.median(vals), statistics.mean(vals), stddev)
+
+def bench_growth(used_totals):
+    " least squares slope of used memory per run (bytes per run) "
+    n = len(used_totals)
+    if n < 2: return 0
+    x_mean = (n - 1) / 2
+    y_mean = sum(used_totals) / n
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in enumerate(used_totals))
+    sxx = sum((x - x_mean) ** 2 for x in range(n))
+    return sxy / sxx
+
+def bench_memory(mems, leak_mbs=1):
+    """
+    Aggregate a list of CellLoggerMemory from repeated runs into CellBenchMemory.
+
+    A run-to-run growth of more than `leak_mbs` that happened in every run is
+    flagged as a likely leak, rather than being treated as noise.
+    """
+    used_deltas = [m.used_delta for m in mems]
+    growth = bench_growth([m.used_total for m in mems])
+    leak = len(mems) > 1 and min(used_deltas) > 0 and growth >= leak_mbs * 2**20
+    return CellBenchMemory(bench_stats(used_deltas), bench_stats([m.peaked_delta for m in mems]), growth, leak)
+
+def cell_bench(func, repeat=5, warmup=1, exp=None, gc_collect=True, set_seed=0, leak_mbs=1, verbose=True):
+    """ Run `func` `warmup` times unmeasured and then `repeat` times measured.
+
+    Parameters:
+    * func          - a callable with no arguments
+    * repeat=5      - number of measured runs
+    * warmup=1      - number of unmeasured runs to do first (imports, caches, allocator growth)
+    * exp=None      - an IPyExperiments object to take the backend from (CPU-only if None)
+    * gc_collect    - gc_collect at the end of each run before mem measurement
+    * set_seed=0    - set RNG seed before each run to the provided value
+    * leak_mbs=1    - flag as a likely leak if memory grew by at least so many MBs in every run
+    * verbose=True  - print the report
+
+    Each run is measured by the same machinery as `CellLogger` does a cell.
+
+    Returns a `CellBenchData` with the min/median/mean/stddev stats and the
+    `CellLoggerData` of each run.
+    """
+    if repeat < 1: raise ValueError("repeat must be at least 1")
+
+    cl = CellLogger(exp=exp, gc_collect=gc_collect, set_seed=set_seed)
+
+    for _ in range(warmup): func()
+
+    runs = []
+    for _ in range(repeat):
+        cl.measure_start()
+        try:
+            func()
+        finally:
+            cl.measure_stop()
+        runs.append(cl.data)
+
+    data = CellBenchData(
+        bench_memory([r.cpu for r in runs], leak_mbs),
+        bench_memory([r.gpu for r in runs], leak_mbs),
+        bench_stats([r.time.time_delta for r in runs]),
+        runs,
+    )
+
+    if verbose: print_bench_report(data, warmup, has_gpu=(cl.backend == "pytorch"))
+
+    return data
+
+def print_bench_report(data, warmup, has_gpu=False):
+    rows = [('CPU', data.cpu)]
+    if has_gpu: rows += [('GPU', data.gpu)]
+
+    vals = [v for _, m in rows for v in (*m.used_delta, *m.peaked_delta)]
+    w = int2width(*map(b2mb, vals)) + 1 # some air
+    if w < 10: w = 10 # accommodate header width
+    pre = '･ '
+    print(f"{pre}Bench: {len(data.runs)} runs after {warmup} warmup runs")
+    print(f"{pre}{'':11} {'Min':>{w}} {'Median':>{w}} {'Mean':>{w}} {'Stddev':>{w}}")
+    print(f"{pre}{'Time:':11} " + " ".join(f"{x:{w}.3f}" for x in data.time) + " secs")
+    for name, m in rows:
+        print(f"{pre}{name+' △Cons:':11} " + " ".join(f"{b2mb(x):{w},.0f}" for x in m.used_delta) + " MB")
+        print(f"{pre}{name+' △Peak:':11} " + " ".join(f"{b2mb(x):{w},.0f}" for x in m.peaked_delta) + " MB")
+    for name, m in rows:
+        if m.leak:
+            print(f"{pre}{name}: likely leak: memory grew in every run, by {b2mb(m.growth):,} MB per run")
+
+
+@magics_class
+class CellBenchMagics(Magics):
+
+    @magic_arguments()
+    @argument('-n', '--repeat', type=int, default=5, help="number of measured runs")
+    @argument('-w', '--warmup', type=int, default=1, help="number of unmeasured warmup runs")
+    @argument('-e', '--exp', default=None, help="name of the experiment variable to take the backend from")
+    @argument('-l', '--leak-mbs', type=int, default=1, help="min growth per run in MBs to flag a likely leak")
+    @argument('-o', '--output', action='store_true', help="return the CellBenchData object")
+    @cell_magic
+    def ipyexp_bench(self, line, cell):
+        """ Benchmark the cell's time and memory usage over repeated runs
+
+        Usage:
+        %%ipyexp_bench -n 10 -w 2
+        ...
+        """
+        args = parse_argstring(self.ipyexp_bench, line)
+        exp = self.shell.user_ns[args.exp] if args.exp else None
+
+        code = compile(self.shell.transform_cell(cell), '<ipyexp_bench>', 'exec')
+        user_ns = self.shell.user_ns
+        data = cell_bench(lambda: exec(code, user_ns), repeat=args.repeat, warmup=args.warmup,
+                          exp=exp, leak_mbs=args.leak_mbs)
+        if args.output: return data
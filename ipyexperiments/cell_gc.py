@@ -0,0 +1,65 @@
+""" Garbage collector pauses of a cell via gc.callbacks """
+
+import gc
+import time
+from collections import namedtuple
+
+CellLoggerGCGeneration = namedtuple('CellLoggerGCGeneration', ['count', 'pause_total', 'pause_max',
+                                                               'collected', 'uncollectable'])
+CellLoggerGC           = namedtuple('CellLoggerGC', ['count', 'pause_total', 'pause_max', 'generations'])
+
+class CellGC():
+    """ Aggregate the gc collections that happen during a cell
+
+    The callback runs on each collection, which in allocation heavy code is
+    very often, so it only updates the per-generation counters in place
+    rather than recording each collection.
+
+    Only the collections between start() and stop() are seen.
+    """
+
+    generations = 3
+
+    def __init__(self):
+        self.registered  = False
+        self.pause_start = 0
+        self.counts        = [0] * self.generations
+        self.pause_totals  = [0.0] * self.generations
+        self.pause_maxs    = [0.0] * self.generations
+        self.collected     = [0] * self.generations
+        self.uncollectable = [0] * self.generations
+
+    def start(self):
+        if self.registered: return
+        gc.callbacks.append(self.callback)
+        self.registered = True
+
+    def stop(self):
+        if not self.registered: return
+        try: gc.callbacks.remove(self.callback)
+        except ValueError: pass # removed by someone else
+        self.registered = False
+
+    def callback(self, phase, info):
+        if phase == "start":
+            self.pause_start = time.perf_counter()
+            return
+        pause = time.perf_counter() - self.pause_start
+        gen = info["generation"]
+        self.counts[gen]        += 1
+        self.pause_totals[gen]  += pause
+        if pause > self.pause_maxs[gen]: self.pause_maxs[gen] = pause
+        self.collected[gen]     += info["collected"]
+        self.uncollectable[gen] += info["uncollectable"]
+
+    def cell_start(self):
+        for i in range(self.generations):
+            self.counts[i] = self.collected[i] = self.uncollectable[i] = 0
+            self.pause_totals[i] = self.pause_maxs[i] = 0.0
+
+    def cell_stop(self):
+        """ Return CellLoggerGC with the collections since cell_start(), or None if not registered """
+        if not self.registered: return None
+        gens = [CellLoggerGCGeneration(*vals) for vals in
+                zip(self.counts, self.pause_totals, self.pause_maxs, self.collected, self.uncollectable)]
+        return CellLoggerGC(sum(self.counts), sum(self.pause_totals), max(self.pause_maxs), gens)
@@ -0,0 +1,167 @@
+""" Columnar store of the measurements of all the logged cells """
+
+import time
+from array import array
+from collections import namedtuple
+
+# column: array typecode, the sources are stored as ids into the interned `sources` list
+columns = dict(
+    execution_count  = 'q',
+    source           = 'l',
+    timestamp        = 'd',
+    time_delta       = 'd',
+    cpu_used_delta   = 'q',
+    cpu_peaked_delta = 'q',
+    cpu_used_peak    = 'q',
+    cpu_used_total   = 'q',
+    gpu_used_delta   = 'q',
+    gpu_peaked_delta = 'q',
+    gpu_used_peak    = 'q',
+    gpu_used_total   = 'q',
+    cpu_user         = 'd',
+    cpu_system       = 'd',
+    ctx_voluntary    = 'q',
+    ctx_involuntary  = 'q',
+    faults_minor     = 'q',
+    faults_major     = 'q',
+    io_read_bytes    = 'q',
+    io_write_bytes   = 'q',
+    io_rchar         = 'q',
+    io_wchar         = 'q',
+    gc_count         = 'q',
+    gc_pause         = 'd',
+    idle_cpu_drift   = 'q',
+    swap_used        = 'q',
+    stall_some       = 'd',
+    stall_full       = 'd',
+)
+
+# one row of CellHistory, created on access only
+CellHistoryRow = namedtuple('CellHistoryRow', list(columns))
+
+class CellHistory():
+    """ The measurements of all the logged cells, one typed array per column
+
+    Each cell adds one value to each of the `array.array` columns, which grow
+    geometrically, and its first source line is interned, so that re-running
+    the same cells in a loop costs about 200 bytes per cell and no python
+    objects are retained per cell. The measurements that weren't taken (e.g.
+    the I/O where it's not supported) are stored as 0, and the cells run
+    without an execution count (`store_history=False`, e.g. by the debugger or
+    the extensions) with the execution count -1.
+
+    Rows are created on access: `history[-1]` is a `CellHistoryRow`, slicing,
+    filter() and sort() return a new CellHistory.
+
+    `column(name)` and `to_numpy()` share the memory of the columns, when a
+    column is exported like that and the history grows, the column is copied
+    before it's appended to, so the exported arrays stay valid.
+    """
+
+    def __init__(self):
+        self.cols      = {name: array(tc) for name, tc in columns.items()}
+        self.sources   = []
+        self.source_id = {}
+
+    def __len__(self): return len(self.cols['execution_count'])
+
+    def __iter__(self): return (self.row(i) for i in range(len(self)))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice): return self.take(range(len(self))[i])
+        return self.row(range(len(self))[i])
+
+    def __repr__(self): return f"<{self.__class__.__name__}: {len(self)} cells>"
+
+    def row(self, i):
+        vals = [self.cols[name][i] for name in columns]
+        vals[1] = self.sources[vals[1]]
+        return CellHistoryRow(*vals)
+
+    def intern(self, source):
+        if source not in self.source_id:
+            self.source_id[source] = len(self.sources)
+            self.sources.append(source)
+        return self.source_id[source]
+
+    def append_row(self, row):
+        """ Append a CellHistoryRow (or any sequence of the values in the `columns` order) """
+        for (name, col), val in zip(self.cols.items(), row):
+            if name == 'source': val = self.intern(val)
+            try:
+                col.append(val)
+            except BufferError: # exported via column() or to_numpy()
+                col = self.cols[name] = array(col.typecode, col)
+                col.append(val)
+
+    def append(self, record, data):
+        """ Append the cell's CellLoggerRecord and CellLoggerData """
+        pr, io, gc, idle, mp = data.process, data.io, data.gc, data.idle, data.pressure
+        self.append_row((
+            -1 if record.execution_count is None else record.execution_count, record.source, time.time(), record.time_delta,
+            record.cpu_used_delta, record.cpu_peaked_delta, record.cpu_used_peak, data.cpu.used_total,
+            record.gpu_used_delta, record.gpu_peaked_delta, record.gpu_used_peak, data.gpu.used_total,
+            pr.cpu_user, pr.cpu_system, pr.ctx_voluntary, pr.ctx_involuntary, pr.faults_minor, pr.faults_major,
+            *((io.read_bytes, io.write_bytes, io.rchar, io.wchar) if io else (0, 0, 0, 0)),
+            *((gc.count, gc.pause_total) if gc else (0, 0)),
+            idle.cpu_drift if idle else 0,
+            *((mp.swap_used, mp.some_stall, mp.full_stall) if mp else (0, 0, 0)),
+        ))
+
+    def take(self, indices):
+        """ Return a new CellHistory with the rows at `indices`, in that order """
+        history = self.__class__()
+        history.sources, history.source_id = self.sources, self.source_id # shared, only ever appended to
+        for name, col in self.cols.items():
+            history.cols[name] = array(col.typecode, (col[i] for i in indices))
+        return history
+
+    def column(self, name):
+        """ Return the values of the column, the source ids are resolved to the sources """
+        if name == 'source': return [self.sources[i] for i in self.cols['source']]
+        return memoryview(self.cols[name])
+
+    # query helpers
+
+    def filter(self, predicate):
+        """ Return a new CellHistory with the rows for which predicate(row) is true, e.g.:
+
+        exp.history.filter(lambda r: r.cpu_used_delta > 2**30)
+        """
+        return self.take([i for i, row in enumerate(self) if predicate(row)])
+
+    def sort(self, name, reverse=False):
+        """ Return a new CellHistory sorted by the column `name` """
+        col = self.column(name)
+        return self.take(sorted(range(len(self)), key=col.__getitem__, reverse=reverse))
+
+    def top(self, name, n=5):
+        """ Return a new CellHistory with the `n` rows with the biggest values of the column `name` """
+        return self.sort(name, reverse=True)[:n]
+
+    def group_by(self, name='source'):
+        """ Return {value: CellHistory} of the rows grouped by the values of the column `name` """
+        groups = {}
+        for i, val in enumerate(self.column(name)): groups.setdefault(val, []).append(i)
+        return {val: self.take(indices) for val, indices in groups.items()}
+
+    def sum(self, name):  return sum(self.cols[name])
+    def min(self, name):  return min(self.cols[name], default=None)
+    def max(self, name):  return max(self.cols[name], default=None)
+    def mean(self, name): return self.sum(name) / len(self) if len(self) else None
+
+    # export
+
+    def to_numpy(self):
+        """ Return {column: numpy array}, sharing the memory of the columns, except for `source` """
+        import numpy as np
+        # frombuffer() of an empty buffer fails in older numpy versions
+        arrays = {name: np.frombuffer(col, dtype=col.typecode) if len(col) else np.array([], dtype=col.typecode)
+                  for name, col in self.cols.items()}
+        arrays['source'] = np.array(self.column('source'), dtype=object)
+        return arrays
+
+    def to_pandas(self):
+        """ Return a pandas DataFrame with a row per cell """
+        import pandas as pd
+        return pd.DataFrame(self.to_numpy(), columns=list(columns), copy=False)
@@ -0,0 +1,82 @@
+""" Memory drift tracking while the notebook is idle between cells """
+
+import threading
+import time
+from collections import deque, namedtuple
+
+CellLoggerIdleSample = namedtuple('CellLoggerIdleSample', ['execution_count', 'time', 'cpu_used', 'gpu_used'])
+CellLoggerIdle       = namedtuple('CellLoggerIdle', ['time_delta', 'cpu_drift', 'cpu_peaked_drift',
+                                                     'gpu_drift', 'gpu_peaked_drift'])
+
+class CellIdle():
+    """ Sample the memory usage at a low rate while no cell is running
+
+    Memory that grows between cells (background threads, async tasks,
+    prefetchers, callbacks) would otherwise be attributed to the next cell.
+
+    Parameters:
+    * mem_used          - a callable returning the (cpu, gpu) used memory in bytes, called from the sampler thread
+    * interval=1        - secs between samples
+    * max_samples=3600  - number of samples kept in `timeline`, the oldest are dropped first
+
+    `timeline` holds `CellLoggerIdleSample` entries of all the idle periods,
+    each tagged with the execution count of the cell the idle period followed.
+    """
+
+    def __init__(self, mem_used, interval=1, max_samples=3600):
+        self.mem_used = mem_used
+        self.interval = interval
+        self.timeline = deque(maxlen=max_samples)
+
+        self.stopping        = threading.Event()
+        self.thread          = None
+        self.execution_count = None
+        self.time_start      = 0
+        self.used_start      = (0, 0)
+        self.used_peak       = (0, 0)
+
+    def add_sample(self, used):
+        self.timeline.append(CellLoggerIdleSample(self.execution_count, time.time(), *used))
+        self.used_peak = tuple(max(p, u) for p, u in zip(self.used_peak, used))
+
+    def idle_start(self, execution_count):
+        """ Start sampling, called when a cell has finished """
+        self.stop()
+        self.execution_count = execution_count
+        self.used_start = self.used_peak = self.mem_used()
+        self.add_sample(self.used_start)
+        self.time_start = time.perf_counter()
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sampler_func, name="ipyexperiments-idle")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def idle_stop(self):
+        """ Stop sampling and return CellLoggerIdle with the drift since idle_start(), or None if not sampling """
+        if self.thread is None: return None
+        self.stop()
+        time_delta = time.perf_counter() - self.time_start
+        used = self.mem_used()
+        self.add_sample(used)
+
+        # same as with the cells, peaked_drift is the temporary overhead above the drift
+        drifts, peaked_drifts = [], []
+        for u, p, s in zip(used, self.used_peak, self.used_start):
+            drift, peaked_drift = u - s, max(0, p - s)
+            if drift > 0: peaked_drift = max(0, peaked_drift - drift)
+            drifts.append(drift)
+            peaked_drifts.append(peaked_drift)
+
+        return CellLoggerIdle(time_delta, drifts[0], peaked_drifts[0], drifts[1], peaked_drifts[1])
+
+    def stop(self):
+        """ Stop the sampler thread if it's running """
+        if self.thread is None: return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def sampler_func(self):
+        while not self.stopping.wait(self.interval):
+            self.add_sample(self.mem_used())
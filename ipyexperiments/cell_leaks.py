@@ -0,0 +1,101 @@
+""" Memory leak trends of the cells that are executed repeatedly """
+
+import math
+from collections import OrderedDict, namedtuple
+
+# the trend of one device's memory across the re-executions of the same cell source
+# * used_delta_mean/stderr  - the mean consumed memory per run and its standard error
+# * used_total_slope/stderr - the growth of the used memory after the cell per run (least squares) and its standard error
+CellLoggerLeakTrend = namedtuple('CellLoggerLeakTrend', ['used_delta_mean', 'used_delta_stderr',
+                                                         'used_total_slope', 'used_total_slope_stderr', 'leaking'])
+CellLoggerLeak      = namedtuple('CellLoggerLeak', ['runs', 'cpu', 'gpu'])
+
+class LeakTrend():
+    """ Running statistics of one device's memory across the runs of one cell, of a fixed size
+
+    Welford's online updates of the mean and variance of the consumed memory,
+    and of the covariance of the used memory with the run number for the slope.
+    """
+
+    __slots__ = ('n', 'delta_mean', 'delta_m2', 'x_mean', 'x_m2', 'y_mean', 'y_m2', 'xy_c')
+
+    def __init__(self):
+        self.n = 0
+        self.delta_mean = self.delta_m2 = 0.0
+        self.x_mean = self.x_m2 = self.y_mean = self.y_m2 = self.xy_c = 0.0
+
+    def update(self, used_delta, used_total):
+        self.n += 1
+        n = self.n
+
+        d = used_delta - self.delta_mean
+        self.delta_mean += d / n
+        self.delta_m2   += d * (used_delta - self.delta_mean)
+
+        x, y = n, used_total
+        dx, dy = x - self.x_mean, y - self.y_mean
+        self.x_mean += dx / n
+        self.y_mean += dy / n
+        self.x_m2   += dx * (x - self.x_mean)
+        self.y_m2   += dy * (y - self.y_mean)
+        self.xy_c   += dx * (y - self.y_mean)
+
+    def trend(self, min_bytes, confidence):
+        """ Return CellLoggerLeakTrend, leaking if both statistics are above min_bytes by `confidence` stderrs
+
+        The used memory also grows when other cells leak, and the consumed
+        memory may be freed by the other cells, so it takes both to tell.
+        """
+        n = self.n
+        delta_stderr = math.sqrt(self.delta_m2 / (n - 1) / n) if n > 1 else math.inf
+
+        slope, slope_stderr = 0.0, math.inf
+        if n > 1 and self.x_m2:
+            slope = self.xy_c / self.x_m2
+            if n > 2:
+                residual = max(0.0, self.y_m2 - slope * self.xy_c) / (n - 2)
+                slope_stderr = math.sqrt(residual / self.x_m2)
+
+        significant = lambda val, stderr: val >= min_bytes and val > confidence * stderr
+        leaking = significant(self.delta_mean, delta_stderr) and significant(slope, slope_stderr)
+        return CellLoggerLeakTrend(self.delta_mean, delta_stderr, slope, slope_stderr, leaking)
+
+class CellLeaks():
+    """ Fit a running trend of the memory of each distinct cell source across its re-executions
+
+    Parameters:
+    * min_runs=5         - don't report before the same source has run so many times
+    * min_bytes=2**20    - the smallest leak per run to report
+    * confidence=3       - how many standard errors the leak per run has to be above 0
+    * max_cells=10000    - number of distinct sources to keep the state of, the least recently run are dropped first
+
+    The cells are keyed by the hash of their source, so editing a cell
+    starts a new trend. The first run of each source is not part of the trend,
+    since it usually builds the state (variables, caches) the later runs reuse.
+    """
+
+    def __init__(self, min_runs=5, min_bytes=2**20, confidence=3, max_cells=10000):
+        self.min_runs   = min_runs
+        self.min_bytes  = min_bytes
+        self.confidence = confidence
+        self.max_cells  = max_cells
+        self.cells      = OrderedDict() # source hash: [runs, cpu LeakTrend, gpu LeakTrend]
+
+    def update(self, source, cpu_used_delta, cpu_used_total, gpu_used_delta=None, gpu_used_total=None):
+        """ Add a run of the source, return CellLoggerLeak once it ran min_runs times, None otherwise """
+        key = hash(source)
+        state = self.cells.get(key)
+        if state is None:
+            state = self.cells[key] = [0, LeakTrend(), LeakTrend() if gpu_used_delta is not None else None]
+            if len(self.cells) > self.max_cells: self.cells.popitem(last=False)
+        else:
+            self.cells.move_to_end(key)
+            state[1].update(cpu_used_delta, cpu_used_total)
+            if state[2] is not None: state[2].update(gpu_used_delta, gpu_used_total)
+        state[0] += 1
+
+        runs, cpu, gpu = state
+        # the slope's stderr needs 3 runs after the first one
+        if runs < max(self.min_runs, 4): return None
+        return CellLoggerLeak(runs, cpu.trend(self.min_bytes, self.confidence),
+                              gpu.trend(self.min_bytes, self.confidence) if gpu is not None else None)
@@ -4,11 +4,17 @@ import datetime
 import gc
 import logging
 import os
-import psutil
 import random
 import sys
-import threading
-import time
+from .cell_gc import CellGC
+from .cell_history import CellHistory
+from .cell_leaks import CellLeaks
+from .cell_idle import CellIdle
+from .cell_sampler import sampler
+from .cell_threads import CellThreads, is_oversubscribed
+from .cell_tracemalloc import CellTracemalloc, CellTracemallocNumpy
+from .subscribers import Dispatcher
+from .utils.proc import cpu_ram_used, usage_delta, io_delta, own_io, pressure_scope
 
 logging.basicConfig(
     format="%(filename)s:%(lineno)s - %(funcName)20s() | %(message)s",
@@ -31,6 +37,53 @@ def secs2time(secs):
     msec = int(abs(secs-int(secs))*1000)
     return f'{datetime.timedelta(seconds=int(secs))}.{msec:03d}'
 
+def share2pct(share, decimals=2):
+    " a share as percents, memory that isn't resident (e.g. untouched pages) can make it exceed 100% "
+    return f"{share*100:0.{decimals}f}%" if share <= 1 else ">100%"
+
+# the report lines shared by the cell logger and the process monitor
+
+def report_memory_compact(cpu, gpu=None):
+    " the CellLoggerMemory of the CPU and optionally of the GPU as 'Consumed/Peaked/Used Total' "
+    out  = f"CPU: {b2mb(cpu.used_delta):0.0f}/{b2mb(cpu.peaked_delta):0.0f}/{b2mb(cpu.used_total):0.0f} MB"
+    if gpu is not None:
+        out += f" | GPU: {b2mb(gpu.used_delta):0.0f}/{b2mb(gpu.peaked_delta):0.0f}/{b2mb(gpu.used_total):0.0f} MB"
+    return out
+
+def report_usage_compact(pr):
+    " the CellLoggerProcess counters on one line "
+    return (f"CPU time {pr.cpu_user:0.3f}/{pr.cpu_system:0.3f}s ({pr.cpu_util:0.2f} cores)"
+            f" | CtxSw {pr.ctx_voluntary:,}/{pr.ctx_involuntary:,} | PgFlt {pr.faults_minor:,}/{pr.faults_major:,}")
+
+def report_io_compact(io):
+    return f"I/O r/w {b2mb(io.rchar):0.0f}/{b2mb(io.wchar):0.0f} MB ({b2mb(io.rchar_rate):0.0f}/{b2mb(io.wchar_rate):0.0f} MB/s)"
+
+def report_memory_lines(pre, cpu, gpu, time_name, time_delta, time_extra=""):
+    " the RAM table of the CellLoggerMemory of the CPU and optionally of the GPU, with the time in the header "
+    vals = list(cpu) + (list(gpu) if gpu is not None else [])
+    w = int2width(*map(b2mb, vals)) + 1 # some air
+    if w < 10: w = 10 # accommodate header width
+    lines = [f"{pre}RAM: {'△Consumed':>{w}} {'△Peaked':>{w}}    {'Used Total':>{w}} | {time_name} {secs2time(time_delta)}{time_extra}"]
+    for name, mem in (("CPU", cpu), ("GPU", gpu)):
+        if mem is None: continue
+        lines.append(f"{pre}{name}: {b2mb(mem.used_delta):{w},.0f} {b2mb(mem.peaked_delta):{w},.0f} {b2mb(mem.used_total):{w},.0f} MB |")
+    return lines
+
+def report_usage_line(pre, pr):
+    return (f"{pre}CPU time: user {pr.cpu_user:0.3f}s, sys {pr.cpu_system:0.3f}s ({pr.cpu_util:0.2f} cores)"
+            f" | Ctx switches: {pr.ctx_voluntary:,} vol, {pr.ctx_involuntary:,} invol"
+            f" | Page faults: {pr.faults_minor:,} minor, {pr.faults_major:,} major")
+
+def report_io_line(pre, io):
+    return (f"{pre}I/O: storage read {b2mb(io.read_bytes):,.0f} MB ({b2mb(io.read_rate):,.0f} MB/s),"
+            f" write {b2mb(io.write_bytes):,.0f} MB ({b2mb(io.write_rate):,.0f} MB/s)"
+            f" | syscalls read {b2mb(io.rchar):,.0f} MB ({b2mb(io.rchar_rate):,.0f} MB/s, {io.syscr:,} calls),"
+            f" write {b2mb(io.wchar):,.0f} MB ({b2mb(io.wchar_rate):,.0f} MB/s, {io.syscw:,} calls)")
+
+def io_reportable(io):
+    " only report the I/O that moved at least 1MB, to not clutter the reports "
+    return io is not None and b2mb(max(io.read_bytes, io.write_bytes, io.rchar, io.wchar)) > 0
+
 def get_nvml_gpu_id(torch_gpu_id):
     """
     Remap torch device id to nvml device id, respecting CUDA_VISIBLE_DEVICES.
@@ -44,12 +97,27 @@ def get_nvml_gpu_id(torch_gpu_id):
     else:
         return torch_gpu_id
 
-process = psutil.Process()
-def cpu_ram_used():  return process.memory_info().rss
-
 CellLoggerMemory = namedtuple('CellLoggerMemory', ['used_delta', 'peaked_delta', 'used_total'])
 CellLoggerTime   = namedtuple('CellLoggerTime', ['time_delta'])
-CellLoggerData   = namedtuple('CellLoggerData', ['cpu', 'gpu', 'time'])
+CellLoggerProcess = namedtuple('CellLoggerProcess', ['cpu_user', 'cpu_system', 'cpu_util',
+                                                     'ctx_voluntary', 'ctx_involuntary', 'faults_minor', 'faults_major'])
+CellLoggerIO      = namedtuple('CellLoggerIO', ['read_bytes', 'write_bytes', 'rchar', 'wchar', 'syscr', 'syscw',
+                                               'read_rate', 'write_rate', 'rchar_rate', 'wchar_rate'])
+# the swap used by the process at the end of the cell and its change, the time the tasks stalled waiting for
+# memory during the cell (PSI 'some' and 'full', 0 where not available) and their share of the cell's time,
+# and whether the stalls are of the process' cgroup or of the system (None where not available)
+CellLoggerPressure = namedtuple('CellLoggerPressure', ['swap_used', 'swap_delta', 'some_stall', 'full_stall',
+                                                       'some_share', 'full_share', 'scope'])
+CellLoggerData   = namedtuple('CellLoggerData', ['cpu', 'gpu', 'time', 'process', 'io', 'threads', 'python', 'idle', 'gc', 'numpy', 'leak', 'pressure'])
+# compact per-cell record, passed to the subscribers and the trace, the history keeps its values in columns
+CellLoggerRecord = namedtuple('CellLoggerRecord', ['execution_count', 'source', 'time_delta',
+                                                   'cpu_used_delta', 'cpu_peaked_delta', 'cpu_used_peak',
+                                                   'gpu_used_delta', 'gpu_peaked_delta', 'gpu_used_peak'])
+
+def source_first_line(source, width=60):
+    " return the first non-empty line of the source, shortened to `width` chars "
+    line = next((l.strip() for l in (source or '').splitlines() if l.strip()), '')
+    return line if len(line) <= width else line[:width-3] + '...'
 
 def set_seed(seed=0):
     """
@@ -79,24 +147,71 @@ def set_seed(seed=0):
 # all the memory measurements functions come from IPyExperiments subclasses
 class CellLogger():
 
-    def __init__(self, exp=None, compact=False, gc_collect=True, set_seed=0):
+    # warn when the tasks stalled waiting for memory for at least this share of a cell's time,
+    # for cells running at least stall_warn_secs
+    stall_warn_share = 0.5
+    stall_warn_secs  = 1
+
+    def __init__(self, exp=None, compact=False, gc_collect=True, set_seed=0,
+                 tracemalloc_frames=0, tracemalloc_top=5, malloc_trim=False, io_children=False,
+                 threads=None, threads_interval=0, idle_interval=0, idle_samples=3600, gc_pauses=True,
+                 tracemalloc_numpy=False, trace=None, verbose=True, dispatcher=None, leak_runs=5, leak_bytes=2**20):
 
         # any subclass object of IPyExperiments that gives us access to its
-        # specific memory measurement functions
+        # specific memory measurement functions (CPU-only if there is none)
 
-        self.backend = exp.backend
+        self.backend = exp.backend if exp is not None else 'cpu'
 
         if self.backend == "pytorch":
             self.pynvml = exp.pynvml
             self.torch = exp.torch
             self.gpu_current_device_id = exp.gpu_current_device_id
 
+        self.verbose    = verbose    # print the report of each cell
         self.compact    = compact    # one line printouts
         self.gc_collect = gc_collect # don't use when tracking mem leaks
         self.set_seed   = set_seed   # set RNG seed before each cell is run to the provided value
-
-        self.peak_monitoring = False
-        self.running         = False
+        self.malloc_trim = malloc_trim # return freed memory to the OS after each cell
+        self.io_children = io_children # include the I/O of the child processes
+        self.io_data     = None
+        self.pressure_data = None
+
+        # per-thread CPU time, grouped by thread 'name' or 'id'
+        self.threads = CellThreads(threads, threads_interval) if threads else None
+        self.threads_data = None
+        self.cpu_mem_trimmed = 0
+
+        # hybrid RSS + tracemalloc mode: report python allocation sites next to RSS
+        self.tracemalloc = CellTracemalloc(tracemalloc_frames, tracemalloc_top) if tracemalloc_frames else None
+        self.python_data = None
+        # the same, but only for the numpy data buffers
+        self.tracemalloc_numpy = CellTracemallocNumpy(tracemalloc_frames or 5, tracemalloc_top) if tracemalloc_numpy else None
+        self.numpy_data = None
+
+        # a TraceEventWriter to export the cells and the memory counters to
+        self.trace = trace
+
+        # the subscribed sinks get each cell's measurements, the experiment shares its own dispatcher
+        self.dispatcher_owned = dispatcher is None
+        self.dispatcher = Dispatcher() if dispatcher is None else dispatcher
+
+        # low rate memory sampling between the cells, to report the drift while idle
+        self.idle = CellIdle(self.mem_used_fast, idle_interval, idle_samples) if idle_interval else None
+        self.idle_data = None
+
+        # the memory trend of the cells that are run repeatedly
+        self.leaks = CellLeaks(leak_runs, leak_bytes) if leak_runs else None
+        self.leak_data = None
+
+        # gc collections and their pauses during the cell
+        self.gc_pauses = CellGC() if gc_pauses else None
+        self.gc_data = None
+
+        # the shared sampler's peak memory window of the current cell and its thread's usage during it
+        self.window              = None
+        self.peak_monitor_usage  = (0, 0, 0, 0, 0, 0)
+        self.peak_monitor_tid    = None
+        self.running             = False
 
         self.time_start = 0
         self.time_delta = 0
@@ -118,9 +233,21 @@ class CellLogger():
         self.data = CellLoggerData(
             CellLoggerMemory(0, 0, 0),
             CellLoggerMemory(0, 0, 0),
-            CellLoggerTime(0)
+            CellLoggerTime(0),
+            CellLoggerProcess(0, 0, 0, 0, 0, 0, 0),
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None
         )
 
+        # the measurements of all the measured cells
+        self.history = CellHistory()
+
     # XXX: all this needs to be refactored - tired of hunting lock deadlocks, so just as well drop
     # the idea of having this extendable to other backends for now and just use it for pytorch
     def gpu_clear_cache(self): self.torch.cuda.empty_cache()
@@ -137,6 +264,22 @@ class CellLogger():
     # use cached handle and clear no cache
     def gpu_ram_used_fast(self, gpu_handle): return self.pynvml.nvmlDeviceGetMemoryInfo(gpu_handle).used
 
+    def mem_used_fast(self):
+        """ return cpu and gpu used RAM in bytes, without clearing the gpu cache (safe to call from other threads) """
+        if self.backend != "pytorch": return cpu_ram_used(), 0
+        handle = self.pynvml.nvmlDeviceGetHandleByIndex(get_nvml_gpu_id(self.gpu_current_device_id))
+        return cpu_ram_used(), self.gpu_ram_used_fast(handle)
+
+    def gpu_nvml_id(self):
+        """ return the nvml id of the current torch device """
+        return get_nvml_gpu_id(self.torch.cuda.current_device())
+
+    def gpu_used_reader(self):
+        """ return the nvml id of the current device and a fast used gpu RAM reader of it for the peak sampler """
+        nvml_gpu_id = self.gpu_nvml_id()
+        handle = self.pynvml.nvmlDeviceGetHandleByIndex(nvml_gpu_id)
+        return nvml_gpu_id, lambda: self.gpu_ram_used_fast(handle)
+
     def start(self):
         """Register memory profiling tools to IPython instance."""
         self.running = True
@@ -145,18 +288,22 @@ class CellLogger():
         # self.exp does it when needed
         #preload_pytorch()
 
+        if self.tracemalloc: self.tracemalloc.start()
+        if self.tracemalloc_numpy: self.tracemalloc_numpy.start()
+        if self.gc_pauses: self.gc_pauses.start()
+
         # initial measurements
         if self.gc_collect: gc.collect()
         self.cpu_mem_used_prev = cpu_ram_used()
         if self.backend == "pytorch":
             self.gpu_mem_used_prev = self.gpu_ram_used()
-        self.ipython.events.register("pre_run_cell",  self.pre_run_cell)
-        logger.debug(f"registered pre_run_cell: {self.pre_run_cell}")
-        self.ipython.events.register("post_run_cell", self.post_run_cell)
-        logger.debug(f"registered post_run_cell: {self.post_run_cell}")
+
+        # the ipython events are handled by the process-wide sampler, shared with the other running loggers
+        sampler.register(self)
+        logger.debug(f"registered with the sampler: {self}")
 
         # run pre_run_cell() manually, since we are past that event in this cell
-        self.pre_run_cell(None)
+        sampler.pre_run_cell(None, [self])
 
         return self
 
@@ -166,69 +313,134 @@ class CellLogger():
         if not self.running: return
         logger.debug("CellLogger: Stopping")
 
-        self.ipython.events.unregister("pre_run_cell",  self.pre_run_cell)
-        self.ipython.events.unregister("post_run_cell", self.post_run_cell)
-
-        # try: self.ipython.events.unregister("pre_run_cell",  self.pre_run_cell)
-        # except ValueError:
-        #     print("Failed to unregister: pre_run_cell ")
-        #     pass
-        # try: self.ipython.events.unregister("post_run_cell", self.post_run_cell)
-        # except ValueError:
-        #     print("Failed to unregister: pre_run_cell ")
-        #     pass
-        #if self.peak_monitor_thread and self.peak_monitor_thread.is_alive():
-        #    self.peak_monitor_thread._Thread__stop()
-
-        self.peak_monitoring = False
+        sampler.unregister(self)
 
         # run post_run_cell() manually, since it's no longer registered
-        self.post_run_cell(None)
+        sampler.post_run_cell(None, [self])
+
+        if self.idle: self.idle.stop()
+        if self.gc_pauses: self.gc_pauses.stop()
+        if self.tracemalloc_numpy: self.tracemalloc_numpy.stop()
+        if self.tracemalloc: self.tracemalloc.stop()
+        if self.dispatcher_owned: self.dispatcher.close()
 
         self.running = False
 
+    def subscribe(self, sink):
+        """ Call `sink` with a SubscriberEvent of each measured cell, from a background thread """
+        self.dispatcher.subscribe(sink)
 
+    def unsubscribe(self, sink):
+        self.dispatcher.unsubscribe(sink)
+
+
+    # called by the sampler before measure_start() and after measure_stop()
     def pre_run_cell(self, info):
+        # measured first, so that the idle drift doesn't include the start of the cell
+        self.idle_data = self.idle.idle_stop() if self.idle else None
+
+    def post_run_cell(self, result):
+        if self.leaks:
+            self.leak_data = self.leak_update(self.cell_source(result)[1])
+            self.data = self.data._replace(leak=self.leak_data)
+        if self.verbose: self.print_report()
+        record = self.record(result)
+        self.history.append(record, self.data)
+        self.dispatcher.publish('cell', record, self.data)
+        if self.trace: self.trace_cell(record)
+
+        if self.idle: self.idle.idle_start(record.execution_count)
+
+    def measure_start(self):
+        """ Take the start measurements and start the peak memory monitor """
+        sampler.measure_start([self])
+
+    def measure_stop(self):
+        """ Stop the peak memory monitor and calculate the deltas since measure_start() """
+        sampler.measure_stop([self])
+
+    # the following are called by the sampler, which takes the measurements shared
+    # by all the loggers once, in this order: measure_prepare, measure_baseline,
+    # (the cell runs), measure_counters, measure_memory
+
+    def measure_prepare(self):
+        """ The per-logger preparations before the start measurements """
         # seed reset
         if self.set_seed != 0: set_seed(self.set_seed)
 
-        self.cpu_mem_used_at_cell_start = cpu_ram_used()
-        if self.backend == "pytorch":
-            self.gpu_mem_used_at_cell_start = self.gpu_ram_used()
-
-        # XXX: perhaps can be replaced with using torch.cuda.reset_max_cached_memory() once pytorch 1.0.1 is released, will need to check that pytorch ver >= 1.0.1
-        #
-        # this thread samples RAM usage as long as the current cell is running
-        self.peak_monitoring = True
-        peak_monitor_thread = threading.Thread(target=self.peak_monitor_func)
-        peak_monitor_thread.daemon = True
-        peak_monitor_thread.start()
+        # the snapshot is taken first so that its own memory is part of the RSS baseline
+        if self.tracemalloc: self.tracemalloc.cell_start()
+        if self.tracemalloc_numpy: self.tracemalloc_numpy.cell_start()
 
-        # time before we execute the current cell
-        self.time_start = time.time()
+        if self.threads: self.threads.cell_start()
 
+    def measure_baseline(self, snapshot, window):
+        """ Set the baseline from the CellSamplerSnapshot at the cell start, the peaks come from the SamplerWindow """
+        self.window = window
+        self.cpu_mem_used_at_cell_start = snapshot.cpu_used
+        if self.backend == "pytorch":
+            self.gpu_mem_used_at_cell_start = snapshot.gpu_used[self.gpu_current_device_id]
+            self.gpu_peak_id = self.gpu_nvml_id()
+
+        # the snapshot may include the children of other loggers' processes
+        self.io_start    = snapshot.io if self.io_children else own_io(snapshot.io)
+        self.usage_start = snapshot.usage
+        self.pressure_start = snapshot.pressure
+        if self.gc_pauses: self.gc_pauses.cell_start()
+        self.time_start  = snapshot.time
+
+        if self.trace:
+            gpu_mem_used = self.gpu_mem_used_at_cell_start if self.backend == "pytorch" else None
+            self.trace.memory(self.cpu_mem_used_at_cell_start, gpu_mem_used, ts=self.time_start)
+
+    def measure_counters(self, end):
+        """ Calculate the time, usage and I/O deltas from the CellSamplerSnapshot at the cell end """
+        self.time_delta = end.time - self.time_start
+        # before the gc.collect() that follows
+        self.gc_data = self.gc_pauses.cell_stop() if self.gc_pauses else None
+        usage = usage_delta(end.usage, self.usage_start)
+        self.pressure_data = self.pressure_stats(end.pressure)
+
+        window, self.window = self.window, None
+        # the peak monitor thread's reads of /proc are excluded, like its usage below
+        io_end = end.io if self.io_children else own_io(end.io)
+        self.io_data = self.io_stats(io_end, window.io) if self.io_start else None
+        self.peak_monitor_usage = window.usage
+        self.peak_monitor_tid   = window.tid
+        self.cpu_mem_used_peak  = window.cpu_used_peak
+        if self.backend == "pytorch":
+            self.gpu_mem_used_peak = window.gpu_used_peak.get(self.gpu_peak_id, -1)
 
-    def post_run_cell(self, result):
-        if not self.running: return
-
-        # this sends a signal to peak_monitor_func to complete its loop
-        self.peak_monitoring = False
+        if self.threads:
+            self.threads_data = self.threads.cell_stop(exclude=(self.peak_monitor_tid,))
 
-        self.time_delta = time.time() - self.time_start
+        # the peak monitor thread is busy the whole cell, so its own usage is excluded
+        cpu_user, cpu_system, *counters = usage_delta(usage, self.peak_monitor_usage)
+        cpu_user, cpu_system = max(0, cpu_user), max(0, cpu_system)
+        cpu_util = (cpu_user + cpu_system) / self.time_delta if self.time_delta else 0
+        self.process_data = CellLoggerProcess(cpu_user, cpu_system, cpu_util, *(max(0, c) for c in counters))
 
-        if self.gc_collect: gc.collect()
+    def measure_memory(self, cpu_mem_used, gpu_mem_used, cpu_mem_trimmed):
+        """ Calculate the memory deltas from the used memory measured after gc.collect() and malloc_trim() """
+        self.cpu_mem_trimmed = cpu_mem_trimmed
 
         # tracemalloc was tried, but it misses all non-python memory allocations so it had to go
+        # as the main measurement - it's only used optionally next to RSS (see self.tracemalloc)
 
-        self.cpu_mem_used_new = cpu_ram_used()
+        self.cpu_mem_used_new = cpu_mem_used
         self.cpu_mem_used_delta = self.cpu_mem_used_new - self.cpu_mem_used_at_cell_start
         # see the logic for gpu below for details of the following
         self.cpu_mem_peaked_delta = max(0, self.cpu_mem_used_peak - self.cpu_mem_used_at_cell_start)
         if self.cpu_mem_used_delta > 0:
             self.cpu_mem_peaked_delta = max(0, self.cpu_mem_peaked_delta - self.cpu_mem_used_delta)
 
+        if self.tracemalloc:
+            self.python_data = self.tracemalloc.cell_stop(self.cpu_mem_used_delta)
+        if self.tracemalloc_numpy:
+            self.numpy_data = self.tracemalloc_numpy.cell_stop(self.cpu_mem_used_delta)
+
         if self.backend == "pytorch":
-            self.gpu_mem_used_new = self.gpu_ram_used()
+            self.gpu_mem_used_new = gpu_mem_used
 
             # delta_used is the difference between used mem at current vs. at cell start
             self.gpu_mem_used_delta = self.gpu_mem_used_new - self.gpu_mem_used_at_cell_start
@@ -249,28 +461,6 @@ class CellLogger():
             if self.gpu_mem_used_delta > 0:
                 self.gpu_mem_peaked_delta = max(0, self.gpu_mem_peaked_delta - self.gpu_mem_used_delta)
 
-
-        if self.compact:
-            if 1:
-                out  = f"CPU: {b2mb(self.cpu_mem_used_delta):0.0f}/{b2mb(self.cpu_mem_peaked_delta):0.0f}/{b2mb(self.cpu_mem_used_new):0.0f} MB"
-            if self.backend == "pytorch":
-                out += f" | GPU: {b2mb(self.gpu_mem_used_delta):0.0f}/{b2mb(self.gpu_mem_peaked_delta):0.0f}/{b2mb(self.gpu_mem_used_new):0.0f} MB"
-            out += f" | Time {secs2time(self.time_delta)} | (Consumed/Peaked/Used Total)"
-            print(out)
-        else:
-            if 1:
-                vals  = [self.cpu_mem_used_delta, self.cpu_mem_peaked_delta, self.cpu_mem_used_new]
-            if self.backend == "pytorch":
-                vals += [self.gpu_mem_used_delta, self.gpu_mem_peaked_delta, self.gpu_mem_used_new]
-            w = int2width(*map(b2mb, vals)) + 1 # some air
-            if w < 10: w = 10 # accommodate header width
-            pre = '･ '
-            print(f"{pre}RAM: {'△Consumed':>{w}} {'△Peaked':>{w}}    {'Used Total':>{w}} | Exec time {secs2time(self.time_delta)}")
-            if 1:
-                print(f"{pre}CPU: {b2mb(self.cpu_mem_used_delta):{w},.0f} {b2mb(self.cpu_mem_peaked_delta):{w},.0f} {b2mb(self.cpu_mem_used_new):{w},.0f} MB |")
-            if self.backend == "pytorch":
-                print(f"{pre}GPU: {b2mb(self.gpu_mem_used_delta):{w},.0f} {b2mb(self.gpu_mem_peaked_delta):{w},.0f} {b2mb(self.gpu_mem_used_new):{w},.0f} MB |")
-
         # for self.data accessor
         self.cpu_mem_used_prev = self.cpu_mem_used_new
         if self.backend == "pytorch":
@@ -279,29 +469,238 @@ class CellLogger():
         self.data = CellLoggerData(
             CellLoggerMemory(self.cpu_mem_used_delta, self.cpu_mem_peaked_delta, self.cpu_mem_used_prev),
             CellLoggerMemory(self.gpu_mem_used_delta, self.gpu_mem_peaked_delta, self.gpu_mem_used_prev),
-            CellLoggerTime(self.time_delta)
+            CellLoggerTime(self.time_delta),
+            self.process_data,
+            self.io_data,
+            self.threads_data,
+            self.python_data,
+            self.idle_data,
+            self.gc_data,
+            self.numpy_data,
+            None, # set by post_run_cell(), which knows the cell's source
+            self.pressure_data,
         )
 
-
-    def peak_monitor_func(self):
-        self.cpu_mem_used_peak = -1
-        self.gpu_mem_used_peak = -1
-
+    def io_stats(self, io_end, io_exclude):
+        """ Return CellLoggerIO with the deltas since the cell start, less `io_exclude`, and derived throughput in bytes/sec """
+        io = usage_delta(io_delta(io_end, self.io_start), io_exclude)
+        read_bytes, write_bytes, rchar, wchar, syscr, syscw = (max(0, c) for c in io)
+        rate = lambda x: x / self.time_delta if self.time_delta else 0
+        return CellLoggerIO(read_bytes, write_bytes, rchar, wchar, syscr, syscw,
+                            rate(read_bytes), rate(write_bytes), rate(rchar), rate(wchar))
+
+
+    def pressure_stats(self, pressure_end):
+        """ Return CellLoggerPressure with the swap and the memory stalls since the cell start """
+        swap_start, stalls_start = self.pressure_start
+        swap_end, stalls_end = pressure_end
+        some_stall = full_stall = 0
+        if stalls_start is not None and stalls_end is not None:
+            some_stall, full_stall = usage_delta(stalls_end, stalls_start)
+        share = lambda x: x / self.time_delta if self.time_delta else 0
+        return CellLoggerPressure(swap_end, swap_end - swap_start, some_stall, full_stall,
+                                  share(some_stall), share(full_stall), pressure_scope if stalls_end is not None else None)
+
+    def cell_source(self, result):
+        """ Return the execution count and the source of the last measured cell """
+        # result is None when called manually from stop(), result.info requires ipython>=7
+        if result is not None and getattr(result, 'info', None) is not None:
+            return result.execution_count, result.info.raw_cell
+        source = self.ipython.user_ns['In'][-1] if self.ipython.user_ns.get('In') else ''
+        return self.ipython.execution_count, source
+
+    def leak_update(self, source):
+        """ Add the last cell to the trend of its source, return CellLoggerLeak (None until it ran enough times) """
         if self.backend == "pytorch":
-            torch_gpu_id = self.torch.cuda.current_device()
-            nvml_gpu_id = get_nvml_gpu_id(torch_gpu_id)
-            handle = self.pynvml.nvmlDeviceGetHandleByIndex(nvml_gpu_id)
-
-        while True:
-            self.cpu_mem_used_peak = max(cpu_ram_used(), self.cpu_mem_used_peak)
-
-            if self.backend == "pytorch":
-                # no gc.collect, empty_cache here, since it has to be fast and we
-                # want to measure only the peak memory usage
-                gpu_mem_used = self.gpu_ram_used_fast(handle)
-                self.gpu_mem_used_peak = max(gpu_mem_used, self.gpu_mem_used_peak)
+            return self.leaks.update(source, self.cpu_mem_used_delta, self.cpu_mem_used_new,
+                                     self.gpu_mem_used_delta, self.gpu_mem_used_new)
+        return self.leaks.update(source, self.cpu_mem_used_delta, self.cpu_mem_used_new)
+
+    def leak_reportable(self):
+        leak = self.leak_data
+        return leak is not None and (leak.cpu.leaking or (leak.gpu is not None and leak.gpu.leaking))
+
+    def record(self, result):
+        """ Return the CellLoggerRecord of the last measured cell """
+        execution_count, source = self.cell_source(result)
+        return CellLoggerRecord(
+            execution_count, source_first_line(source), self.time_delta,
+            self.cpu_mem_used_delta, self.cpu_mem_peaked_delta, max(self.cpu_mem_used_peak, self.cpu_mem_used_new),
+            self.gpu_mem_used_delta, self.gpu_mem_peaked_delta, max(self.gpu_mem_used_peak, self.gpu_mem_used_prev),
+        )
 
-            # can't sleep or will not catch the peak right
-            # time.sleep(0.001) # 1msec
+    def trace_sample(self):
+        """ Write the current memory usage to the trace, called periodically by the sampler during the cell """
+        cpu_mem_used, gpu_mem_used = self.mem_used_fast()
+        self.trace.memory(cpu_mem_used, gpu_mem_used if self.backend == "pytorch" else None)
 
-            if not self.peak_monitoring: break
+    def trace_cell(self, record):
+        """ Write the last cell as a duration event, followed by the memory usage after it """
+        mb = lambda x: round(x/2**20, 1)
+        args = dict(cpu_used_delta_mb=mb(record.cpu_used_delta), cpu_peaked_delta_mb=mb(record.cpu_peaked_delta),
+                    cpu_used_peak_mb=mb(record.cpu_used_peak))
+        if self.backend == "pytorch":
+            args.update(gpu_used_delta_mb=mb(record.gpu_used_delta), gpu_peaked_delta_mb=mb(record.gpu_peaked_delta),
+                        gpu_used_peak_mb=mb(record.gpu_used_peak))
+        if self.gc_data: args.update(gc_collections=self.gc_data.count, gc_pause_secs=round(self.gc_data.pause_total, 6))
+        if self.idle_data: args.update(idle_cpu_drift_mb=mb(self.idle_data.cpu_drift))
+
+        self.trace.complete(f"In [{record.execution_count}]: {record.source}", "cell",
+                            self.time_start, self.time_delta, self.trace.tid_cells, args)
+        self.trace.memory(self.cpu_mem_used_new, self.gpu_mem_used_new if self.backend == "pytorch" else None)
+        self.trace.flush()
+
+    def print_report(self):
+        """ Print the measurements of the last measured cell """
+        d = self.data
+        gpu = d.gpu if self.backend == "pytorch" else None
+        if self.compact:
+            out = report_memory_compact(d.cpu, gpu)
+            if b2mb(self.cpu_mem_trimmed):
+                out += f" | Trimmed: {b2mb(self.cpu_mem_trimmed):0.0f} MB"
+            if self.python_data:
+                py = self.python_data
+                out += f" | Python: {b2mb(py.used_delta):0.0f}/{b2mb(py.peaked_delta):0.0f} MB ({share2pct(py.rss_share, 0)})"
+            if self.numpy_data:
+                np_ = self.numpy_data
+                out += f" | NumPy: {b2mb(np_.used_delta):0.0f}/{b2mb(np_.peaked_delta):0.0f} MB ({share2pct(np_.rss_share, 0)})"
+            out += f" | Time {secs2time(self.time_delta)}"
+            if self.gc_data and self.gc_data.count:
+                out += f" | GC {self.gc_data.pause_total:0.3f}s ({self.gc_data.count:,} collections)"
+            out += " | " + report_usage_compact(self.process_data)
+            if self.io_reportable():
+                out += " | " + report_io_compact(self.io_data)
+            if self.idle_reportable():
+                idle = self.idle_data
+                out += f" | Idle drift {b2mb(idle.cpu_drift):+0.0f}/{b2mb(idle.cpu_peaked_drift):0.0f} MB"
+                if self.backend == "pytorch":
+                    out += f", GPU {b2mb(idle.gpu_drift):+0.0f}/{b2mb(idle.gpu_peaked_drift):0.0f} MB"
+                out += f" in {secs2time(idle.time_delta)}"
+            if self.leak_reportable():
+                leak = self.leak_data
+                out += f" | Leak? CPU {b2mb(leak.cpu.used_delta_mean):+0.0f}/{b2mb(leak.cpu.used_total_slope):+0.0f} MB/run"
+                if leak.gpu is not None:
+                    out += f", GPU {b2mb(leak.gpu.used_delta_mean):+0.0f}/{b2mb(leak.gpu.used_total_slope):+0.0f} MB/run"
+                out += f" over {leak.runs} runs"
+            if self.pressure_reportable():
+                mp = self.pressure_data
+                out += f" | Swap {b2mb(mp.swap_used):0.0f}/{b2mb(mp.swap_delta):+0.0f} MB"
+                if mp.scope is not None:
+                    out += f" | Stall {mp.some_stall:0.3f}/{mp.full_stall:0.3f}s"
+            if self.threads_data:
+                th = self.threads_data
+                out += f" | Threads {th.parallelism:0.2f}x ({th.active}/{th.total} active)"
+            out += " | (Consumed/Peaked/Used Total)"
+            print(out)
+            if self.pressure_stalled():
+                self.print_stalled()
+            if self.threads_data and is_oversubscribed(self.threads_data):
+                self.print_oversubscribed()
+        else:
+            pre = '･ '
+            gc_time = f" | GC {self.gc_data.pause_total:0.3f}s" if self.gc_data and self.gc_data.count else ""
+            for line in report_memory_lines(pre, d.cpu, gpu, "Exec time", self.time_delta, gc_time): print(line)
+            print(report_usage_line(pre, self.process_data))
+            if self.gc_data and self.gc_data.count:
+                self.print_gc_report(pre)
+            if self.io_reportable():
+                print(report_io_line(pre, self.io_data))
+            if self.pressure_reportable():
+                self.print_pressure_report(pre)
+            if self.idle_reportable():
+                self.print_idle_report(pre)
+            if self.leak_reportable():
+                self.print_leak_report(pre)
+            if self.threads_data:
+                self.print_threads_report(pre)
+            if b2mb(self.cpu_mem_trimmed):
+                print(f"{pre}malloc_trim returned {b2mb(self.cpu_mem_trimmed):,.0f} MB to the OS")
+            if self.python_data:
+                self.print_tracemalloc_report(pre, "Python", self.python_data)
+            if self.numpy_data:
+                self.print_tracemalloc_report(pre, "NumPy", self.numpy_data)
+
+    def print_threads_report(self, pre):
+        """ Print the per-thread CPU time breakdown of the last cell """
+        th = self.threads_data
+        print(f"{pre}Threads: {th.parallelism:0.2f}x parallelism, {th.active} of {th.total} threads active")
+        w = max([len(g.name) for g in th.groups], default=0)
+        for g in th.groups:
+            print(f"{pre}  {g.name:<{w}}  user {g.cpu_user:8.3f}s, sys {g.cpu_system:8.3f}s"
+                  f" ({g.count} thread{'s' if g.count > 1 else ''})")
+        if is_oversubscribed(th): self.print_oversubscribed(pre)
+
+    def print_oversubscribed(self, pre=''):
+        print(f"{pre}Warning: more threads were busy than there are cores, check the thread pools for oversubscription")
+
+    def io_reportable(self): return io_reportable(self.io_data)
+
+    def pressure_reportable(self):
+        """ Only report the memory pressure if the process uses swap or the tasks stalled for at least 10ms """
+        pr = self.pressure_data
+        if pr is None: return False
+        return bool(b2mb(pr.swap_used) or b2mb(abs(pr.swap_delta)) or pr.some_stall >= 0.01)
+
+    def pressure_stalled(self):
+        """ Whether the cell's time was dominated by waiting for memory """
+        pr = self.pressure_data
+        return (pr is not None and self.time_delta >= self.stall_warn_secs
+                and pr.some_share >= self.stall_warn_share)
+
+    def print_pressure_report(self, pre):
+        """ Print the swap used by the process and the memory stalls during the last cell """
+        pr = self.pressure_data
+        out = f"{pre}Memory pressure: swap {b2mb(pr.swap_used):,.0f} MB ({b2mb(pr.swap_delta):+,.0f} MB)"
+        if pr.scope is not None:
+            out += (f" | stalls some {pr.some_stall:0.3f}s ({share2pct(pr.some_share)}),"
+                    f" full {pr.full_stall:0.3f}s ({share2pct(pr.full_share)}) ({pr.scope})")
+        print(out)
+        if self.pressure_stalled(): self.print_stalled(pre)
+
+    def print_stalled(self, pre=''):
+        pr = self.pressure_data
+        print(f"{pre}Warning: the {pr.scope}'s tasks stalled waiting for memory {share2pct(pr.some_share, 0)} of this"
+              f" cell's time, it was likely swapping or reclaiming memory")
+
+    def print_gc_report(self, pre):
+        """ Print the gc collections of the last cell per generation """
+        gens = [f"gen{i} {g.count:,} in {g.pause_total:0.3f}s (max {g.pause_max:0.3f}s)"
+                for i, g in enumerate(self.gc_data.generations) if g.count]
+        collected     = sum(g.collected for g in self.gc_data.generations)
+        uncollectable = sum(g.uncollectable for g in self.gc_data.generations)
+        print(f"{pre}GC: {', '.join(gens)} | collected {collected:,}, uncollectable {uncollectable:,}")
+
+    def idle_reportable(self):
+        """ Only report the idle drift if memory moved by at least 1MB while idle """
+        idle = self.idle_data
+        if idle is None: return False
+        return any(b2mb(abs(x)) for x in (idle.cpu_drift, idle.cpu_peaked_drift, idle.gpu_drift, idle.gpu_peaked_drift))
+
+    def print_idle_report(self, pre):
+        """ Print the memory drift since the previous cell ended, which isn't part of this cell's numbers """
+        idle = self.idle_data
+        out = f"{pre}Idle: CPU drift {b2mb(idle.cpu_drift):+,.0f} MB (△Peaked {b2mb(idle.cpu_peaked_drift):,.0f} MB)"
+        if self.backend == "pytorch":
+            out += f", GPU drift {b2mb(idle.gpu_drift):+,.0f} MB (△Peaked {b2mb(idle.gpu_peaked_drift):,.0f} MB)"
+        print(out + f" since the previous cell ended {secs2time(idle.time_delta)} ago")
+
+    def print_leak_report(self, pre):
+        """ Print the warning about the memory growing consistently across the runs of this cell """
+        leak = self.leak_data
+        trends = [("CPU", leak.cpu)] + ([("GPU", leak.gpu)] if leak.gpu is not None else [])
+        for name, t in trends:
+            if not t.leaking: continue
+            print(f"{pre}Warning: possible {name} leak, this cell ran {leak.runs} times, each run"
+                  f" △Consumed {t.used_delta_mean/2**20:+,.1f} MB (±{t.used_delta_stderr/2**20:,.1f})"
+                  f" and Used Total grew {t.used_total_slope/2**20:+,.1f} MB (±{t.used_total_slope_stderr/2**20:,.1f})")
+
+    def print_tracemalloc_report(self, pre, name, py):
+        """ Print the tracemalloc deltas and the top allocation sites of the last cell """
+        print(f"{pre}{name}: △Consumed {b2mb(py.used_delta):,.0f} MB, △Peaked {b2mb(py.peaked_delta):,.0f} MB"
+              f" ({share2pct(py.rss_share)} of CPU △Consumed)")
+        if py.sites is None:
+            print(f"{pre}  too many traces to diff the allocation sites")
+            return
+        for site in py.sites:
+            if site.size_delta < 2**20/10: continue # would show as 0.0 MB
+            print(f"{pre}  {site.size_delta/2**20:+10,.1f} MB {site.count_delta:+10,} blocks  {site.site}")
@@ -0,0 +1,253 @@
+""" A single set of ipython event handlers and a single peak memory sampler shared by all cell loggers """
+
+import gc
+import logging
+import threading
+import time
+from collections import namedtuple
+from .utils.malloc import malloc_trim
+from .utils.proc import cpu_ram_used, proc_usage, thread_usage, thread_io, usage_delta, io_counters, pressure_counters
+
+logger = logging.getLogger(__name__)
+
+# the measurements taken once at a cell boundary and shared by all the cell loggers measuring that cell
+CellSamplerSnapshot = namedtuple('CellSamplerSnapshot', ['time', 'usage', 'io', 'cpu_used', 'gpu_used', 'pressure'])
+
+def gpu_used(cache, cl):
+    " the used gpu RAM of the cell logger's device, measured once per device per snapshot "
+    if cl.backend != "pytorch": return 0
+    if cl.gpu_current_device_id not in cache:
+        cache[cl.gpu_current_device_id] = cl.gpu_ram_used()
+    return cache[cl.gpu_current_device_id]
+
+class SamplerWindow():
+    """ The peak memory seen by the sampler thread between CellSampler.open() and close()
+
+    * cpu_used_peak   - the peak RSS
+    * gpu_used_peak   - {nvml device id: the peak used gpu RAM}
+    * usage           - the usage counters of the sampler thread during the window
+    * io              - the I/O counters of the sampler thread during the window (its reads of /proc)
+    * tid             - the native id of the sampler thread
+    * loggers         - the cell loggers measuring with this window
+    """
+
+    def __init__(self):
+        self.cpu_used_peak = -1
+        self.gpu_used_peak = {}
+        self.gpu_readers   = {}
+        self.periodic      = [] # [interval, next sample time, func]
+        self.usage_start   = None
+        self.usage         = (0, 0, 0, 0, 0, 0)
+        self.io_start      = None
+        self.io            = (0, 0, 0, 0, 0, 0)
+        self.base          = None # (usage, io) of the window this one continues
+        self.loggers       = []
+        self.tid           = None
+        self.closing       = False
+        self.closed        = threading.Event()
+
+class CellSampler():
+    """ Process-wide registry of the running cell loggers
+
+    However many experiments are active, there is a single pair of
+    `pre_run_cell`/`post_run_cell` handlers and a single peak memory sampler
+    thread. The measurements that don't depend on the logger's options (time,
+    usage counters, I/O, RSS, the gc collection) are taken once per cell and
+    fanned out to all the loggers, each of which keeps its own baseline. The
+    loggers with `gc_collect=False` get the RSS from before the collection.
+    Each logger's own options still cost per logger, e.g. the `gc.callbacks`
+    hook of `gc_pauses` and the idle sampler thread of `idle_interval`.
+
+    The sampler thread updates the peaks of all the open windows, so nested
+    measurements (e.g. `cell_bench` inside a logged cell) share it too. Once
+    the last window is closed it waits for `linger` secs for a new one before
+    exiting, so that back-to-back measurements (`measure()`, `cell_bench`)
+    don't start a thread each.
+    """
+
+    linger = 1
+
+    def __init__(self):
+        self.loggers = []
+        self.ipython = None
+
+        self.lock    = threading.Lock()
+        self.windows = () # replaced, never mutated, so the sampler thread can read it without the lock
+        self.thread  = None
+        self.wakeup  = threading.Event()
+
+    def register(self, cl):
+        """ Add the cell logger to the ones measured on each cell, hooking the ipython events on the first one """
+        if cl in self.loggers: return
+        if not self.loggers:
+            self.ipython = cl.ipython
+            self.ipython.events.register("pre_run_cell",  self.pre_run_cell)
+            self.ipython.events.register("post_run_cell", self.post_run_cell)
+            logger.debug("CellSampler: registered the event handlers")
+        self.loggers.append(cl)
+
+    def unregister(self, cl):
+        if cl not in self.loggers: return
+        self.loggers.remove(cl)
+        if not self.loggers:
+            self.ipython.events.unregister("pre_run_cell",  self.pre_run_cell)
+            self.ipython.events.unregister("post_run_cell", self.post_run_cell)
+            self.ipython = None
+            logger.debug("CellSampler: unregistered the event handlers")
+
+    def pre_run_cell(self, info, loggers=None):
+        loggers = [cl for cl in (self.loggers if loggers is None else loggers) if cl.running]
+        for cl in loggers: cl.pre_run_cell(info)
+        self.measure_start(loggers)
+
+    def post_run_cell(self, result, loggers=None):
+        loggers = [cl for cl in (self.loggers if loggers is None else loggers) if cl.running and cl.window]
+        self.measure_stop(loggers)
+        for cl in loggers: cl.post_run_cell(result)
+
+    def measure_start(self, loggers):
+        """ Take the start measurements of the loggers and open a shared peak memory window """
+        if not loggers: return
+        for cl in loggers: cl.measure_prepare()
+
+        cpu_used, gpu_cache = cpu_ram_used(), {}
+        for cl in loggers: gpu_used(gpu_cache, cl)
+
+        # this thread samples RAM usage as long as the current cell is running
+        window = self.open(loggers)
+
+        # time and usage counters before we execute the current cell
+        io, usage, pressure = io_counters(any(cl.io_children for cl in loggers)), proc_usage(), pressure_counters()
+        snapshot = CellSamplerSnapshot(time.perf_counter(), usage, io, cpu_used, gpu_cache, pressure)
+        for cl in loggers: cl.measure_baseline(snapshot, window)
+
+    def measure_stop(self, loggers):
+        """ Close the loggers' windows and fan out the end measurements """
+        if not loggers: return
+        # signal the sampler first, or it may hold on to the GIL while the end measurements are taken
+        windows = {id(cl.window): cl.window for cl in loggers}
+        for window in windows.values(): window.closing = True
+
+        end = CellSamplerSnapshot(time.perf_counter(), proc_usage(),
+                                  io_counters(any(cl.io_children for cl in loggers)), 0, {}, pressure_counters())
+
+        stopping = {id(cl) for cl in loggers}
+        # back-to-back measurements (e.g. repeated runs) must not overlap
+        for window in windows.values():
+            self.close(window)
+            # the loggers still measuring (e.g. one experiment finished in the middle of a cell while
+            # another is running) continue in a new window, which starts with this one's peaks and usage
+            others = [cl for cl in window.loggers if cl.window is window and id(cl) not in stopping]
+            if others:
+                continued = self.open(others, window)
+                for cl in others: cl.window = continued
+
+        for cl in loggers: cl.measure_counters(end)
+
+        # a single collection and trim serve all the loggers, the ones that don't collect
+        # (e.g. tracking leaks) get the used memory from before the collection
+        trimmed = 0
+        for collect in (False, True):
+            group = [cl for cl in loggers if cl.gc_collect == collect]
+            if not group: continue
+            if collect: gc.collect()
+            if any(cl.malloc_trim for cl in group):
+                cpu_used_untrimmed = cpu_ram_used()
+                malloc_trim()
+                trimmed += max(0, cpu_used_untrimmed - cpu_ram_used())
+
+            cpu_used, gpu_cache = cpu_ram_used(), {}
+            for cl in group:
+                cl.measure_memory(cpu_used, gpu_used(gpu_cache, cl), trimmed if cl.malloc_trim else 0)
+
+    def open(self, loggers, previous=None):
+        """ Return a new SamplerWindow tracking the peak memory of the loggers' devices, continuing `previous` if given """
+        window = SamplerWindow()
+        window.loggers = list(loggers)
+        if previous is not None:
+            window.cpu_used_peak = previous.cpu_used_peak
+            window.base = (previous.usage, previous.io)
+        for cl in loggers:
+            if cl.backend == "pytorch":
+                nvml_gpu_id, reader = cl.gpu_used_reader()
+                window.gpu_readers.setdefault(nvml_gpu_id, reader)
+                window.gpu_used_peak[nvml_gpu_id] = previous.gpu_used_peak.get(nvml_gpu_id, -1) if previous else -1
+            if cl.threads and cl.threads.interval:
+                window.periodic.append([cl.threads.interval, time.perf_counter() + cl.threads.interval, cl.threads.sample])
+            if cl.trace and cl.trace.interval:
+                window.periodic.append([cl.trace.interval, time.perf_counter() + cl.trace.interval, cl.trace_sample])
+
+        with self.lock:
+            self.windows += (window,)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.sampler_func, name="ipyexperiments-sampler")
+                self.thread.daemon = True
+                self.thread.start()
+            else:
+                self.wakeup.set()
+        return window
+
+    def close(self, window):
+        """ Wait for the sampler thread to take the last sample of the window """
+        window.closing = True
+        while not window.closed.wait(0.1):
+            thread = self.thread
+            if thread is None or not thread.is_alive(): break
+
+    def sampler_func(self):
+        try:
+            self.sample_windows()
+        except Exception:
+            logger.exception("CellSampler: the sampler thread failed")
+            with self.lock:
+                windows, self.windows, self.thread = self.windows, (), None
+            for window in windows: window.closed.set()
+
+    def sample_windows(self):
+        tid = threading.get_native_id() if hasattr(threading, "get_native_id") else None # py-3.8+
+        while True:
+            windows = self.windows
+            if not windows:
+                if self.wakeup.wait(self.linger):
+                    self.wakeup.clear()
+                    continue
+                with self.lock:
+                    if not self.windows:
+                        self.thread = None
+                        return
+                continue
+
+            cpu_used = cpu_ram_used()
+            gpu_used = None
+            for window in windows:
+                if window.usage_start is None:
+                    window.usage_start, window.io_start, window.tid = thread_usage(), thread_io(tid), tid
+                if cpu_used > window.cpu_used_peak: window.cpu_used_peak = cpu_used
+
+                # no gc.collect, empty_cache here, since it has to be fast and we
+                # want to measure only the peak memory usage
+                if window.gpu_readers:
+                    if gpu_used is None: gpu_used = {}
+                    for nvml_gpu_id, reader in window.gpu_readers.items():
+                        if nvml_gpu_id not in gpu_used: gpu_used[nvml_gpu_id] = reader()
+                        if gpu_used[nvml_gpu_id] > window.gpu_used_peak[nvml_gpu_id]:
+                            window.gpu_used_peak[nvml_gpu_id] = gpu_used[nvml_gpu_id]
+
+                for p in window.periodic:
+                    if time.perf_counter() >= p[1]:
+                        p[2]()
+                        p[1] = time.perf_counter() + p[0]
+
+                # can't sleep or will not catch the peak right
+                if window.closing:
+                    window.usage = usage_delta(thread_usage(), window.usage_start)
+                    if window.io_start is not None: window.io = usage_delta(thread_io(tid), window.io_start)
+                    if window.base is not None:
+                        window.usage = tuple(c + b for c, b in zip(window.usage, window.base[0]))
+                        window.io    = tuple(c + b for c, b in zip(window.io, window.base[1]))
+                    with self.lock:
+                        self.windows = tuple(w for w in self.windows if w is not window)
+                    window.closed.set()
+
+# the process-wide instance
+sampler = CellSampler()
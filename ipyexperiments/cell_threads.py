@@ -0,0 +1,107 @@
+""" Per-thread CPU time accounting of a cell """
+
+import os
+import psutil
+import threading
+import time
+from collections import namedtuple
+
+CellLoggerThreadGroup = namedtuple('CellLoggerThreadGroup', ['name', 'cpu_user', 'cpu_system', 'count'])
+CellLoggerThreads     = namedtuple('CellLoggerThreads', ['parallelism', 'active', 'total', 'groups'])
+
+process = psutil.Process()
+
+def thread_times():
+    " return {native thread id: (user time, system time)} of this process' threads "
+    return {t.id: (t.user_time, t.system_time) for t in process.threads()}
+
+def python_thread_names():
+    " return {native thread id: name} of the python threads "
+    return {t.native_id: t.name for t in threading.enumerate() if getattr(t, 'native_id', None) is not None}
+
+def native_thread_name(tid):
+    " return the name of a non-python thread (linux only), falling back to its id "
+    try:
+        with open(f"/proc/self/task/{tid}/comm") as f: return f.read().strip()
+    except OSError:
+        return str(tid)
+
+class CellThreads():
+    """ Attribute the cell's CPU time to the threads that used it
+
+    Parameters:
+    * group_by='name'  - group the threads by 'name' or by native 'id'
+    * interval=0       - secs between samples taken during the cell (0 to only snapshot at the cell boundaries).
+                         Threads that exit during the cell are only accounted for up to their last sample.
+    * top=5            - number of thread groups to report
+    * active_pct=10    - a thread is active if it used more than so many % of a core during the cell
+
+    The threads' cpu times have a resolution of a clock tick (10 msecs on
+    linux), so the parallelism of cells shorter than `min_time` secs isn't calculated.
+    """
+
+    min_time = 0.1
+
+    def __init__(self, group_by='name', interval=0, top=5, active_pct=10):
+        if group_by not in ('name', 'id'): raise ValueError("group_by must be 'name' or 'id'")
+        self.group_by   = group_by
+        self.interval   = interval
+        self.top        = top
+        self.active_pct = active_pct
+
+        self.times_start = {}
+        self.times_last  = {}
+        self.names       = {}
+        self.time_start  = 0
+
+    def cell_start(self):
+        self.names = {}
+        self.time_start  = time.perf_counter()
+        self.times_start = thread_times()
+        self.times_last  = dict(self.times_start)
+        self.name_threads(self.times_start)
+
+    def sample(self):
+        """ Record the latest times of the threads, so that the threads that exit before the end are accounted for """
+        times = thread_times()
+        self.name_threads(times)
+        self.times_last.update(times)
+
+    def name_threads(self, times):
+        new = [tid for tid in times if tid not in self.names]
+        if not new: return
+        py_names = python_thread_names()
+        for tid in new:
+            self.names[tid] = py_names[tid] if tid in py_names else native_thread_name(tid)
+
+    def cell_stop(self, exclude=()):
+        """ Return CellLoggerThreads for the cell, excluding the `exclude` thread ids """
+        self.sample()
+        # the threads' times are compared over the time between the snapshots
+        time_delta = time.perf_counter() - self.time_start
+
+        groups, active, total = {}, 0, 0
+        for tid, (user, system) in self.times_last.items():
+            if tid in exclude: continue
+            user_start, system_start = self.times_start.get(tid, (0, 0))
+            user, system = max(0, user - user_start), max(0, system - system_start)
+            total += 1
+            if (user + system) / (time_delta or 1) * 100 > self.active_pct: active += 1
+            key = self.names[tid] if self.group_by == 'name' else str(tid)
+            g = groups.get(key, (0, 0, 0))
+            groups[key] = (g[0] + user, g[1] + system, g[2] + 1)
+
+        if time_delta < self.min_time: active = 0
+        cpu_time = sum(u + s for u, s, _ in groups.values())
+        parallelism = cpu_time / time_delta if time_delta >= self.min_time else 0
+        top = sorted(groups.items(), key=lambda x: x[1][0] + x[1][1], reverse=True)[:self.top]
+        return CellLoggerThreads(parallelism, active, total,
+                                 [CellLoggerThreadGroup(name, *vals) for name, vals in top])
+
+def is_oversubscribed(threads):
+    " more threads were busy than there are cores available to this process "
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError: # not linux
+        cores = os.cpu_count() or 1
+    return threads.active > cores
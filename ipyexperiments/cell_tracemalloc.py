@@ -0,0 +1,171 @@
+""" tracemalloc snapshots at cell boundaries, complementing the RSS measurements """
+
+import heapq
+import os
+import sys
+import tracemalloc
+from collections import namedtuple
+
+CellLoggerAllocSite   = namedtuple('CellLoggerAllocSite', ['site', 'size_delta', 'count_delta'])
+CellLoggerTracemalloc = namedtuple('CellLoggerTracemalloc', ['used_delta', 'peaked_delta', 'rss_share', 'sites'])
+
+# allocations that are an artifact of the tracing and importing machinery
+snapshot_filters = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# tracemalloc's own memory per trace is at least this many bytes, so its total memory bounds the number of traces
+trace_bytes = 48
+
+# numpy reports its data buffers to tracemalloc under this domain (numpy.lib.tracemalloc_domain)
+numpy_domain = 389047
+
+class CellTracemalloc():
+    """ Diff tracemalloc snapshots taken at the start and the end of a cell
+
+    tracemalloc only sees python allocations, so it's used alongside RSS and
+    not instead of it, to tell where the python part of the memory came from.
+
+    Parameters:
+    * frames=1            - number of frames to store per allocation (the allocation site depth)
+    * top=5               - number of allocation sites to report
+    * max_traces=200_000  - don't snapshot and diff the sites if tracemalloc holds more traces than that,
+                            so that the cost of the snapshots stays bounded in big cells
+
+    If tracemalloc is already tracing when started, it's left running at the
+    end and its traceback limit is used.
+    """
+
+    def __init__(self, frames=1, top=5, max_traces=200_000):
+        self.frames     = frames
+        self.top        = top
+        self.max_traces = max_traces
+        self.filters    = snapshot_filters
+
+        self.started_tracing = False
+        self.cell_running    = False
+        self.snapshot_start  = None
+        self.used_at_start   = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+
+    def stop(self):
+        self.cell_running   = False
+        self.snapshot_start = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def cell_start(self):
+        self.cell_running = tracemalloc.is_tracing()
+        if not self.cell_running: return
+        self.snapshot_start = self.snapshot()
+        self.used_at_start = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"): tracemalloc.reset_peak() # py-3.9+
+
+    def cell_stop(self, rss_used_delta):
+        """ Return CellLoggerTracemalloc with the cell's python deltas and top allocation sites.
+
+        `rss_used_delta` is the cell's RSS delta, to calculate which share of it python allocations explain.
+        """
+        if not (self.cell_running and tracemalloc.is_tracing()): return None
+        self.cell_running = False
+
+        used, peak = tracemalloc.get_traced_memory()
+        snapshot_start, self.snapshot_start = self.snapshot_start, None
+        snapshot_end = self.snapshot() if snapshot_start is not None else None
+
+        used_delta = self.used_delta(used - self.used_at_start, snapshot_end, snapshot_start)
+        if used_delta is None: return None
+        # same as RSS, peaked_delta is the temporary overhead above used_delta
+        peaked_delta = max(0, peak - self.used_at_start) if hasattr(tracemalloc, "reset_peak") else 0
+        if used_delta > 0:
+            peaked_delta = max(0, peaked_delta - used_delta)
+        rss_share = used_delta / rss_used_delta if rss_used_delta > 0 else 0
+
+        # sites is None if the snapshots were too big to diff
+        sites = self.sites(snapshot_end, snapshot_start) if snapshot_end is not None else None
+
+        return CellLoggerTracemalloc(used_delta, peaked_delta, rss_share, sites)
+
+    def used_delta(self, traced_used_delta, snapshot_end, snapshot_start):
+        " the cell's used memory delta, None if it can't be told "
+        return traced_used_delta
+
+    def snapshot(self):
+        """ Return a filtered snapshot, or None if it holds more than max_traces traces """
+        # take_snapshot() copies all the traces, so skip it if tracemalloc's memory tells there are too many
+        if tracemalloc.get_tracemalloc_memory() > self.max_traces * trace_bytes: return None
+        snapshot = tracemalloc.take_snapshot()
+        # filtering and diffing are done in python, so check the size before doing either
+        if len(snapshot.traces) > self.max_traces: return None
+        return snapshot.filter_traces(self.filters)
+
+    def sites(self, snapshot_end, snapshot_start):
+        key_type = 'lineno' if tracemalloc.get_traceback_limit() == 1 else 'traceback'
+        stats = snapshot_end.compare_to(snapshot_start, key_type)
+        top = heapq.nlargest(self.top, stats, key=lambda x: x.size_diff)
+        return [CellLoggerAllocSite(site_name(s.traceback), s.size_diff, s.count_diff)
+                for s in top if s.size_diff > 0]
+
+def site_name(traceback):
+    " file:lineno of the allocation, followed by its callers when more than one frame is traced "
+    return " <- ".join(f"{f.filename}:{f.lineno}" for f in reversed(traceback))
+
+class CellTracemallocNumpy(CellTracemalloc):
+    """ Diff only the NumPy data buffers, which numpy reports to tracemalloc under its own domain
+
+    The used delta is exact, but tracemalloc has a single peak counter for all
+    domains, so peaked_delta also includes the python allocations of the cell
+    and is an upper bound of NumPy's.
+
+    Nothing is measured in cells that start before numpy is imported, and
+    tracing, which slows down all the python allocations, only starts with the
+    first cell that finds numpy imported. The sites are named after the
+    innermost frame outside of numpy, so trace enough frames to get past
+    numpy's own python code.
+    """
+
+    def __init__(self, frames=5, top=5, max_traces=200_000):
+        super().__init__(frames, top, max_traces)
+        self.filters = [tracemalloc.DomainFilter(True, numpy_domain)]
+
+    def start(self): pass # deferred to the first cell with numpy imported
+
+    def cell_start(self):
+        if 'numpy' not in sys.modules:
+            self.cell_running = False
+            return
+        super().start()
+        super().cell_start()
+
+    def used_delta(self, traced_used_delta, snapshot_end, snapshot_start):
+        if snapshot_end is None or snapshot_start is None: return None
+        return domain_size(snapshot_end) - domain_size(snapshot_start)
+
+    def sites(self, snapshot_end, snapshot_start):
+        stats = snapshot_end.compare_to(snapshot_start, 'traceback')
+        numpy_dir = os.path.dirname(sys.modules['numpy'].__file__)
+        # the different tracebacks of the same caller are merged
+        sites = {}
+        for s in stats:
+            name = caller_site_name(s.traceback, numpy_dir)
+            size_delta, count_delta = sites.get(name, (0, 0))
+            sites[name] = (size_delta + s.size_diff, count_delta + s.count_diff)
+        top = heapq.nlargest(self.top, sites.items(), key=lambda x: x[1][0])
+        return [CellLoggerAllocSite(name, size_delta, count_delta) for name, (size_delta, count_delta) in top if size_delta > 0]
+
+def domain_size(snapshot):
+    " the total size of the traces in a filtered snapshot "
+    return sum(trace.size for trace in snapshot.traces)
+
+def caller_site_name(traceback, skip_dir):
+    " file:lineno of the innermost frame outside of skip_dir, or of the allocation if there is none "
+    frame = next((f for f in reversed(traceback) if not f.filename.startswith(skip_dir)), traceback[-1])
+    return f"{frame.filename}:{frame.lineno}"
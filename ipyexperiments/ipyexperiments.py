@@ -1,6 +1,9 @@
 __all__ = ['IPyExperimentsCPU', 'IPyExperimentsPytorch']
 
+import contextlib
 import gc
+import heapq
+import io
 import logging
 import os
 import psutil
@@ -11,7 +14,13 @@ import weakref
 from IPython import get_ipython
 from IPython.core.magics.namespace import NamespaceMagics # Used to query namespace.
 from collections import namedtuple
-from .cell_logger import CellLogger, b2mb, int2width, get_nvml_gpu_id
+from .cell_logger import CellLogger, b2mb, int2width, secs2time, get_nvml_gpu_id
+from .out_history import OutHistory
+from .subscribers import Dispatcher
+from .trace_events import TraceEventWriter
+from .utils.ipython import ipython_tb_clear_frames_hook
+from .utils.malloc import malloc_trim
+from .utils.proc import pressure_counters, pressure_scope, proc_usage, usage_delta
 
 logging.basicConfig(
     format="%(filename)s:%(lineno)s - %(funcName)20s() | %(message)s",
@@ -22,8 +31,24 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 #logger.setLevel(logging.DEBUG)
 
-IPyExperimentMemory = namedtuple('IPyExperimentMemory', ['consumed', 'reclaimed', 'available'])
-IPyExperimentData   = namedtuple('IPyExperimentData', ['cpu', 'gpu'])
+IPyExperimentMemory = namedtuple('IPyExperimentMemory', ['consumed', 'reclaimed', 'available', 'trimmed'])
+IPyExperimentData   = namedtuple('IPyExperimentData', ['cpu', 'gpu', 'cells', 'gc_freeze', 'out_history', 'pressure'])
+# the time of a full gc.collect() before and after freezing the pre-experiment heap
+IPyExperimentGCFreeze = namedtuple('IPyExperimentGCFreeze', ['frozen', 'collect_time', 'collect_time_frozen'])
+# the per-cell summary: total and top-N cells for each metric
+IPyExperimentCells    = namedtuple('IPyExperimentCells', ['count', 'cpu_peak', 'gpu_peak', 'time',
+                                                          'cpu_consumed', 'cpu_peaked', 'gpu_consumed', 'gpu_peaked'])
+IPyExperimentHotspots = namedtuple('IPyExperimentHotspots', ['total', 'top'])
+IPyExperimentHotspot  = namedtuple('IPyExperimentHotspot', ['execution_count', 'source', 'value', 'share'])
+# the outputs of the experiment's cells held by ipython: their estimated size, the biggest of them (OutHistoryEntry),
+# how many the retention dropped during the experiment, and how many were purged at finish() and what it reclaimed
+IPyExperimentOutHistory = namedtuple('IPyExperimentOutHistory', ['count', 'size', 'top', 'dropped',
+                                                                 'purged', 'cpu_reclaimed', 'gpu_reclaimed'])
+# the swap used by the process and its change since the start, the (PSI) memory stall secs and the major page
+# faults during the experiment, the stalls are of the process' cgroup or of the system, per `scope`, None if
+# PSI isn't available
+IPyExperimentPressure = namedtuple('IPyExperimentPressure', ['swap_used', 'swap_delta', 'some_stall', 'full_stall',
+                                                             'faults_major', 'scope'])
 
 # this forces preloading of all CUDA kernels, so that we don't get misleading measurements at runtime
 # this is needed since pytorch-1.13 where lazy loading has been introduced
@@ -34,25 +59,84 @@ process = psutil.Process(os.getpid())
 class IPyExperiments():
     "Create an experiment with time/memory checkpoints"
 
-    def __init__(self, exp_enable=True,
-                 cl_enable=True, cl_compact=False, cl_gc_collect=True, cl_set_seed=0):
+    def __init__(self, exp_enable=True, exp_hotspots=5, exp_malloc_trim=False, exp_gc_freeze=False,
+                 exp_trace=None, exp_trace_interval=0.1, exp_verbose=True, exp_subscribers=(),
+                 exp_subscribers_queue=1000, exp_tb_clear_frames=False, exp_tb_clear_bytes=2**26,
+                 exp_out_keep=None, exp_out_bytes=None, exp_out_purge=False,
+                 cl_enable=True, cl_verbose=True, cl_compact=False, cl_gc_collect=True, cl_set_seed=0,
+                 cl_tracemalloc_frames=0, cl_tracemalloc_top=5, cl_malloc_trim=False, cl_io_children=False,
+                 cl_threads=None, cl_threads_interval=0, cl_idle_interval=0, cl_idle_samples=3600,
+                 cl_gc_pauses=True, cl_tracemalloc_numpy=False, cl_leak_runs=5, cl_leak_bytes=2**20):
         """ Instantiate an object with parameters:
 
         Parameters:
         * exp_enable=False   - run just the CellLogger if exp_enable=False, cl_enable=True
+        * exp_hotspots=5     - report top N cells by time/memory at finish() (0 to disable, requires cl_enable)
+        * exp_malloc_trim=False - return freed memory to the OS with malloc_trim at finish() (glibc only)
+        * exp_gc_freeze=False   - gc.freeze() the pre-experiment objects at start() to speed up all later collections (py-3.7+)
+        * exp_trace=None        - write the cells, memory counters and finish() phases to this trace-event json file
+        * exp_trace_interval=0.1 - secs between the memory counter samples during the cells (0 to only sample at the cell boundaries)
+        * exp_verbose=True      - print the experiment's start and finish reports
+        * exp_subscribers=()    - callables to deliver the experiment start, cell and finish measurements to (see subscribe())
+        * exp_subscribers_queue=1000 - number of measurements waiting for delivery, the new ones are dropped when it's full
+        * exp_tb_clear_frames=False  - clear the frames of the tracebacks of the cells' exceptions to reclaim the memory their locals hold (see tb_keep_frames())
+        * exp_tb_clear_bytes=2**26   - clear the frames only if their locals hold at least so many bytes
+        * exp_out_keep=None     - keep only so many of the most recent outputs of the experiment's cells in ipython's Out/_N/_ (None for all)
+        * exp_out_bytes=None    - keep the most recent outputs of the experiment's cells under so many bytes (None for no limit)
+        * exp_out_purge=False   - purge the outputs of the experiment's cells at finish()
 
         Cell logger Parameters: these are being passed to CellLogger (and the defaults)
         * cl_enable=True     - run the cell logger
+        * cl_verbose=True    - print the report of each cell
         * cl_compact=False   - compact cell report
         * cl_gc_collect=True - gc_collect at the end of each cell before mem measurement
         * cl_set_seed=0      - set RNG seed before each cell is run to the provided value
+        * cl_tracemalloc_frames=0 - report python allocation sites next to RSS, tracing so many frames (0 to disable)
+        * cl_tracemalloc_top=5    - number of python allocation sites to report
+        * cl_malloc_trim=False    - return freed memory to the OS with malloc_trim after each cell (glibc only)
+        * cl_io_children=False    - include the I/O of the child processes in the cell's I/O report
+        * cl_threads=None         - report per-thread CPU time grouped by thread 'name' or 'id' (None to disable)
+        * cl_threads_interval=0   - also sample the threads every so many secs during the cell (0 to disable)
+        * cl_idle_interval=0      - sample the memory every so many secs between the cells to report the idle drift (0 to disable)
+        * cl_idle_samples=3600    - number of the most recent idle samples to keep
+        * cl_gc_pauses=True       - report the gc collections and their pauses during each cell
+        * cl_tracemalloc_numpy=False - report the numpy data buffers allocated by each cell and their allocation sites
+        * cl_leak_runs=5          - warn about cells whose memory grows consistently once they ran so many times (0 to disable)
+        * cl_leak_bytes=2**20     - the smallest growth per run to warn about
         """
 
         logger.debug(f"{self.__class__.__name__}::__init__: {self}")
 
         self.cl_enable = cl_enable
-        self.cl_kwargs = dict(compact=cl_compact, gc_collect=cl_gc_collect, set_seed=cl_set_seed)
+        self.trace = TraceEventWriter(exp_trace, exp_trace_interval) if exp_trace else None
+        self.verbose = exp_verbose
+        self.dispatcher = Dispatcher(exp_subscribers_queue)
+        for sink in exp_subscribers: self.dispatcher.subscribe(sink)
+        self.cl_kwargs = dict(verbose=cl_verbose, compact=cl_compact, gc_collect=cl_gc_collect, set_seed=cl_set_seed,
+                              tracemalloc_frames=cl_tracemalloc_frames, tracemalloc_top=cl_tracemalloc_top,
+                              malloc_trim=cl_malloc_trim, io_children=cl_io_children,
+                              threads=cl_threads, threads_interval=cl_threads_interval,
+                              idle_interval=cl_idle_interval, idle_samples=cl_idle_samples,
+                              gc_pauses=cl_gc_pauses, tracemalloc_numpy=cl_tracemalloc_numpy,
+                              leak_runs=cl_leak_runs, leak_bytes=cl_leak_bytes,
+                              trace=self.trace, dispatcher=self.dispatcher)
         self.enable = exp_enable
+        self.hotspots = exp_hotspots
+        self.malloc_trim = exp_malloc_trim
+        self.cpu_ram_trimmed = 0
+        self.gc_freeze = exp_gc_freeze
+        self.gc_freeze_data = None
+        self.cell_history = None
+        self.tb_clear_frames = exp_tb_clear_frames
+        self.tb_clear_bytes = exp_tb_clear_bytes
+        self.tb_hook = None
+        self.out_keep = exp_out_keep
+        self.out_bytes = exp_out_bytes
+        self.out_purge = exp_out_purge
+        self.out_history = None
+        self.out_history_data = None
+        self.pressure_start = None
+        self.pressure_data = None
 
         self.running = False
 
@@ -65,7 +149,8 @@ class IPyExperiments():
         # grab the notebook var names during creation
         ipython = get_ipython()
         self.namespace = NamespaceMagics()
-        self.namespace.shell = ipython.kernel.shell
+        # jupyter kernels expose the shell via .kernel, a plain ipython shell is the shell itself
+        self.namespace.shell = ipython.kernel.shell if hasattr(ipython, "kernel") else ipython
         self.var_names_start = self.get_var_names()
         #print(self.var_names_start)
 
@@ -87,17 +172,26 @@ class IPyExperiments():
         self.gpu_clear_cache()
 
         self.running = True
+        self.start_perf_counter = time.perf_counter()
 
         if self.enable:
 
+            if self.gc_freeze: self.gc_freeze_start()
+
             self.cpu_ram_used_start = self.cpu_ram_used()
             self.gpu_ram_used_start = self.gpu_ram_used()
+            self.pressure_start, self.pressure_data = (pressure_counters(), proc_usage()[5]), None
             #print(f"gpu used f{self.gpu_ram_used_start}")
 
             self.print_state()
             # XXX: perhaps prefix all the prints from exp with some |?
             print("\n") # extra vertical white space, to not mix with user's outputs
 
+            # before the cell logger, so that its measurements include the outputs dropped after each cell
+            shell = self.namespace.shell
+            self.out_history = OutHistory(shell, start=shell.execution_count, keep=self.out_keep, max_bytes=self.out_bytes)
+            self.out_history.register()
+
         # start the per cell sub-system
         if self.cl_enable:
             self.cl = CellLogger(exp=self, **self.cl_kwargs)
@@ -105,6 +199,87 @@ class IPyExperiments():
         else:
             self.cl = None
 
+        if self.tb_clear_frames: self.tb_hook_start()
+
+        if self.enable: self.dispatcher.publish('experiment_start', data=self.data)
+
+    def tb_hook_start(self):
+        shell = get_ipython()
+        if shell is None:
+            logger.debug("exp_tb_clear_frames: not running under ipython")
+            return
+        self.tb_hook = ipython_tb_clear_frames_hook(shell, min_bytes=self.tb_clear_bytes, exp=self,
+                                                    verbose=self.verbose).install()
+
+    def tb_keep_frames(self, keep=True):
+        """ Keep the frames of the tracebacks of the following exceptions, e.g. to `%debug` a cell (with exp_tb_clear_frames) """
+        if self.tb_hook is not None: self.tb_hook.keep_frames = keep
+
+    def gc_freeze_start(self):
+        """ Move all the objects that survived the baseline collection to the permanent generation """
+        if not hasattr(gc, "freeze"): # py-3.7+
+            print("\n*** gc.freeze is not available in this python version, skipping")
+            return
+        if gc.get_freeze_count():
+            print("\n*** gc.freeze was already called before the experiment, leaving it as is")
+            return
+
+        # time a full collection with and without the pre-experiment objects being traversed
+        start = time.perf_counter()
+        gc.collect()
+        collect_time = time.perf_counter() - start
+        gc.freeze()
+        start = time.perf_counter()
+        gc.collect()
+        collect_time_frozen = time.perf_counter() - start
+
+        self.gc_freeze_data = IPyExperimentGCFreeze(gc.get_freeze_count(), collect_time, collect_time_frozen)
+        self.print_gc_freeze()
+
+    def gc_freeze_stop(self):
+        """ Return the frozen objects to the oldest generation, so that the final collection sees them """
+        if self.gc_freeze_data is None: return
+        gc.unfreeze()
+
+    def print_gc_freeze(self):
+        fz = self.gc_freeze_data
+        speedup = fz.collect_time / fz.collect_time_frozen if fz.collect_time_frozen else 0
+        print(f"\n*** gc.freeze: froze {fz.frozen:,} pre-experiment objects")
+        print(f"full gc.collect: {fz.collect_time*1000:,.3f} msecs -> {fz.collect_time_frozen*1000:,.3f} msecs"
+              f" ({speedup:0.1f}x faster)")
+
+    def subscribe(self, sink):
+        """ Call `sink` with a SubscriberEvent of each measured cell and of the experiment's finish
+
+        The sinks are called from a background thread, so that they never
+        delay the cells. Pass the sinks that should also get the experiment's
+        start via `exp_subscribers`, since it starts in the constructor.
+        """
+        self.dispatcher.subscribe(sink)
+
+    def unsubscribe(self, sink):
+        self.dispatcher.unsubscribe(sink)
+
+    def printing(self):
+        """ Context manager silencing the experiment's own reports unless exp_verbose """
+        # ExitStack() is a no-op context manager that works with py-3.6
+        return contextlib.ExitStack() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def print_dispatcher(self):
+        d = self.dispatcher
+        if d.dropped: print(f"\n*** Subscribers: dropped {d.dropped:,} measurements, the sinks can't keep up (increase exp_subscribers_queue)")
+        if d.errors:  print(f"\n*** Subscribers: the sinks failed {d.errors:,} times, see the log for the tracebacks")
+
+    def trace_phase(self, name, start, **args):
+        """ Write a finish() phase that started at `start` and ends now to the trace """
+        if not self.trace: return
+        self.trace.complete(name, "experiment", start, time.perf_counter() - start, self.trace.tid_experiment, args)
+
+    def trace_close(self):
+        if not self.trace: return
+        self.trace.close()
+        print(f"*** Trace written to {self.trace.path}, open it in https://ui.perfetto.dev or chrome://tracing")
+
     def __enter__(self):
         return self
 
@@ -153,17 +328,114 @@ class IPyExperiments():
             gpu_ram_recl = 0
         return cpu_ram_recl, gpu_ram_recl
 
+    def _out_history(self):
+        """ Return IPyExperimentOutHistory of the outputs of the experiment's cells held by ipython (None if not tracked) """
+        if self.out_history_data is not None: return self.out_history_data
+        oh = self.out_history
+        if oh is None: return None
+        entries = oh.entries()
+        return IPyExperimentOutHistory(len(entries), oh.size(), entries[:5], oh.dropped, 0, 0, 0)
+
+    def out_history_finish(self):
+        """ Stop the retention, take the final accounting and purge the outputs if asked to """
+        self.out_history.unregister()
+        data = self._out_history()
+        if self.out_purge and data.count:
+            phase_start = time.perf_counter()
+            cpu_used, gpu_used = self.cpu_ram_used(), self.gpu_ram_used()
+            purged = self.out_history.purge()
+            gc.collect()
+            self.gpu_clear_cache()
+            data = data._replace(purged=len(purged), cpu_reclaimed=cpu_used - self.cpu_ram_used(),
+                                 gpu_reclaimed=gpu_used - self.gpu_ram_used())
+            self.trace_phase("purge outputs", phase_start, purged=len(purged), reclaimed_mb=b2mb(data.cpu_reclaimed))
+        self.out_history_data = data
+        self.out_history = None
+
+    def print_out_history(self):
+        oh = self.out_history_data
+        if not (oh.count or oh.dropped): return
+        print("\n*** Output history (Out, _N, _, __, ___):")
+        if oh.dropped: print(f"dropped {oh.dropped:,} outputs during the experiment (exp_out_keep/exp_out_bytes)")
+        if not oh.count: return
+        top = ", ".join(f"Out[{e.execution_count}] {b2mb(e.size):,.0f} MB ({e.type})" for e in oh.top)
+        print(f"the experiment's {oh.count:,} outputs held ~{b2mb(oh.size):,.0f} MB, the biggest: {top}")
+        if oh.purged:
+            out = f"purged {oh.purged:,} outputs, reclaimed CPU {b2mb(oh.cpu_reclaimed):,.0f} MB"
+            if self.backend != 'cpu': out += f", GPU {b2mb(oh.gpu_reclaimed):,.0f} MB"
+            print(out)
+        elif b2mb(oh.size):
+            print("(exp_out_purge=True purges them at finish())")
+
+    def _pressure(self):
+        """ Return IPyExperimentPressure since the start of the experiment (None if not started) """
+        if self.pressure_data is not None: return self.pressure_data
+        if self.pressure_start is None: return None
+        (swap_start, stalls_start), faults_start = self.pressure_start
+        swap_used, stalls = pressure_counters()
+        some_stall = full_stall = 0
+        if stalls_start is not None and stalls is not None:
+            some_stall, full_stall = usage_delta(stalls, stalls_start)
+        return IPyExperimentPressure(swap_used, swap_used - swap_start, some_stall, full_stall,
+                                     proc_usage()[5] - faults_start, pressure_scope if stalls is not None else None)
+
+    def print_pressure(self):
+        mp = self.pressure_data
+        stalls = (f"some {mp.some_stall:0.3f}s, full {mp.full_stall:0.3f}s ({mp.scope})" if mp.scope is not None
+                  else "n/a (PSI isn't available)")
+        print("\n*** Memory pressure:")
+        print(f"swap used {b2mb(mp.swap_used):,.0f} MB ({b2mb(mp.swap_delta):+,.0f} MB) | stalls {stalls}"
+              f" | major page faults {mp.faults_major:,}")
+
+    def _cells(self):
+        """ Return IPyExperimentCells summary of the cells logged so far (None if there are none) """
+        history = self.history
+        if not history: return None
+
+        def hotspots(field):
+            vals  = [max(0, v) for v in history.column(field)]
+            total = sum(vals)
+            top   = heapq.nlargest(self.hotspots, range(len(vals)), key=vals.__getitem__)
+            rows  = [history.row(i) for i in top if vals[i] > 0]
+            return IPyExperimentHotspots(total, [
+                IPyExperimentHotspot(r.execution_count, r.source, getattr(r, field), getattr(r, field)/total)
+                for r in rows])
+
+        return IPyExperimentCells(
+            len(history),
+            max(0, history.max('cpu_used_peak')),
+            max(0, history.max('gpu_used_peak')),
+            hotspots('time_delta'),
+            hotspots('cpu_used_delta'),
+            hotspots('cpu_peaked_delta'),
+            hotspots('gpu_used_delta'),
+            hotspots('gpu_peaked_delta'),
+        )
+
+    @property
+    def history(self):
+        """ Return the CellHistory of the logged cells (None if the cell logger is disabled) """
+        return self.cl.history if self.cl else self.cell_history
+
     def _data_format(self, cpu_ram_avail, cpu_ram_cons, cpu_ram_recl,
                            gpu_ram_avail, gpu_ram_cons, gpu_ram_recl):
         if self.backend == 'cpu':
             return IPyExperimentData(
-                IPyExperimentMemory(cpu_ram_cons, cpu_ram_recl, cpu_ram_avail),
-                IPyExperimentMemory(0, 0, 0)
+                IPyExperimentMemory(cpu_ram_cons, cpu_ram_recl, cpu_ram_avail, self.cpu_ram_trimmed),
+                IPyExperimentMemory(0, 0, 0, 0),
+                self._cells(),
+                self.gc_freeze_data,
+                self._out_history(),
+                self._pressure(),
             )
         else:
             return IPyExperimentData(
-                IPyExperimentMemory(cpu_ram_cons, cpu_ram_recl, cpu_ram_avail),
-                IPyExperimentMemory(gpu_ram_cons, gpu_ram_recl, gpu_ram_avail)
+                IPyExperimentMemory(cpu_ram_cons, cpu_ram_recl, cpu_ram_avail, self.cpu_ram_trimmed),
+                IPyExperimentMemory(gpu_ram_cons, gpu_ram_recl, gpu_ram_avail, 0),
+                self._cells(),
+                self.gc_freeze_data,
+                self._out_history(),
+                self._pressure(),
             )
 
     @property
@@ -196,18 +468,54 @@ class IPyExperiments():
         if self.backend != 'cpu':
             print(f"GPU: {b2mb(gpu_ram_used):{w},.0f} {b2mb(gpu_ram_free):{w},.0f} {b2mb(gpu_ram_total):{w},.0f} MB {gpu_ram_util:6.2f}% ")
 
+    def print_cells(self, cells):
+        """ Print the hotspots of IPyExperimentCells summary """
+        metrics = [("Exec time", cells.time, secs2time)]
+        metrics += [("CPU △Consumed", cells.cpu_consumed, None), ("CPU △Peaked", cells.cpu_peaked, None)]
+        if self.backend != 'cpu':
+            metrics += [("GPU △Consumed", cells.gpu_consumed, None), ("GPU △Peaked", cells.gpu_peaked, None)]
+
+        tops = [h for _, m, _ in metrics for h in m.top]
+        wc = max([len(str(h.execution_count)) for h in tops], default=1)
+        w = int2width(*[b2mb(h.value) for _, m, f in metrics if f is None for h in m.top], 0)
+
+        print(f"\n*** Experiment hotspots (top {self.hotspots} of {cells.count} cells):")
+        for name, m, fmt in metrics:
+            top = m.top if fmt else [h for h in m.top if b2mb(h.value)] # sub-MB noise
+            if not top: continue
+            if fmt: print(f"{name}: {fmt(m.total)} total")
+            else:   print(f"{name}: {b2mb(m.total):,.0f} MB total")
+            for h in top:
+                val = fmt(h.value) if fmt else f"{b2mb(h.value):{w},.0f} MB"
+                print(f"  In [{h.execution_count:>{wc}}]: {val} ({h.share*100:6.2f}%) {h.source}")
+        out = f"Peak used: CPU {b2mb(cells.cpu_peak):,.0f} MB"
+        if self.backend != 'cpu':
+            out += f" | GPU {b2mb(cells.gpu_peak):,.0f} MB"
+        print(out)
+
 
     def finish(self):
+        """ Finish the experiment, reclaim memory, return final stats """
+        with self.printing(): return self._finish()
+
+    def _finish(self):
         if self.cl:
             logger.debug(self.__class__.__name__ +f"finish: 0 {self}")
             self.cl.stop()
+            self.cell_history = self.cl.history # retain for the summary
             self.cl = None # free the CL object
 
         self.running = False
 
-        if not self.enable: return
+        if self.tb_hook is not None:
+            self.tb_hook.uninstall()
+            self.tb_hook = None
+
+        if not self.enable:
+            self.trace_close()
+            self.dispatcher.close()
+            return
 
-        """ Finish the experiment, reclaim memory, return final stats """
         print("\n" + self.__class__.__name__ + ": Finishing")
 
         elapsed_time = int(time.time() - self.start_time)
@@ -215,6 +523,7 @@ class IPyExperiments():
 
         # first take the final snapshot of consumed resources
         cpu_ram_cons,  gpu_ram_cons = self._consumed()
+        self.pressure_data = self._pressure()
         self.cpu_ram_cons = cpu_ram_cons
         self.gpu_ram_cons = gpu_ram_cons
 
@@ -233,6 +542,7 @@ class IPyExperiments():
         # extract the var names added during the experiment and delete
         # them, with the exception of those we were told to preserve
         var_names_new = list(set(var_names_cur) - set(self.var_names_start) - set(self.var_names_keep))
+        phase_start = time.perf_counter()
         var_names_deleted = []
         var_names_failed_delete = []
         for x in var_names_new:
@@ -260,8 +570,18 @@ class IPyExperiments():
             if self.var_names_keep:
                 print("Kept:   ", ", ".join(sorted(self.var_names_keep)))
 
+        self.trace_phase("delete variables", phase_start, deleted=len(var_names_deleted))
+
+        # the deleted variables' values may still be held by the output history
+        if self.out_history is not None:
+            self.out_history_finish()
+            self.print_out_history()
+
         # cleanup and reclamation
+        self.gc_freeze_stop()
+        phase_start = time.perf_counter()
         collected = gc.collect()
+        self.trace_phase("gc.collect", phase_start, collected=collected, garbage=len(gc.garbage))
         if collected:
             print("\n*** Circular ref objects gc collected during the experiment:")
             print(f"cleared {collected} objects (only temporary leakage)")
@@ -269,7 +589,16 @@ class IPyExperiments():
             print("\n*** Potential memory leaks during the experiment:")
             print(f"uncollected gc.garbage of {len(gc.garbage)} objects")
         # now we can attempt to reclaim GPU memory
+        phase_start = time.perf_counter()
         self.gpu_clear_cache()
+        if self.backend != 'cpu': self.trace_phase("gpu cache clear", phase_start)
+        # glibc often keeps the freed memory mapped, so it needs to be explicitly returned to the OS
+        if self.malloc_trim:
+            phase_start = time.perf_counter()
+            cpu_ram_used_untrimmed = self.cpu_ram_used()
+            malloc_trim()
+            self.cpu_ram_trimmed = max(0, cpu_ram_used_untrimmed - self.cpu_ram_used())
+            self.trace_phase("malloc_trim", phase_start, trimmed_mb=b2mb(self.cpu_ram_trimmed))
         self.reclaimed = True
 
         # now we can measure how much was reclaimed
@@ -289,16 +618,36 @@ class IPyExperiments():
         print(f"RAM: {'Consumed':>{w}}       {'Reclaimed':>{w}}")
         if 1:
             print(f"CPU: {b2mb(cpu_ram_cons):{w},.0f} {b2mb(cpu_ram_recl):{w},.0f} MB ({cpu_ram_pct*100:6.2f}%)")
+        if self.malloc_trim:
+            print(f"     (reclaimed by gc: {b2mb(cpu_ram_recl - self.cpu_ram_trimmed):,.0f} MB,"
+                  f" returned to OS by malloc_trim: {b2mb(self.cpu_ram_trimmed):,.0f} MB)")
         if self.backend != 'cpu':
             print(f"GPU: {b2mb(gpu_ram_cons):{w},.0f} {b2mb(gpu_ram_recl):{w},.0f} MB ({gpu_ram_pct*100:6.2f}%)")
 
+        self.print_pressure()
+
+        cells = self._cells()
+        if cells and self.hotspots: self.print_cells(cells)
+
+        if self.gc_freeze_data: self.print_gc_freeze()
+
+        self.print_dispatcher()
+
         self.print_state()
 
         print("\n") # extra vertical white space, to not mix with user's outputs
 
+        if self.trace:
+            self.trace_phase("experiment", self.start_perf_counter, consumed_mb=b2mb(cpu_ram_cons), reclaimed_mb=b2mb(cpu_ram_recl))
+            self.trace.memory(self.cpu_ram_used(), self.gpu_ram_used() if self.backend != 'cpu' else None)
+        self.trace_close()
+
         cpu_ram_avail, gpu_ram_avail = self._available()
-        return self._data_format(cpu_ram_avail, cpu_ram_cons, cpu_ram_recl,
+        data = self._data_format(cpu_ram_avail, cpu_ram_cons, cpu_ram_recl,
                                  gpu_ram_avail, gpu_ram_cons, gpu_ram_recl)
+        self.dispatcher.publish('experiment_finish', data=data)
+        self.dispatcher.close()
+        return data
 
 
     def __del__(self):
@@ -331,8 +680,9 @@ class IPyExperimentsCPU(IPyExperiments):
         self.has_gpu = False
         if self.__class__.__name__ == 'IPyExperimentsCPU':
             logger.debug("Starting IPyExperimentsCPU")
-            self.backend_init()
-            self.start()
+            with self.printing():
+                self.backend_init()
+                self.start()
 
     def backend_init(self):
         super().backend_init()
@@ -394,8 +744,9 @@ class IPyExperimentsPytorch(IPyExperimentsGPU):
         self.backend = 'pytorch'
         if self.__class__.__name__ == 'IPyExperimentsPytorch':
             logger.debug("Starting IPyExperimentsPytorch")
-            self.backend_init()
-            self.start()
+            with self.printing():
+                self.backend_init()
+                self.start()
 
     def backend_init(self):
         super().backend_init()
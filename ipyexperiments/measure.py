@@ -0,0 +1,137 @@
+""" Measure any block or function like the cell logger measures a cell, in ipython or not """
+
+import functools
+import threading
+import time
+from collections import namedtuple
+from .cell_logger import (CellLogger, CellLoggerData, CellLoggerMemory, CellLoggerTime, CellLoggerProcess,
+                          b2mb, secs2time)
+from .utils.proc import cpu_ram_used, proc_usage, usage_delta
+
+# the totals of all the measured calls
+MeasureStats = namedtuple('MeasureStats', ['count', 'time_total', 'time_max',
+                                           'cpu_used_delta_total', 'cpu_peaked_delta_max',
+                                           'gpu_used_delta_total', 'gpu_peaked_delta_max'])
+
+class measure():
+    """ Context manager and decorator measuring a block or a function, returning CellLoggerData
+
+    Parameters:
+    * name=None        - the name to report, the function's name when decorating
+    * exp=None         - an IPyExperiments object to take the backend from (CPU-only if None)
+    * peak=True        - sample the peak memory via the cell logger's sampler and gc.collect at the end,
+                         False for a fast path of a few counters reads, for hot functions
+    * gc_collect=True  - gc_collect at the end before the memory measurement (with peak=True)
+    * verbose=False    - print a one line report of each measurement
+
+    Usage:
+
+    with measure() as m:
+        ...
+    print(m.data.cpu.peaked_delta)
+
+    @measure(peak=False)
+    def step(batch): ...
+    print(step.measure.stats)
+
+    `data` is the `CellLoggerData` of the last measurement, `stats` the
+    `MeasureStats` totals of all of them. With peak=True each measurement is
+    taken exactly like a cell is, sharing the sampler thread with any running
+    cell loggers and outer measurements. The fast path only reads the time,
+    the usage counters and the RSS at the start and the end, so `peaked_delta`
+    is 0 and there is no gpu data.
+
+    It's re-entrant: a recursive call of a decorated function, or re-entering
+    the same object's block, is part of the outermost measurement. Each thread
+    has its own measurements.
+    """
+
+    def __init__(self, name=None, exp=None, peak=True, gc_collect=True, verbose=False):
+        self.name       = name
+        self.exp        = exp
+        self.peak       = peak
+        self.gc_collect = gc_collect
+        self.verbose    = verbose
+        self.local      = threading.local() # per-thread nesting depth, cell logger and start counters
+        self.lock       = threading.Lock()
+        self.data       = None
+        self.reset()
+
+    def reset(self):
+        """ Reset the stats """
+        with self.lock:
+            self.count = 0
+            self.time_total = self.time_max = 0
+            self.cpu_used_delta_total = self.cpu_peaked_delta_max = 0
+            self.gpu_used_delta_total = self.gpu_peaked_delta_max = 0
+
+    @property
+    def stats(self):
+        return MeasureStats(self.count, self.time_total, self.time_max,
+                            self.cpu_used_delta_total, self.cpu_peaked_delta_max,
+                            self.gpu_used_delta_total, self.gpu_peaked_delta_max)
+
+    def __enter__(self):
+        local = self.local
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        if depth: return self
+
+        if self.peak:
+            if getattr(local, 'cl', None) is None:
+                local.cl = CellLogger(exp=self.exp, gc_collect=self.gc_collect, gc_pauses=False, leak_runs=0)
+            local.cl.measure_start()
+        else:
+            local.start = (cpu_ram_used(), proc_usage(), time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        local = self.local
+        local.depth -= 1
+        if local.depth: return
+
+        if self.peak:
+            local.cl.measure_stop()
+            data = local.cl.data
+        else:
+            time_end = time.perf_counter()
+            usage_end, cpu_used = proc_usage(), cpu_ram_used()
+            cpu_used_start, usage_start, time_start = local.start
+            time_delta = time_end - time_start
+            cpu_user, cpu_system, *counters = usage_delta(usage_end, usage_start)
+            cpu_util = (cpu_user + cpu_system) / time_delta if time_delta else 0
+            data = CellLoggerData(CellLoggerMemory(cpu_used - cpu_used_start, 0, cpu_used),
+                                  CellLoggerMemory(0, 0, 0), CellLoggerTime(time_delta),
+                                  CellLoggerProcess(cpu_user, cpu_system, cpu_util, *counters),
+                                  None, None, None, None, None, None, None, None)
+        self.add(data)
+        if self.verbose: self.print_report(data)
+
+    def add(self, data):
+        with self.lock:
+            self.data = data
+            self.count += 1
+            self.time_total += data.time.time_delta
+            self.time_max = max(self.time_max, data.time.time_delta)
+            self.cpu_used_delta_total += data.cpu.used_delta
+            self.cpu_peaked_delta_max = max(self.cpu_peaked_delta_max, data.cpu.peaked_delta)
+            self.gpu_used_delta_total += data.gpu.used_delta
+            self.gpu_peaked_delta_max = max(self.gpu_peaked_delta_max, data.gpu.peaked_delta)
+
+    def __call__(self, func):
+        """ Decorate `func`, the measure object is available as `func.measure` """
+        if self.name is None: self.name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self: return func(*args, **kwargs)
+        wrapper.measure = self
+        return wrapper
+
+    def print_report(self, data):
+        out  = f"{self.name or 'measure'}: CPU: {b2mb(data.cpu.used_delta):0.0f}/{b2mb(data.cpu.peaked_delta):0.0f}/{b2mb(data.cpu.used_total):0.0f} MB"
+        if self.peak and self.local.cl.backend == "pytorch":
+            out += f" | GPU: {b2mb(data.gpu.used_delta):0.0f}/{b2mb(data.gpu.peaked_delta):0.0f}/{b2mb(data.gpu.used_total):0.0f} MB"
+        pr = data.process
+        out += f" | Time {secs2time(data.time.time_delta)} | CPU time {pr.cpu_user:0.3f}/{pr.cpu_system:0.3f}s ({pr.cpu_util:0.2f} cores)"
+        print(out + " | (Consumed/Peaked/Used Total)")
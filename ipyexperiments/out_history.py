@@ -0,0 +1,104 @@
+""" The memory held by ipython's output history, and its retention """
+
+from collections import namedtuple
+from .utils.ipython import objs_size
+
+# an output cached by ipython: the cell's execution count, the estimated size of the result, its type name
+OutHistoryEntry = namedtuple('OutHistoryEntry', ['execution_count', 'size', 'type'])
+
+class OutHistory():
+    """ Account for and limit the results ipython keeps in `Out`, `_N`, `_`, `__` and `___`
+
+    Parameters:
+    * shell          - the ipython shell
+    * start=0        - only the outputs of the cells from this execution count on are subject to the retention and purge()
+    * keep=None      - keep at most so many of these outputs, the oldest are dropped first (None for no limit)
+    * max_bytes=None - keep the most recent of these outputs under so many bytes in total (None for no limit)
+
+    ipython keeps every displayed result alive until its output cache of 1000
+    entries fills up, so a big result (a tensor, a DataFrame) that is shown and
+    then deleted isn't freed. The sizes are estimated like the locals of the
+    tracebacks (see `utils.ipython.objs_size`) once per output.
+    """
+
+    def __init__(self, shell, start=0, keep=None, max_bytes=None):
+        self.shell      = shell
+        self.start      = start
+        self.keep       = keep
+        self.max_bytes  = max_bytes
+        self.sizes      = {} # execution count: (id of the result, size)
+        self.dropped    = 0
+        self.registered = False
+
+    @property
+    def out(self):
+        return self.shell.user_ns.get('_oh', {})
+
+    def size_of(self, n, result):
+        cached = self.sizes.get(n)
+        if cached is None or cached[0] != id(result):
+            cached = self.sizes[n] = (id(result), objs_size([result]))
+        return cached[1]
+
+    def entries(self, all=False):
+        """ Return the OutHistoryEntry of the outputs since `start` (all of them if `all`), the biggest first """
+        entries = [OutHistoryEntry(n, self.size_of(n, result), type(result).__name__)
+                   for n, result in list(self.out.items()) if all or n >= self.start]
+        return sorted(entries, key=lambda e: e.size, reverse=True)
+
+    def size(self, all=False):
+        """ Return the estimated memory held by the outputs since `start` (all of them if `all`), each object counted once """
+        return objs_size([result for n, result in list(self.out.items()) if all or n >= self.start])
+
+    def drop(self, n):
+        """ Remove all of ipython's references to the output of cell `n` """
+        shell = self.shell
+        result = self.out.pop(n, None)
+        self.sizes.pop(n, None)
+        dh = shell.displayhook
+        for unders in ('_', '__', '___'):
+            if getattr(dh, unders, None) is result: setattr(dh, unders, '')
+        # ipython pushes them into both
+        for ns in (shell.user_ns, getattr(shell, 'user_ns_hidden', {})):
+            if ns.get(f'_{n}') is result: ns.pop(f'_{n}', None)
+            for unders in ('_', '__', '___'):
+                if ns.get(unders) is result: ns[unders] = ''
+        for exec_result in (getattr(shell, 'last_execution_result', None), getattr(dh, 'exec_result', None)):
+            if exec_result is not None and exec_result.result is result: exec_result.result = None
+
+    def enforce(self):
+        """ Drop the oldest outputs since `start` until they are within `keep` and `max_bytes`, return how many were dropped """
+        if self.keep is None and self.max_bytes is None: return 0
+        ns = sorted(n for n in self.out if n >= self.start)
+        drop = max(0, len(ns) - self.keep) if self.keep is not None else 0
+        if self.max_bytes is not None:
+            # keep the most recent outputs that fit
+            total = 0
+            for i in range(len(ns) - 1, drop - 1, -1):
+                total += self.size_of(ns[i], self.out[ns[i]])
+                if total > self.max_bytes:
+                    drop = i + 1
+                    break
+        for n in ns[:drop]: self.drop(n)
+        self.dropped += drop
+        return drop
+
+    def purge(self):
+        """ Drop all the outputs since `start`, return their OutHistoryEntry """
+        entries = self.entries()
+        for e in entries: self.drop(e.execution_count)
+        return entries
+
+    def register(self):
+        """ Enforce the retention after each cell """
+        if self.registered or (self.keep is None and self.max_bytes is None): return
+        self.shell.events.register("post_run_cell", self.post_run_cell)
+        self.registered = True
+
+    def unregister(self):
+        if not self.registered: return
+        self.shell.events.unregister("post_run_cell", self.post_run_cell)
+        self.registered = False
+
+    def post_run_cell(self, result=None):
+        self.enforce()
@@ -0,0 +1,180 @@
+""" Monitor another process (e.g. a training script or torchrun) from the notebook """
+
+import logging
+import threading
+import time
+import psutil
+from .cell_logger import (CellLoggerData, CellLoggerMemory, CellLoggerTime, CellLoggerProcess, CellLoggerIO,
+                          secs2time, io_reportable, report_memory_compact, report_usage_compact, report_io_compact,
+                          report_memory_lines, report_usage_line, report_io_line)
+from .subscribers import Dispatcher
+from .utils.proc import proc_tree, proc_rss, proc_usage_of, proc_io_counters, io_delta, gpu_used_by_pids
+
+logger = logging.getLogger(__name__)
+
+class ProcessMonitor():
+    """ Track the RAM, the peak RAM, the CPU usage and the I/O of another process and its children
+
+    Parameters:
+    * pid                   - the process to monitor
+    * include_children=True - include all its descendants (e.g. torchrun's workers)
+    * interval=0.1          - secs between the samples the peak memory is taken from
+    * report_interval=0     - also checkpoint every so many secs (0 to only checkpoint when checkpoint() is called)
+    * gpu=True              - also measure the gpu RAM used by the processes, via nvml (if it's available)
+    * compact=False         - one line reports
+    * verbose=True          - print the report of each checkpoint
+
+    Each checkpoint() reports the deltas since the previous one (or since
+    start()) and returns them as `CellLoggerData`, just like the cell logger
+    does for a cell. Unlike the cell logger's, the peak is sampled at an
+    interval, since busy-looping over another process tree would take a core.
+
+    The processes that exit between the checkpoints are still counted, with
+    their CPU usage and I/O as of the last sample that saw them.
+    """
+
+    def __init__(self, pid, include_children=True, interval=0.1, report_interval=0, gpu=True,
+                 compact=False, verbose=True):
+        self.process          = psutil.Process(pid)
+        self.pid              = pid
+        self.include_children = include_children
+        self.interval         = interval
+        self.report_interval  = report_interval
+        self.compact          = compact
+        self.verbose          = verbose
+
+        self.pynvml = None
+        if gpu:
+            try:
+                from .utils.pynvml_gate import load_pynvml_env
+                self.pynvml = load_pynvml_env()
+            except Exception as e:
+                logger.debug(f"ProcessMonitor: no gpu monitoring: {e}")
+
+        self.dispatcher = Dispatcher()
+        self.lock       = threading.Lock()
+        self.stopping   = threading.Event()
+        self.thread     = None
+        self.data       = None
+
+        # the last sample
+        self.pids     = set()
+        self.alive    = True
+        self.cpu_used = self.cpu_used_peak = 0
+        self.gpu_used = self.gpu_used_peak = 0
+        self.usage    = {} # {pid: usage counters}
+        self.io       = {} # {pid: I/O counters}
+
+    def start(self):
+        """ Take the baseline and start sampling """
+        if self.thread is not None: return self
+        with self.lock:
+            self.sample()
+            self.checkpoint_reset()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sampler_func, name=f"ipyexperiments-monitor-{self.pid}")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop sampling and return the data of the final checkpoint """
+        if self.thread is None: return self.data
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        return self.checkpoint()
+
+    def __enter__(self): return self.start()
+
+    def __exit__(self, *exc): self.stop()
+
+    def subscribe(self, sink):
+        """ Call `sink` with a SubscriberEvent of kind 'process' for each checkpoint, from a background thread """
+        self.dispatcher.subscribe(sink)
+
+    def unsubscribe(self, sink):
+        self.dispatcher.unsubscribe(sink)
+
+    def sampler_func(self):
+        next_report = time.perf_counter() + self.report_interval
+        while not self.stopping.wait(self.interval):
+            with self.lock: self.sample()
+            if self.report_interval and time.perf_counter() >= next_report:
+                self.checkpoint()
+                next_report = time.perf_counter() + self.report_interval
+
+    def sample(self):
+        """ Update the current and peak used memory and the per-pid counters, called with the lock held """
+        procs = proc_tree(self.process, self.include_children)
+        self.alive = bool(procs)
+        self.pids  = {p.pid for p in procs}
+        self.cpu_used = proc_rss(procs)
+        self.gpu_used = gpu_used_by_pids(self.pynvml, self.pids) if self.pynvml else 0
+        self.cpu_used_peak = max(self.cpu_used_peak, self.cpu_used)
+        self.gpu_used_peak = max(self.gpu_used_peak, self.gpu_used)
+        # the last seen counters of each pid, so that the exited ones still count
+        for proc in procs:
+            usage, io = proc_usage_of(proc), proc_io_counters(proc)
+            if usage is not None: self.usage[proc.pid] = usage
+            if io is not None: self.io[proc.pid] = io
+
+    def checkpoint_reset(self):
+        """ Make the current sample the baseline of the next checkpoint """
+        self.time_start     = time.perf_counter()
+        self.cpu_used_start = self.cpu_used_peak = self.cpu_used
+        self.gpu_used_start = self.gpu_used_peak = self.gpu_used
+        # the exited processes were accounted for by now
+        self.usage          = {pid: c for pid, c in self.usage.items() if pid in self.pids}
+        self.io             = {pid: c for pid, c in self.io.items() if pid in self.pids}
+        self.usage_start    = dict(self.usage)
+        self.io_start       = dict(self.io)
+
+    def checkpoint(self):
+        """ Report the deltas since the previous checkpoint and return them as CellLoggerData """
+        with self.lock:
+            self.sample()
+            time_delta = time.perf_counter() - self.time_start
+            memory = []
+            for used, start, peak in ((self.cpu_used, self.cpu_used_start, self.cpu_used_peak),
+                                      (self.gpu_used, self.gpu_used_start, self.gpu_used_peak)):
+                # the same as the cell logger's consumed and peaked
+                used_delta, peaked_delta = used - start, max(0, peak - start)
+                if used_delta > 0: peaked_delta = max(0, peaked_delta - used_delta)
+                memory.append(CellLoggerMemory(used_delta, peaked_delta, used))
+
+            cpu_user, cpu_system, *counters = io_delta(self.usage, self.usage_start)
+            cpu_util = (cpu_user + cpu_system) / time_delta if time_delta else 0
+            process = CellLoggerProcess(cpu_user, cpu_system, cpu_util, *counters)
+
+            io = None
+            if self.io:
+                read_bytes, write_bytes, rchar, wchar, syscr, syscw = io_delta(self.io, self.io_start)
+                rate = lambda x: x / time_delta if time_delta else 0
+                io = CellLoggerIO(read_bytes, write_bytes, rchar, wchar, syscr, syscw,
+                                  rate(read_bytes), rate(write_bytes), rate(rchar), rate(wchar))
+
+            self.data = CellLoggerData(memory[0], memory[1], CellLoggerTime(time_delta), process, io,
+                                       None, None, None, None, None, None, None)
+            self.checkpoint_reset()
+
+        if self.verbose: self.print_report()
+        self.dispatcher.publish('process', data=self.data)
+        return self.data
+
+    def print_report(self):
+        """ Print the last checkpoint's data """
+        d, pre = self.data, '･ '
+        name = f"PID {self.pid}" + (f" (+{len(self.pids) - 1} children)" if len(self.pids) > 1 else "") + ("" if self.alive else " (exited)")
+        gpu = d.gpu if self.pynvml is not None else None
+        if self.compact:
+            out  = f"{name} | {report_memory_compact(d.cpu, gpu)} | Time {secs2time(d.time.time_delta)}"
+            out += " | " + report_usage_compact(d.process)
+            if io_reportable(d.io): out += " | " + report_io_compact(d.io)
+            print(out + " | (Consumed/Peaked/Used Total)")
+            return
+
+        print(f"{pre}{name}")
+        for line in report_memory_lines(pre, d.cpu, gpu, "Elapsed time", d.time.time_delta): print(line)
+        print(report_usage_line(pre, d.process))
+        if io_reportable(d.io): print(report_io_line(pre, d.io))
@@ -0,0 +1,126 @@
+""" pytest plugin: per-test time and memory accounting with budgets
+
+Enabled with `pytest -p ipyexperiments.pytest_plugin`, or with
+`pytest_plugins = ["ipyexperiments.pytest_plugin"]` in the top conftest.py.
+It's not registered as an auto-loaded entry point, since importing
+ipyexperiments configures the logging and the CUDA environment of the whole
+process, which other projects' test suites shouldn't get just by having it
+installed. Only the tests marked with
+`@pytest.mark.ipyexp(...)` are measured, unless `--ipyexp` is passed, which
+measures all of them and prints the top consumers at the end of the session.
+"""
+
+import pytest
+from .cell_logger import b2mb
+from .measure import measure
+
+# marker keyword: (measurement, unit) - the measurement's value is compared to the budget in the unit
+budgets = dict(
+    max_time        = ('time',     'secs'),
+    max_cpu_time    = ('cpu_time', 'secs'),
+    max_consumed_mb = ('consumed', 'MB'),
+    max_peak_mb     = ('peak',     'MB'),
+)
+
+# the measurements are passed to the controller in the reports' user_properties, which xdist
+# transfers from its workers and junitxml records as properties
+prefix = 'ipyexp_'
+
+def pytest_addoption(parser):
+    group = parser.getgroup("ipyexperiments", "per-test time and memory accounting")
+    group.addoption("--ipyexp", action="store_true", default=False,
+                    help="measure the time and memory of all the tests and print the top consumers")
+    group.addoption("--ipyexp-top", type=int, default=10, metavar="N",
+                    help="number of the top consumers to print (default: 10)")
+    group.addoption("--ipyexp-sort", default="peak", choices=["peak", "consumed", "time", "cpu_time"],
+                    help="the measurement to sort the top consumers by (default: peak)")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers",
+        "ipyexp(max_peak_mb=None, max_consumed_mb=None, max_time=None, max_cpu_time=None): "
+        "measure the test's time and memory and fail it if it goes over any of these budgets")
+    config.pluginmanager.register(IPyExpPlugin(config), "ipyexperiments-accounting")
+
+def measurements(data):
+    """ Return the plugin's measurements of a test from its CellLoggerData """
+    return dict(
+        time     = data.time.time_delta,
+        cpu_time = data.process.cpu_user + data.process.cpu_system,
+        consumed = data.cpu.used_delta,
+        # the highest RSS above the one at the start of the test
+        peak     = max(0, data.cpu.used_delta) + data.cpu.peaked_delta,
+    )
+
+def budget_failures(limits, values):
+    """ Return the descriptions of the budgets in `limits` that `values` went over """
+    failures = []
+    for key, limit in limits.items():
+        name, unit = budgets[key]
+        value = values[name] / 2**20 if unit == 'MB' else values[name]
+        if value > limit: failures.append(f"{name} {value:,.3f} {unit} > {key}={limit}")
+    return failures
+
+class IPyExpPlugin():
+    """ Measures the call phase of the tests and collects their measurements, including from xdist workers """
+
+    def __init__(self, config):
+        self.config  = config
+        self.all     = config.getoption("ipyexp")
+        self.top     = config.getoption("ipyexp_top")
+        self.sort    = config.getoption("ipyexp_sort")
+        self.measure = measure(gc_collect=True)
+        self.results = [] # (nodeid, measurements)
+
+    def limits(self, item):
+        marker = item.get_closest_marker("ipyexp")
+        return marker.kwargs if marker is not None else None
+
+    def pytest_runtest_setup(self, item):
+        limits = self.limits(item)
+        if limits is None: return
+        unknown = set(limits) - set(budgets)
+        if unknown or item.get_closest_marker("ipyexp").args:
+            raise ValueError(f"{item.nodeid}: ipyexp marker accepts only the keyword arguments {list(budgets)}")
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        # sampling only during the call, the setup and teardown of the fixtures aren't counted
+        if not (self.all or self.limits(item) is not None):
+            yield
+            return
+        with self.measure:
+            yield
+        item.ipyexp_data = self.measure.data
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        data = getattr(item, "ipyexp_data", None)
+        if report.when != "call" or data is None: return
+        del item.ipyexp_data
+
+        values = measurements(data)
+        report.user_properties.extend((prefix + k, v) for k, v in values.items())
+        limits = self.limits(item)
+        if limits and report.passed:
+            failures = budget_failures(limits, values)
+            if failures:
+                report.outcome = "failed"
+                report.longrepr = "ipyexperiments budget exceeded:\n" + "\n".join(failures)
+
+    def pytest_runtest_logreport(self, report):
+        if report.when != "call": return
+        values = {k[len(prefix):]: v for k, v in report.user_properties if k.startswith(prefix)}
+        if values: self.results.append((report.nodeid, values))
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.results or not self.all: return
+        tr, key = terminalreporter, self.sort
+        results = sorted(self.results, key=lambda r: r[1][key], reverse=True)[:self.top]
+        tr.write_sep("=", f"ipyexperiments: top {len(results)} of {len(self.results)} tests by {key}")
+        tr.write_line(f"{'Time':>9} {'CPU time':>9} {'△Consumed':>10} {'△Peak':>10}")
+        for nodeid, v in results:
+            tr.write_line(f"{v['time']:8.3f}s {v['cpu_time']:8.3f}s {b2mb(v['consumed']):7,.0f} MB {b2mb(v['peak']):7,.0f} MB  {nodeid}")
+        total = lambda k: sum(v[k] for _, v in self.results)
+        tr.write_line(f"total: time {total('time'):0.3f}s, CPU time {total('cpu_time'):0.3f}s")
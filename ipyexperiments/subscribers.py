@@ -0,0 +1,88 @@
+""" Asynchronous delivery of the cell and experiment measurements to subscribed sinks """
+
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# kind is one of 'experiment_start', 'cell', 'experiment_finish'
+# * record - CellLoggerRecord of the cell, None for the experiment events
+# * data   - CellLoggerData of the cell, IPyExperimentData of the experiment
+SubscriberEvent = namedtuple('SubscriberEvent', ['kind', 'time', 'record', 'data'])
+
+class Dispatcher():
+    """ Deliver the published events to the subscribed sinks from a background thread
+
+    Parameters:
+    * maxsize=1000  - number of events waiting for delivery, the new ones are dropped when it's full
+
+    A sink is any callable, called with one `SubscriberEvent` at a time in the
+    order they were published. `publish()` only puts the event on the queue,
+    so a slow sink (file, socket, database) never delays the cell. The events
+    that didn't fit are counted in `dropped`, the sinks that raised in `errors`.
+
+    The thread is started by the first subscribe(), so there is no cost
+    when nothing is subscribed, and exits once close() was called and the
+    queue is drained.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.sinks   = () # replaced, never mutated, so the thread can read it without the lock
+        self.queue   = queue.Queue(maxsize)
+        self.dropped = 0
+        self.errors  = 0
+        self.closed  = False
+        self.lock    = threading.Lock()
+        self.thread  = None
+
+    def subscribe(self, sink):
+        """ Deliver the events published from now on to the `sink` callable """
+        if not callable(sink): raise ValueError('expecting a callable sink')
+        with self.lock:
+            if sink in self.sinks: return
+            self.sinks += (sink,)
+            if self.thread is None and not self.closed:
+                self.thread = threading.Thread(target=self.dispatcher_func, name="ipyexperiments-dispatcher")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def unsubscribe(self, sink):
+        with self.lock:
+            self.sinks = tuple(s for s in self.sinks if s != sink)
+
+    def publish(self, kind, record=None, data=None):
+        """ Queue a SubscriberEvent for delivery, never blocks """
+        if not self.sinks or self.closed: return
+        try:
+            self.queue.put_nowait(SubscriberEvent(kind, time.time(), record, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        """ Wait for the queued events to be delivered, return False on timeout """
+        with self.queue.all_tasks_done:
+            return self.queue.all_tasks_done.wait_for(lambda: not self.queue.unfinished_tasks, timeout)
+
+    def close(self):
+        """ Stop accepting events, the queued ones are still delivered """
+        self.closed = True
+
+    def dispatcher_func(self):
+        while True:
+            try:
+                event = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.closed:
+                    with self.lock: self.thread = None
+                    return
+                continue
+            for sink in self.sinks:
+                try:
+                    sink(event)
+                except Exception:
+                    self.errors += 1
+                    logger.exception(f"Dispatcher: the sink {sink} failed")
+            self.queue.task_done()
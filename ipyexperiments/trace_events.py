@@ -0,0 +1,80 @@
+""" Chrome trace-event / Perfetto export of an experiment's cells and memory counters """
+
+import json
+import os
+import threading
+import time
+
+def trace_ts(perf_counter_time):
+    " trace-event timestamps are in microseconds "
+    return round(perf_counter_time * 1e6, 3)
+
+class TraceEventWriter():
+    """ Write the experiment as a trace-event json file, to be opened in chrome://tracing or https://ui.perfetto.dev
+
+    Parameters:
+    * path          - the file to write to
+    * interval=0.1  - secs between the memory counter samples taken during the cells (0 to only sample at the cell boundaries)
+
+    The events are written as they happen, so nothing is buffered in memory,
+    and the file is flushed at the end of each cell. The json array is only
+    closed by close(), but the trace viewers accept an unterminated one too,
+    so the file can be looked at while the experiment is still running.
+
+    The events are written from the main thread and the sampler thread, the
+    timestamps are `time.perf_counter()` based.
+    """
+
+    # the timeline rows
+    tid_cells      = 1
+    tid_experiment = 2
+
+    def __init__(self, path, interval=0.1):
+        self.path     = path
+        self.interval = interval
+        self.pid      = os.getpid()
+        self.lock     = threading.Lock()
+        self.first    = True
+        self.file     = open(path, "w")
+        self.file.write("[\n")
+
+        self.metadata("process_name", name="ipyexperiments")
+        self.metadata("thread_name", self.tid_cells, name="cells")
+        self.metadata("thread_name", self.tid_experiment, name="experiment")
+
+    def write(self, event):
+        line = json.dumps(event, separators=(',', ':'))
+        with self.lock:
+            if self.file is None: return
+            self.file.write(line if self.first else ",\n" + line)
+            self.first = False
+
+    def metadata(self, kind, tid=0, **args):
+        self.write(dict(ph="M", name=kind, pid=self.pid, tid=tid, args=args))
+
+    def complete(self, name, cat, start, duration, tid, args=None):
+        """ A duration event, start and duration are in secs """
+        event = dict(ph="X", name=name, cat=cat, ts=trace_ts(start), dur=trace_ts(duration), pid=self.pid, tid=tid)
+        if args: event["args"] = args
+        self.write(event)
+
+    def counter(self, name, ts, **values):
+        """ A counter track sample, ts is a `time.perf_counter()` time """
+        self.write(dict(ph="C", name=name, ts=trace_ts(ts), pid=self.pid, args=values))
+
+    def memory(self, cpu_used, gpu_used=None, ts=None):
+        """ Sample the memory counter tracks, in MBs """
+        ts = time.perf_counter() if ts is None else ts
+        self.counter("CPU RAM", ts, used=round(cpu_used/2**20, 1))
+        if gpu_used is not None: self.counter("GPU RAM", ts, used=round(gpu_used/2**20, 1))
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None: self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is None: return
+            self.file.write("\n]\n")
+            self.file.close()
+            self.file = None
@@ -3,9 +3,12 @@
 ############# ipython on exception memory leak prevention helpers ############
 
 import functools
+import gc
 import os
 import sys
 import traceback
+import weakref
+import psutil
 
 def is_in_ipython():
     "Is the code running in the ipython environment (jupyter including)"
@@ -71,3 +74,161 @@ class ipython_tb_clear_frames_ctx():
         if not exc_val: return True
         traceback.clear_frames(exc_tb)
         raise exc_type(exc_val).with_traceback(exc_tb) from None
+
+
+def tb_frames(value):
+    " The frames of the exception's traceback and of the tracebacks of the exceptions it's chained to "
+    frames, seen = [], set()
+    while value is not None and id(value) not in seen:
+        seen.add(id(value))
+        tb = value.__traceback__
+        while tb is not None:
+            frames.append(tb.tb_frame)
+            tb = tb.tb_next
+        value = value.__cause__ or value.__context__
+    return frames
+
+def obj_size(obj):
+    " The size of the object's data: numpy arrays and torch tensors report their buffers', the rest their own "
+    try:
+        nbytes = getattr(obj, 'nbytes', None)
+        if isinstance(nbytes, int): return nbytes
+        if hasattr(obj, 'element_size') and hasattr(obj, 'nelement'): return obj.element_size() * obj.nelement()
+    except Exception:
+        pass
+    return sys.getsizeof(obj)
+
+def objs_size(objs, seen=None):
+    """ Estimate the memory held by the objects
+
+    Counts each object once (also across the calls sharing `seen`), with the
+    items of the lists, tuples, sets and dicts one level deep.
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    def add(obj):
+        nonlocal size
+        if id(obj) in seen: return
+        seen.add(id(obj))
+        size += obj_size(obj)
+    for obj in objs:
+        add(obj)
+        if isinstance(obj, dict): obj = obj.values()
+        if isinstance(obj, (list, tuple, set, frozenset, type({}.values()))):
+            for item in list(obj)[:10000]: add(item)
+    return size
+
+def tb_locals_size(frames):
+    """ Estimate the memory held by the locals of the frames
+
+    The module level frames are skipped, since their locals are the
+    notebook's namespace, which is kept regardless.
+    """
+    seen = set()
+    return sum(objs_size(list(frame.f_locals.values()), seen) for frame in frames
+               if frame.f_locals is not frame.f_globals)
+
+class ipython_tb_clear_frames_hook():
+    """Reclaim general/GPU RAM on any exception in any cell (ipython exception handler).
+
+    Parameters:
+    * shell=None       - the ipython shell to install the handler into (the current one if None)
+    * min_bytes=2**26  - clear the frames only if their locals hold at least so many bytes
+    * keep_frames=False - don't clear the frames, e.g. to use `%debug` on the next exception
+    * exp=None         - an IPyExperiments object to measure the reclaimed memory with (CPU-only if None)
+    * verbose=True     - report the reclaimed memory
+
+    Unlike `ipython_tb_clear_frames`, nothing needs to be wrapped: this
+    installs a custom exception handler, which shows the traceback as usual
+    (and runs the debugger under `%pdb on`) and then clears the locals of its
+    frames if they are big enough, so that the memory they hold can be
+    reclaimed.
+
+    `%debug` needs the frames' locals, so set `keep_frames = True` and re-run
+    the failing cell to debug it.
+
+    A custom handler installed before this one still handles its exceptions,
+    and is restored by `uninstall()`.
+
+    For example:
+    ```
+    hook = ipython_tb_clear_frames_hook().install()
+    ...
+    hook.uninstall()
+    ```
+    """
+
+    exceptions = (Exception, KeyboardInterrupt)
+
+    def __init__(self, shell=None, min_bytes=2**26, keep_frames=False, exp=None, verbose=True):
+        if shell is None:
+            from IPython import get_ipython
+            shell = get_ipython()
+            if shell is None: raise RuntimeError("ipython_tb_clear_frames_hook requires an ipython shell")
+        self.shell       = shell
+        self.min_bytes   = min_bytes
+        self.keep_frames = keep_frames
+        # weak, so that the installed handler doesn't keep the experiment from being deleted (and finished)
+        self.exp         = weakref.ref(exp) if exp is not None else lambda: None
+        self.verbose     = verbose
+        self.active      = False
+        self.reclaimed   = None # (cpu, gpu) bytes reclaimed after the last exception, None if the frames weren't cleared
+
+    def install(self):
+        if self.active: return self
+        shell = self.shell
+        self.prev = (shell.custom_exceptions, shell.CustomTB)
+        shell.set_custom_exc(tuple(set(self.exceptions + shell.custom_exceptions)), self.handler)
+        self.handler_installed = shell.CustomTB
+        self.active = True
+        return self
+
+    def uninstall(self):
+        if not self.active: return
+        self.active = False
+        shell = self.shell
+        # restore the previous handler unless another one was installed since, this one then passes through
+        if shell.CustomTB is self.handler_installed:
+            shell.custom_exceptions, shell.CustomTB = self.prev
+
+    def __enter__(self): return self.install()
+
+    def __exit__(self, *exc): self.uninstall()
+
+    def used(self):
+        exp = self.exp()
+        if exp is None: return psutil.Process().memory_info().rss, 0
+        return exp.cpu_ram_used(), exp.gpu_ram_used()
+
+    def handler(self, shell, etype, value, tb, tb_offset=None):
+        prev_exceptions, prev_handler = self.prev
+        if issubclass(etype, prev_exceptions): prev_handler(etype, value, tb, tb_offset)
+        else: shell.showtraceback((etype, value, tb), tb_offset=tb_offset)
+
+        self.reclaimed = None
+        if not self.active or self.keep_frames: return None
+        frames = tb_frames(value)
+        size = tb_locals_size(frames)
+        if size < self.min_bytes: return None
+
+        gc.collect()
+        cpu_before, gpu_before = self.used()
+        for frame in frames:
+            try:
+                frame.clear()
+                # the locals dict cached by accessing f_locals isn't cleared with the frame, re-syncing empties it
+                frame.f_locals
+            except RuntimeError: # still executing
+                pass
+        del frames
+        gc.collect()
+        exp = self.exp()
+        if exp is not None: exp.gpu_clear_cache()
+        cpu_after, gpu_after = self.used()
+        self.reclaimed = (cpu_before - cpu_after, gpu_before - gpu_after)
+
+        if self.verbose:
+            out = f"･ Cleared the traceback's frames holding ~{size/2**20:,.0f} MB: reclaimed CPU {self.reclaimed[0]/2**20:,.0f} MB"
+            if exp is not None and exp.backend != 'cpu': out += f", GPU {self.reclaimed[1]/2**20:,.0f} MB"
+            print(out + " (to %debug it, keep the frames and re-run the cell)")
+        return None
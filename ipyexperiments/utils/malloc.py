@@ -0,0 +1,37 @@
+""" Helpers to return freed heap memory to the OS """
+
+import ctypes
+import platform
+
+_malloc_trim_func = None
+
+def _load_malloc_trim():
+    "Return glibc's malloc_trim function, or None if it's not available"
+    global _malloc_trim_func
+    if _malloc_trim_func is None:
+        _malloc_trim_func = False
+        if platform.system() == "Linux" and platform.libc_ver()[0] == "glibc":
+            try:
+                _malloc_trim_func = ctypes.CDLL("libc.so.6").malloc_trim
+                _malloc_trim_func.argtypes = [ctypes.c_size_t]
+                _malloc_trim_func.restype  = ctypes.c_int
+            except (OSError, AttributeError):
+                _malloc_trim_func = False
+    return _malloc_trim_func or None
+
+def is_malloc_trim_available():
+    "Is glibc's malloc_trim available on this platform"
+    return _load_malloc_trim() is not None
+
+def malloc_trim():
+    """Return freed heap memory to the OS by calling glibc's `malloc_trim(0)`
+
+    glibc often keeps the freed memory mapped in its arenas, so the process'
+    RSS doesn't go down even after the objects were freed.
+
+    Returns `True` if some memory was released, `False` otherwise. It's a no-op
+    returning `False` on platforms without glibc.
+    """
+    func = _load_malloc_trim()
+    if func is None: return False
+    return bool(func(0))
@@ -0,0 +1,228 @@
+""" Find the smallest CPU memory budget a function or a cell needs, by running it in subprocesses under a limit """
+
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+import psutil
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+# the memory the probe used above its baseline, in the measure of the limit
+# * budget    - the limit above the baseline, None for the unlimited probe
+# * ok        - the function completed
+# * peak_used - the peak of the limited measure (RSS, address space or data segment) above the baseline
+# * peak_rss  - the peak RSS of the probe process
+# * error     - why it failed
+MemoryProbe = namedtuple('MemoryProbe', ['budget', 'ok', 'peak_used', 'peak_rss', 'time', 'error'])
+MinMemory   = namedtuple('MinMemory', ['budget', 'baseline', 'peak_used', 'probes'])
+
+# how many times a given `high` budget that isn't enough is doubled before giving up
+max_doublings = 8
+
+# limit: the psutil memory_info() field its baseline and peak are measured in
+limit_measures = dict(rss='rss', address_space='vms', data='data')
+
+def run_cell(source):
+    " run the source of a cell in the probe process "
+    exec(compile(source, "<cell>", "exec"), {"__name__": "__main__"})
+
+def probe_child(conn, func, args, kwargs, limit, budget):
+    """ The probe process: report the baseline, set the limit, run the function, report the outcome """
+    mi = psutil.Process().memory_info()
+    baseline = getattr(mi, limit_measures[limit])
+    conn.send(('start', baseline))
+    if budget is not None and limit != 'rss':
+        rlimit = resource.RLIMIT_AS if limit == 'address_space' else resource.RLIMIT_DATA
+        resource.setrlimit(rlimit, (baseline + budget, resource.getrlimit(rlimit)[1]))
+
+    start, ok, error = time.perf_counter(), True, None
+    try:
+        if isinstance(func, str): run_cell(func)
+        else: func(*args, **kwargs)
+    except BaseException as e:
+        ok, error = False, "".join(traceback.format_exception_only(type(e), e)).strip()
+    duration = time.perf_counter() - start
+
+    maxrss = 0
+    if resource is not None: # KBs on linux, bytes on osx
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    conn.send(('done', ok, error, duration, maxrss))
+    conn.close()
+
+class Probe():
+    """ A running probe process, watched by the parent for its peak memory and, with limit='rss', killed if over budget """
+
+    def __init__(self, ctx, func, args, kwargs, limit, budget, timeout):
+        self.budget, self.limit, self.timeout = budget, limit, timeout
+        self.conn, child_conn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=probe_child, args=(child_conn, func, args, kwargs, limit, budget), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.proc = psutil.Process(self.process.pid)
+        self.baseline = None
+        self.peak = self.peak_rss = 0
+        self.start = time.perf_counter()
+        self.result = None
+
+    def poll(self):
+        """ Sample the probe, return its MemoryProbe once it's done, None while it's running """
+        if self.result is not None: return self.result
+        try:
+            mi = self.proc.memory_info()
+            self.peak     = max(self.peak, getattr(mi, limit_measures[self.limit]))
+            self.peak_rss = max(self.peak_rss, mi.rss)
+        except psutil.Error:
+            pass
+
+        done = self.recv()
+        if done: return self.finish(*done)
+
+        if self.budget is not None and self.limit == 'rss' and self.baseline is not None \
+           and self.peak - self.baseline > self.budget:
+            return self.kill("RSS exceeded the budget")
+        if self.timeout and time.perf_counter() - self.start > self.timeout:
+            return self.kill(f"timed out after {self.timeout} secs")
+        if not self.process.is_alive():
+            # its last message may have arrived after the check above
+            done = self.recv()
+            if done: return self.finish(*done)
+            return self.finish(False, f"the probe process died with exit code {self.process.exitcode}",
+                               time.perf_counter() - self.start, 0)
+        return None
+
+    def recv(self):
+        """ Read the probe's messages, return the outcome once it's done, None otherwise """
+        try:
+            while self.conn.poll():
+                msg = self.conn.recv()
+                if msg[0] == 'start': self.baseline = msg[1]
+                else: return msg[1:]
+        except (EOFError, OSError): # the probe died
+            pass
+        return None
+
+    def kill(self, error):
+        self.process.kill()
+        return self.finish(False, error, time.perf_counter() - self.start, 0)
+
+    def finish(self, ok, error, duration, maxrss):
+        self.process.join()
+        self.conn.close()
+        baseline = self.baseline or 0
+        self.result = MemoryProbe(self.budget, ok, max(0, self.peak - baseline), max(self.peak_rss, maxrss), duration, error)
+        return self.result
+
+def run_probes(ctx, func, args, kwargs, limit, budgets, timeout, interval=0.005):
+    """ Run a probe per budget concurrently, return their MemoryProbe and the baseline """
+    probes = [Probe(ctx, func, args, kwargs, limit, budget, timeout) for budget in budgets]
+    try:
+        while not all(p.result for p in probes):
+            for p in probes: p.poll()
+            time.sleep(interval)
+    finally:
+        for p in probes:
+            if p.result is None: p.kill("interrupted")
+    return [p.result for p in probes], max((p.baseline or 0) for p in probes)
+
+def print_probe(probe):
+    budget = "unlimited" if probe.budget is None else f"{probe.budget/2**20:,.0f} MB"
+    outcome = "ok    " if probe.ok else "failed"
+    out = f"･ budget {budget:>12}: {outcome} | peak used {probe.peak_used/2**20:,.0f} MB, peak RSS {probe.peak_rss/2**20:,.0f} MB | {probe.time:0.3f}s"
+    if not probe.ok: out += f" | {probe.error}"
+    print(out)
+
+def find_min_memory(func, args=(), kwargs=None, limit='rss', tolerance=2**24, high=None, workers=None,
+                    timeout=None, start_method=None, verbose=True):
+    """ Binary-search the smallest memory budget at which `func(*args, **kwargs)` still completes
+
+    Parameters:
+    * func                - the function to run, or the source of a cell (str)
+    * args=(), kwargs=None - the function's arguments
+    * limit='rss'         - how the budget is enforced:
+      'rss'           - the probe is killed once its RSS grows by more than the budget (a cgroup-like watchdog)
+      'address_space' - RLIMIT_AS, allocations fail with MemoryError once the address space grows by more than the budget
+      'data'          - RLIMIT_DATA, the same for the data segment and the private mappings (linux-4.7+)
+    * tolerance=2**24     - stop once the smallest passing and the biggest failing budgets are this close (bytes)
+    * high=None           - a budget known to be enough, by default measured by an unlimited probe, which
+                            also runs if the given one isn't enough, to tell whether it fails regardless
+    * workers=None        - probes to run in parallel, by default half the cores up to 4
+    * timeout=None        - secs after which a probe is killed and counts as failed
+    * start_method=None   - the multiprocessing start method, 'fork' by default where available, so that
+                            functions defined in the notebook can be used, 'spawn' requires an importable function
+    * verbose=True        - print each probe
+
+    The budgets are above the probe process' own baseline, which is in
+    `MinMemory.baseline`, the same measure as the limit. Returns
+    `MinMemory(budget, baseline, peak_used, probes)`, where `budget` is the
+    smallest budget the function completed with and `probes` the
+    `MemoryProbe` of each run. With several workers each round probes as many
+    evenly spaced budgets at once. A probe failing with any exception counts
+    as not enough memory, since that's how many libraries report it.
+    """
+    if limit not in limit_measures: raise ValueError(f"limit must be one of {list(limit_measures)}")
+    if limit != 'rss' and resource is None: raise ValueError(f"limit='{limit}' requires the resource module (unix)")
+    if limit == 'data' and not hasattr(psutil.Process().memory_info(), 'data'):
+        raise ValueError("limit='data' requires linux")
+    if start_method is None:
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    ctx = multiprocessing.get_context(start_method)
+    if workers is None: workers = max(1, min(4, (os.cpu_count() or 1) // 2))
+    kwargs = kwargs or {}
+    run = lambda budgets: run_probes(ctx, func, args, kwargs, limit, budgets, timeout)
+
+    probes = []
+    high_measured = high is None
+    if high is None:
+        # the unlimited run tells how much is enough
+        (probe,), baseline = run([None])
+        probes.append(probe)
+        if verbose: print_probe(probe)
+        if not probe.ok: raise RuntimeError(f"the function failed without a memory limit: {probe.error}")
+        high = probe.peak_used + tolerance
+
+    # make sure high is enough, the runs vary
+    checked, doublings = high_measured, 0
+    while True:
+        (probe,), baseline = run([high])
+        probes.append(probe)
+        if verbose: print_probe(probe)
+        if probe.ok: break
+        if not checked:
+            # tell a function that fails regardless of the memory from one that needs more than the given high
+            (probe,), baseline = run([None])
+            probes.append(probe)
+            if verbose: print_probe(probe)
+            if not probe.ok: raise RuntimeError(f"the function failed without a memory limit: {probe.error}")
+            checked = True
+            high = max(high, probe.peak_used + tolerance)
+            continue
+        doublings += 1
+        if doublings > max_doublings:
+            raise RuntimeError(f"the function still failed with a budget of {high/2**20:,.0f} MB: {probe.error}")
+        high *= 2
+
+    low, best = 0, probe
+    while high - low > tolerance:
+        step = (high - low) / (workers + 1)
+        budgets = [int(low + step * i) for i in range(1, workers + 1)]
+        results, _ = run(budgets)
+        probes.extend(results)
+        for probe in results:
+            if verbose: print_probe(probe)
+        passed = [p for p in results if p.ok]
+        if passed:
+            best = min(passed, key=lambda p: p.budget)
+            high = best.budget
+        # the failures above a passing budget are noise, assume the needed memory is monotonic
+        low = max([p.budget for p in results if not p.ok and p.budget < high], default=low)
+
+    if verbose:
+        print(f"\n*** Minimum memory: {high/2**20:,.0f} MB above the baseline {limit} of {baseline/2**20:,.0f} MB"
+              f" (within {tolerance/2**20:,.0f} MB, {len(probes)} probes)")
+    return MinMemory(high, baseline, best.peak_used, probes)
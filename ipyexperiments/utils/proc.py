@@ -0,0 +1,172 @@
+""" Cheap counters of this process (and of other processes): RSS, CPU usage and I/O """
+
+import psutil
+import time
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+process = psutil.Process()
+def cpu_ram_used():  return process.memory_info().rss
+
+# the process and thread usage counters: user and system cpu time, voluntary and
+# involuntary context switches, minor and major page faults
+def proc_usage():
+    " return the usage counters of this process "
+    if resource is not None:
+        r = resource.getrusage(resource.RUSAGE_SELF)
+        return (r.ru_utime, r.ru_stime, r.ru_nvcsw, r.ru_nivcsw, r.ru_minflt, r.ru_majflt)
+    cpu, ctx = process.cpu_times(), process.num_ctx_switches()
+    return (cpu.user, cpu.system, ctx.voluntary, ctx.involuntary, 0, 0)
+
+def thread_usage():
+    " return the usage counters of the calling thread (only the cpu time is available on non-linux) "
+    if hasattr(resource, "RUSAGE_THREAD"): # linux
+        r = resource.getrusage(resource.RUSAGE_THREAD)
+        return (r.ru_utime, r.ru_stime, r.ru_nvcsw, r.ru_nivcsw, r.ru_minflt, r.ru_majflt)
+    return (time.thread_time(), 0, 0, 0, 0, 0)
+
+def usage_delta(end, start): return tuple(e - s for e, s in zip(end, start))
+
+# the memory pressure: the swap used by this process, which isn't part of its RSS, and the
+# total time the tasks stalled waiting for memory (PSI, linux-4.20+): 'some' - at least one
+# task, 'full' - all the non-idle tasks at once, of this process' cgroup (v2) or of the system
+def proc_swap(pid='self'):
+    " return the swap used by the process (VmSwap), 0 where not available "
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmSwap:"): return int(line.split()[1]) * 1024
+    except OSError: # not linux
+        pass
+    return 0
+
+def memory_pressure(path):
+    " return the total (some, full) stall secs from a PSI file, None if it can't be read "
+    if path is None: return None
+    try:
+        with open(path) as f: lines = f.read().splitlines()
+    except OSError: # gone, or PSI is disabled (psi=0)
+        return None
+    totals = {line.split()[0]: int(line.rsplit("total=", 1)[1]) / 1e6 for line in lines if "total=" in line}
+    return (totals.get("some", 0), totals.get("full", 0))
+
+def memory_pressure_file():
+    " return (path, scope) of the memory PSI file of this process' cgroup, or else of the system, (None, None) if neither is available "
+    try:
+        with open("/proc/self/cgroup") as f:
+            path = next((l.strip()[3:] for l in f if l.startswith("0::")), None)
+    except OSError:
+        path = None
+    # the root cgroup has no pressure file, it's the system's
+    if path and path != "/":
+        for root in ("/sys/fs/cgroup", "/sys/fs/cgroup/unified"): # the latter with the hybrid hierarchy
+            candidate = f"{root}{path}/memory.pressure"
+            if memory_pressure(candidate) is not None: return candidate, "cgroup"
+    if memory_pressure("/proc/pressure/memory") is not None: return "/proc/pressure/memory", "system"
+    return None, None
+
+pressure_path, pressure_scope = memory_pressure_file()
+
+def pressure_counters():
+    " return the swap used by this process and the (some, full) stall secs, the latter None where PSI isn't available "
+    return (proc_swap(), memory_pressure(pressure_path))
+
+# the I/O counters: bytes read and written at the storage layer (read_bytes,
+# write_bytes) and via syscalls (rchar, wchar), and the number of read and
+# write syscalls (syscr, syscw), as in /proc/<pid>/io on linux
+def proc_io_counters(proc):
+    " return the I/O counters of the process, or None if not available "
+    try:
+        c = proc.io_counters()
+    except (AttributeError, psutil.Error): # not supported (osx), no permissions or the process is gone
+        return None
+    return (c.read_bytes, c.write_bytes, getattr(c, 'read_chars', 0), getattr(c, 'write_chars', 0), c.read_count, c.write_count)
+
+def io_counters(children=False):
+    " return {pid: I/O counters} of this process and optionally of its children "
+    procs = [process]
+    if children:
+        try: procs += process.children(recursive=True)
+        except psutil.Error: pass
+    counters = {}
+    for proc in procs:
+        c = proc_io_counters(proc)
+        if c is not None: counters[proc.pid] = c
+    return counters
+
+def io_delta(end, start):
+    """ sum up the per-pid deltas of I/O counters
+
+    The kernel folds the I/O of reaped children into their parent's counters,
+    so the counters of the processes that are gone by the end are subtracted
+    to not count their I/O from before the start twice.
+    """
+    total = [0]*6
+    for pid, c in end.items():
+        for i, d in enumerate(usage_delta(c, start.get(pid, (0,)*6))): total[i] += d
+    for pid, c in start.items():
+        if pid in end: continue
+        for i, d in enumerate(c): total[i] -= d
+    return total
+
+def thread_io(tid):
+    " return the I/O counters of a thread of this process, None if not available (not linux) "
+    if tid is None: return None
+    try:
+        with open(f"/proc/self/task/{tid}/io") as f:
+            c = dict(line.split(": ") for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None
+    return tuple(int(c[k]) for k in ('read_bytes', 'write_bytes', 'rchar', 'wchar', 'syscr', 'syscw'))
+
+def own_io(counters):
+    " return only this process' entry of the {pid: I/O counters} "
+    return {pid: c for pid, c in counters.items() if pid == process.pid}
+
+# the same for any process (e.g. ProcessMonitor), via psutil
+
+def proc_tree(proc, children=True):
+    " return the process and optionally all its descendants, [] if it's gone "
+    try:
+        return [proc] + (proc.children(recursive=True) if children else [])
+    except psutil.Error:
+        return []
+
+def proc_rss(procs):
+    " return the summed RSS of the processes, skipping the ones that are gone "
+    rss = 0
+    for proc in procs:
+        try: rss += proc.memory_info().rss
+        except psutil.Error: pass
+    return rss
+
+def proc_faults(proc):
+    " return the minor and major page faults of any process, (0, 0) where not available "
+    try:
+        with open(f"/proc/{proc.pid}/stat") as f: stat = f.read()
+    except OSError: # not linux, or the process is gone
+        return (0, 0)
+    # the fields after the ')' closing the command name: state is field 3, minflt 10 and majflt 12
+    fields = stat[stat.rindex(")")+2:].split()
+    return (int(fields[7]), int(fields[9]))
+
+def proc_usage_of(proc):
+    " return the usage counters of any process, or None if it's gone "
+    try:
+        cpu, ctx = proc.cpu_times(), proc.num_ctx_switches()
+    except psutil.Error:
+        return None
+    return (cpu.user, cpu.system, ctx.voluntary, ctx.involuntary, *proc_faults(proc))
+
+def gpu_used_by_pids(pynvml, pids):
+    " return the gpu RAM used by the pids on all the devices, as reported by nvml "
+    used = 0
+    for i in range(pynvml.nvmlDeviceGetCount()):
+        handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+        for p in pynvml.nvmlDeviceGetComputeRunningProcesses(handle):
+            # usedGpuMemory is None where it isn't available (e.g. windows WDDM)
+            if p.pid in pids and p.usedGpuMemory: used += p.usedGpuMemory
+    return used
@@ -3,3 +3,9 @@ import ipyexperiments
 
 def test_basic():
     assert ipyexperiments.__version__
+
+def test_star_import():
+    ns = {}
+    exec("from ipyexperiments import *", ns)
+    for name in ('IPyExperiments', 'IPyExperimentsCPU', 'IPyExperimentsGPU', 'IPyExperimentsPytorch', '__version__'):
+        assert name in ns
@@ -0,0 +1,26 @@
+import pytest
+from ipyexperiments import cell_bench
+from ipyexperiments.cell_bench import bench_stats, bench_growth
+
+def test_stats():
+    stats = bench_stats([3, 1, 2])
+    assert stats.min == 1 and stats.median == 2 and stats.mean == 2
+    assert stats.stddev == 1
+    assert bench_stats([5]).stddev == 0
+
+def test_growth():
+    assert bench_growth([10, 20, 30, 40]) == 10
+    assert bench_growth([10]) == 0
+
+def test_bench():
+    calls = []
+    data = cell_bench(lambda: calls.append(1), repeat=3, warmup=2, verbose=False)
+    assert len(calls) == 5
+    assert len(data.runs) == 3
+    assert data.time.min >= 0
+    assert not data.cpu.leak
+
+def test_bench_leak():
+    leak = []
+    data = cell_bench(lambda: leak.append(bytearray(8*2**20)), repeat=4, warmup=1, verbose=False)
+    assert data.cpu.leak, f"leak not detected: {data.cpu}"
@@ -0,0 +1,34 @@
+import gc
+from ipyexperiments.cell_gc import CellGC
+
+def test_gc_pauses():
+    cg = CellGC()
+    cg.cell_start()
+    assert cg.cell_stop() is None # not registered
+
+    cg.start()
+    try:
+        cg.cell_start()
+        gc.collect(1)
+        gc.collect(2)
+        data = cg.cell_stop()
+    finally:
+        cg.stop()
+    assert cg.callback not in gc.callbacks
+    assert data.count >= 2
+    assert data.generations[1].count >= 1
+    assert data.generations[2].count >= 1
+    assert data.pause_max <= data.pause_total
+
+def test_gc_uncollectable_free_cycles_collected():
+    cg = CellGC()
+    cg.start()
+    try:
+        gc.collect()
+        cg.cell_start()
+        a = []; a.append(a); del a
+        gc.collect()
+        data = cg.cell_stop()
+    finally:
+        cg.stop()
+    assert data.generations[2].collected >= 1
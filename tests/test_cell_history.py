@@ -0,0 +1,35 @@
+import pytest
+from ipyexperiments.cell_history import CellHistory, CellHistoryRow, columns
+
+def make_history(n):
+    history = CellHistory()
+    for i in range(n):
+        row = dict.fromkeys(columns, 0)
+        row.update(execution_count=i+1, source=f"cell {i % 3}", time_delta=i/10, cpu_used_delta=(i % 3) * 2**20)
+        history.append_row(CellHistoryRow(**row))
+    return history
+
+def test_cell_history():
+    history = make_history(9)
+    assert len(history) == 9 and history.sources == ["cell 0", "cell 1", "cell 2"]
+    assert history[-1].execution_count == 9 and history[-1].source == "cell 2"
+    assert [r.execution_count for r in history[2:4]] == [3, 4]
+
+    assert history.sum('cpu_used_delta') == 9 * 2**20
+    assert history.max('time_delta') == pytest.approx(0.8)
+    assert [r.execution_count for r in history.top('time_delta', 2)] == [9, 8]
+    assert len(history.filter(lambda r: r.source == "cell 1")) == 3
+    groups = history.group_by('source')
+    assert {s: g.sum('cpu_used_delta') for s, g in groups.items()} == {"cell 0": 0, "cell 1": 3*2**20, "cell 2": 6*2**20}
+
+def test_cell_history_numpy():
+    np = pytest.importorskip("numpy")
+    history = make_history(3)
+    arrays = history.to_numpy()
+    assert arrays['execution_count'].tolist() == [1, 2, 3]
+    assert arrays['source'].tolist() == ["cell 0", "cell 1", "cell 2"]
+    assert np.shares_memory(arrays['time_delta'], np.frombuffer(history.cols['time_delta']))
+
+    # growing an exported history leaves the exported arrays intact
+    history.append_row(history[0])
+    assert len(history) == 4 and arrays['execution_count'].tolist() == [1, 2, 3]
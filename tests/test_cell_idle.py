@@ -0,0 +1,31 @@
+import time
+from ipyexperiments.cell_idle import CellIdle
+
+class FakeMem():
+    def __init__(self): self.used = 100
+    def __call__(self): return self.used, 0
+
+def test_idle_drift():
+    mem = FakeMem()
+    ci = CellIdle(mem, interval=0.01)
+    assert ci.idle_stop() is None
+
+    ci.idle_start(1)
+    mem.used = 500
+    time.sleep(0.1)
+    mem.used = 300
+    data = ci.idle_stop()
+    assert ci.thread is None
+    assert data.cpu_drift == 200
+    assert data.cpu_peaked_drift == 200
+    assert data.gpu_drift == 0
+    assert data.time_delta > 0
+    assert {s.execution_count for s in ci.timeline} == {1}
+    assert ci.idle_stop() is None
+
+def test_idle_timeline_bounded():
+    ci = CellIdle(FakeMem(), interval=0.001, max_samples=5)
+    ci.idle_start(1)
+    time.sleep(0.05)
+    ci.idle_stop()
+    assert len(ci.timeline) == 5
@@ -0,0 +1,25 @@
+from ipyexperiments.cell_leaks import CellLeaks
+
+MB = 2**20
+
+def test_cell_leaks():
+    leaks = CellLeaks(min_runs=5, min_bytes=MB)
+    total, leak = 100*MB, None
+    for run in range(8):
+        # the first run builds the state, then 2MB +- noise leak per run
+        delta = 50*MB if run == 0 else 2*MB + (run % 2) * MB//4
+        total += delta
+        leak = leaks.update("train()", delta, total)
+        # an unrelated cell, which allocates the same amount each run but frees it on the next
+        stable = leaks.update("x = load()", 10*MB if run == 0 else 0, total)
+        if run < 4: assert leak is None
+
+    assert leak.runs == 8 and leak.gpu is None
+    assert leak.cpu.leaking
+    assert 2*MB <= leak.cpu.used_delta_mean <= 2.25*MB
+    assert not stable.cpu.leaking
+
+def test_cell_leaks_max_cells():
+    leaks = CellLeaks(max_cells=2)
+    for source in ("a", "b", "c"): leaks.update(source, 0, 0)
+    assert len(leaks.cells) == 2 and hash("a") not in leaks.cells
@@ -0,0 +1,41 @@
+import pytest
+import time
+from ipyexperiments.cell_logger import CellLogger, io_delta
+
+def test_io_delta():
+    start = {1: (10, 10, 10, 10, 1, 1), 2: (5, 5, 5, 5, 1, 1)}
+    # pid 2 got reaped and its total (5 before the start + 3) folded into pid 1
+    end   = {1: (10+8, 10+8, 10+8, 10+8, 1+2, 1+2), 3: (1, 1, 1, 1, 1, 1)}
+    assert io_delta(end, start) == [4, 4, 4, 4, 2, 2]
+
+def measure_cell(func):
+    cl = CellLogger(gc_collect=False, gc_pauses=False, leak_runs=0)
+    cl.measure_start()
+    func()
+    cl.measure_stop()
+    return cl
+
+def test_process_usage():
+    def busy():
+        end = time.perf_counter() + 0.3
+        while time.perf_counter() < end: pass
+    cl = measure_cell(busy)
+    pr = cl.data.process
+    assert pr.cpu_user > 0.15 and 0.5 < pr.cpu_util < 1.5, pr
+    assert pr.ctx_voluntary >= 0 and pr.faults_minor >= 0
+
+def test_sampler_usage_excluded():
+    # the peak monitor thread busy-loops a core for the whole cell, but an idle cell uses no CPU
+    cl = measure_cell(lambda: time.sleep(0.5))
+    sampler_cpu = cl.peak_monitor_usage[0] + cl.peak_monitor_usage[1]
+    assert sampler_cpu > 0.1, cl.peak_monitor_usage
+    pr = cl.data.process
+    assert pr.cpu_user + pr.cpu_system < 0.1, pr
+
+def test_idle_cell_io():
+    # the peak monitor thread reads /proc in a busy loop, which isn't the cell's I/O
+    cl = measure_cell(lambda: time.sleep(0.7))
+    io = cl.data.io
+    if io is None: pytest.skip("the I/O counters aren't available")
+    assert io.rchar < 2**16 and io.syscr < 100, io
+    assert not cl.io_reportable()
@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+from ipyexperiments.cell_logger import CellLogger
+from ipyexperiments.cell_sampler import CellSampler
+
+def fake_logger():
+    return SimpleNamespace(backend='cpu', threads=None, trace=None)
+
+def test_nested_windows_share_one_thread():
+    s = CellSampler()
+    s.linger = 0.1
+    outer = s.open([fake_logger()])
+    thread = s.thread
+    inner = s.open([fake_logger()])
+    assert s.thread is thread
+    x = bytearray(50*2**20)
+    time.sleep(0.05)
+    s.close(inner)
+    del x
+    s.close(outer)
+    assert inner.closed.is_set() and outer.closed.is_set()
+    assert outer.cpu_used_peak >= inner.cpu_used_peak > 0
+    assert inner.tid is not None and inner.tid == outer.tid
+
+    # the thread exits once no windows are open for `linger` secs
+    thread.join(2)
+    assert not thread.is_alive()
+    assert s.thread is None and s.windows == ()
+
+def test_periodic_sampling():
+    samples = []
+    cl = SimpleNamespace(backend='cpu', threads=SimpleNamespace(interval=0.01, sample=lambda: samples.append(1)), trace=None)
+    s = CellSampler()
+    w = s.open([cl])
+    time.sleep(0.1)
+    s.close(w)
+    assert len(samples) > 1
+
+def test_mixed_gc_collect():
+    # the loggers that don't collect aren't affected by the collection run for the others
+    collecting, leak_tracking = (CellLogger(gc_collect=collect, gc_pauses=False, leak_runs=0) for collect in (True, False))
+    s = CellSampler()
+    s.linger = 0.1
+    s.measure_start([collecting, leak_tracking])
+    cycle = [bytearray(32*2**20)]
+    cycle.append(cycle)
+    del cycle
+    s.measure_stop([collecting, leak_tracking])
+    assert leak_tracking.data.cpu.used_delta > 16*2**20, leak_tracking.data.cpu
+    assert collecting.data.cpu.used_delta < 16*2**20, collecting.data.cpu
@@ -0,0 +1,36 @@
+import pytest
+import threading
+import time
+from ipyexperiments.cell_threads import CellThreads
+
+def busy(secs):
+    end = time.perf_counter() + secs
+    while time.perf_counter() < end: pass
+
+def test_threads():
+    ct = CellThreads(group_by='name')
+    ct.cell_start()
+    t = threading.Thread(target=lambda: (busy(0.3), time.sleep(0.2)), name="busy-worker")
+    t.start()
+    busy(0.1)
+    data = ct.cell_stop()
+    t.join()
+    names = [g.name for g in data.groups]
+    assert "busy-worker" in names
+    assert data.parallelism > 0
+    assert data.total >= 2
+
+def test_sampled_exited_thread():
+    ct = CellThreads(group_by='id', interval=0.01)
+    ct.cell_start()
+    t = threading.Thread(target=busy, args=(0.2,))
+    t.start()
+    t.join(0.15)
+    ct.sample()
+    t.join()
+    data = ct.cell_stop()
+    assert str(t.native_id) in [g.name for g in data.groups]
+
+def test_bad_group_by():
+    with pytest.raises(ValueError):
+        CellThreads(group_by='foo')
@@ -0,0 +1,84 @@
+import pytest
+import sys
+import tracemalloc
+from ipyexperiments.cell_tracemalloc import CellTracemalloc
+
+def allocate(): return [bytearray(2**10) for _ in range(2**10)]
+
+def test_sites():
+    tm = CellTracemalloc(frames=1, top=3)
+    tm.start()
+    try:
+        tm.cell_start()
+        x = allocate()
+        data = tm.cell_stop(rss_used_delta=2**20)
+    finally:
+        tm.stop()
+    assert not tracemalloc.is_tracing()
+    assert data.used_delta >= 2**20
+    assert data.rss_share >= 1
+    assert "test_cell_tracemalloc.py" in data.sites[0].site
+    assert data.sites[0].count_delta >= 2**10
+
+def test_max_traces():
+    tm = CellTracemalloc(max_traces=10)
+    tm.start()
+    try:
+        tm.cell_start()
+        x = allocate()
+        data = tm.cell_stop(rss_used_delta=0)
+    finally:
+        tm.stop()
+    assert data.sites is None
+    assert data.rss_share == 0
+
+def test_max_traces_no_snapshot(monkeypatch):
+    tm = CellTracemalloc(max_traces=10)
+    tm.start()
+    try:
+        x = allocate()
+        def take_snapshot(): raise AssertionError("the snapshot should have been skipped")
+        monkeypatch.setattr(tracemalloc, "take_snapshot", take_snapshot)
+        assert tm.snapshot() is None
+    finally:
+        tm.stop()
+
+def test_keeps_user_tracing():
+    tracemalloc.start()
+    try:
+        tm = CellTracemalloc()
+        tm.start()
+        tm.stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_numpy_domain():
+    np = pytest.importorskip("numpy")
+    from ipyexperiments.cell_tracemalloc import CellTracemallocNumpy
+    tm = CellTracemallocNumpy(top=3)
+    tm.start()
+    try:
+        tm.cell_start()
+        a = np.ones(2**20)  # 8MB
+        x = allocate()       # python allocations aren't counted
+        data = tm.cell_stop(rss_used_delta=2**23)
+    finally:
+        tm.stop()
+    assert data.used_delta == a.nbytes
+    assert "test_cell_tracemalloc.py" in data.sites[0].site
+    assert data.sites[0].size_delta == a.nbytes
+
+def test_numpy_not_imported(monkeypatch):
+    # no tracing, and so no slow down, until numpy is imported
+    from ipyexperiments.cell_tracemalloc import CellTracemallocNumpy
+    monkeypatch.delitem(sys.modules, "numpy", raising=False)
+    tm = CellTracemallocNumpy()
+    tm.start()
+    try:
+        tm.cell_start()
+        assert not tracemalloc.is_tracing()
+        assert tm.cell_stop(rss_used_delta=0) is None
+    finally:
+        tm.stop()
+    assert not tracemalloc.is_tracing()
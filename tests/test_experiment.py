@@ -0,0 +1,95 @@
+import gc
+import platform
+import pytest
+from IPython.core.interactiveshell import InteractiveShell
+from ipyexperiments.cell_history import CellHistory, CellHistoryRow, columns
+
+def make_exp(**kwargs):
+    """ Create an IPyExperimentsCPU in the test ipython shell """
+    shell = InteractiveShell.instance()
+    shell.run_cell("from ipyexperiments import IPyExperimentsCPU")
+    shell.user_ns["exp_kwargs"] = kwargs
+    shell.run_cell("exp = IPyExperimentsCPU(**exp_kwargs)")
+    return shell.user_ns["exp"]
+
+def test_cells_hotspots(capsys):
+    exp = make_exp(cl_enable=False, exp_hotspots=2)
+    exp.cell_history = history = CellHistory()
+    for n, (time_delta, consumed, peaked) in enumerate([(1, 3*2**20, 2**10), (3, 0, 2**10), (2, 5*2**20, 0)], 1):
+        row = dict.fromkeys(columns, 0)
+        row.update(execution_count=n, source=f"cell {n}", time_delta=time_delta, cpu_used_delta=consumed,
+                   cpu_peaked_delta=peaked, cpu_used_peak=100*2**20)
+        history.append_row(CellHistoryRow(**row))
+
+    cells = exp._cells()
+    assert cells.count == 3 and cells.cpu_peak == 100*2**20
+    assert [h.execution_count for h in cells.time.top] == [2, 3]
+    assert cells.time.total == 6 and cells.time.top[0].share == 0.5
+    assert [h.execution_count for h in cells.cpu_consumed.top] == [3, 1]
+    # only the non-zero values
+    assert [h.execution_count for h in cells.gpu_consumed.top] == []
+
+    capsys.readouterr()
+    exp.print_cells(cells)
+    out = capsys.readouterr().out
+    assert "In [3]: 5 MB" in out and "In [2]: 0:00:03.000" in out
+    # all sub-MB, the section is skipped
+    assert "CPU △Peaked" not in out
+    exp.finish()
+
+@pytest.mark.skipif(platform.libc_ver()[0] != "glibc", reason="requires glibc")
+def test_finish_malloc_trim(capsys):
+    exp = make_exp(cl_enable=False, exp_malloc_trim=True)
+    exp.namespace.shell.run_cell("x = [bytearray(1000) for i in range(5000)]")
+    # pins the top of the heap, so that glibc keeps the freed small allocations mapped until the trim
+    keep = bytearray(1000)
+    data = exp.finish()
+    assert data.cpu.trimmed > 0
+    out = capsys.readouterr().out
+    assert f"returned to OS by malloc_trim: {data.cpu.trimmed//2**20:,} MB" in out
+
+def test_gc_freeze():
+    assert gc.get_freeze_count() == 0
+    try:
+        exp = make_exp(cl_enable=False, exp_gc_freeze=True)
+        assert gc.get_freeze_count() > 0 and exp.gc_freeze_data.frozen > 0
+        assert exp.data.gc_freeze is exp.gc_freeze_data
+        exp.finish()
+        assert gc.get_freeze_count() == 0
+    finally:
+        gc.unfreeze()
+
+def test_gc_freeze_already_frozen(capsys):
+    gc.freeze()
+    try:
+        exp = make_exp(cl_enable=False, exp_gc_freeze=True)
+        assert exp.gc_freeze_data is None
+        assert "gc.freeze was already called before the experiment" in capsys.readouterr().out
+        exp.finish()
+        # the user's freeze is left alone
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+
+def test_cell_without_history():
+    events = []
+    exp = make_exp(exp_subscribers=[events.append], cl_verbose=False)
+    shell = exp.namespace.shell
+    shell.run_cell("x = 1", store_history=False)
+    shell.run_cell("y = 2", store_history=True)
+    exp.dispatcher.flush(2)
+    history = exp.history
+    assert [r.execution_count for r in history[-2:]] == [-1, shell.execution_count - 1]
+    assert sum(e.kind == 'cell' for e in events) >= 2
+    exp.finish()
+
+def test_finish_mid_cell():
+    # the other experiment's logger keeps sampling the peak after one finishes in the middle of a cell
+    exp1 = make_exp(cl_verbose=False)
+    shell = exp1.namespace.shell
+    shell.user_ns["exp1"] = exp1
+    exp2 = make_exp(cl_verbose=False)
+    shell.run_cell("exp1.finish(); x = bytearray(64*2**20); del x")
+    assert exp2.cl.data.cpu.peaked_delta > 32*2**20, exp2.cl.data.cpu
+    assert exp2.cl.data.process.cpu_user + exp2.cl.data.process.cpu_system < 0.5, exp2.cl.data.process
+    exp2.finish()
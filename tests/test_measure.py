@@ -0,0 +1,38 @@
+import threading
+from ipyexperiments import measure
+
+def test_block():
+    with measure(gc_collect=False) as m:
+        x = bytearray(32*2**20)
+        del x
+    assert m.data.time.time_delta > 0
+    assert m.data.cpu.peaked_delta > 16*2**20, f"peak not measured: {m.data.cpu}"
+    assert m.stats.count == 1
+
+def test_decorator_reentrant():
+    @measure(peak=False)
+    def fact(n): return 1 if n <= 1 else n * fact(n - 1)
+    assert fact(5) == 120
+    assert fact.measure.name.endswith("fact")
+    assert fact.measure.stats.count == 1
+    fact(3)
+    assert fact.measure.stats.count == 2
+    fact.measure.reset()
+    assert fact.measure.stats.count == 0
+
+def test_fast_path():
+    keep = []
+    m = measure(peak=False)
+    with m: keep.append(bytearray(16*2**20))
+    assert m.data.cpu.peaked_delta == 0
+    assert m.data.cpu.used_delta > 8*2**20, f"consumed not measured: {m.data.cpu}"
+
+def test_threads():
+    m = measure(peak=False)
+    def run():
+        for _ in range(10):
+            with m: pass
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert m.stats.count == 40
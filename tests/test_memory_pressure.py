@@ -0,0 +1,33 @@
+from ipyexperiments import measure
+from ipyexperiments.cell_logger import CellLogger
+from ipyexperiments.utils import proc
+
+def test_memory_pressure(tmp_path):
+    psi = tmp_path / "memory.pressure"
+    psi.write_text("some avg10=0.00 avg60=0.00 avg300=0.00 total=2500000\n"
+                   "full avg10=0.00 avg60=0.00 avg300=0.00 total=1000000\n")
+    assert proc.memory_pressure(str(psi)) == (2.5, 1.0)
+    assert proc.memory_pressure(str(tmp_path / "missing")) is None
+    assert proc.memory_pressure(None) is None
+    assert proc.proc_swap() >= 0
+    assert proc.proc_swap("no-such-pid") == 0
+
+def test_cell_pressure():
+    with measure(gc_collect=False) as m: pass
+    mp = m.data.pressure
+    assert mp.swap_used >= 0 and mp.some_stall >= 0 and mp.full_stall >= 0
+    assert mp.scope in (None, "cgroup", "system")
+    assert mp.scope is not None or mp.some_stall == mp.full_stall == 0
+
+def test_stall_warning(capsys):
+    cl = CellLogger(gc_pauses=False, leak_runs=0)
+    cl.measure_start()
+    cl.measure_stop()
+    cl.time_delta = 2
+    cl.pressure_data = cl.pressure_data._replace(swap_used=2**24, some_stall=1.5, some_share=0.75, scope="system")
+    assert cl.pressure_reportable() and cl.pressure_stalled()
+    cl.print_report()
+    out = capsys.readouterr().out
+    assert "Memory pressure: swap 16 MB" in out and "Warning: the system's tasks stalled" in out
+    cl.time_delta = 0.5 # too short to warn about
+    assert not cl.pressure_stalled()
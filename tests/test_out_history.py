@@ -0,0 +1,53 @@
+from IPython.core.interactiveshell import InteractiveShell
+from ipyexperiments.out_history import OutHistory
+
+big_class = """
+class Big(bytearray):
+    def __repr__(self): return "Big"
+"""
+
+def run(shell, source):
+    shell.run_cell(source, store_history=True, silent=False)
+    return shell.execution_count - 1
+
+def test_entries_and_drop():
+    shell = InteractiveShell.instance()
+    run(shell, big_class)
+    oh = OutHistory(shell, start=shell.execution_count)
+    n = run(shell, "Big(8*2**20)")
+    run(shell, "[1, 2]")
+    top = oh.entries()[0]
+    assert top.execution_count == n and top.size >= 8*2**20 and top.type == "Big"
+    assert oh.size() >= 8*2**20
+
+    oh.drop(n)
+    assert n not in shell.user_ns["Out"]
+    assert f"_{n}" not in shell.user_ns and f"_{n}" not in shell.user_ns_hidden
+    assert all(type(shell.user_ns[u]).__name__ != "Big" for u in ("_", "__", "___"))
+
+def test_retention():
+    shell = InteractiveShell.instance()
+    run(shell, big_class)
+    oh = OutHistory(shell, start=shell.execution_count, keep=2, max_bytes=20*2**20)
+    oh.register()
+    try:
+        ns = [run(shell, "Big(8*2**20)") for _ in range(3)]
+        assert [n for n in shell.user_ns["Out"] if n >= oh.start] == ns[1:] and oh.dropped == 1
+        n = run(shell, "Big(16*2**20)")
+        # the previous one no longer fits
+        assert [n for n in shell.user_ns["Out"] if n >= oh.start] == [n]
+    finally:
+        oh.unregister()
+    assert [e.execution_count for e in oh.purge()] == [n]
+    assert not oh.entries()
+
+def test_exp_purge():
+    shell = InteractiveShell.instance()
+    run(shell, big_class + "from ipyexperiments import IPyExperimentsCPU")
+    run(shell, "exp = IPyExperimentsCPU(exp_out_keep=1, exp_out_purge=True, exp_verbose=False, cl_enable=False)")
+    exp = shell.user_ns["exp"]
+    for _ in range(2): run(shell, "Big(32*2**20)")
+    data = exp.data.out_history
+    assert data.count == 1 and data.dropped == 1
+    data = exp.finish().out_history
+    assert data.purged == 1 and data.cpu_reclaimed > 16*2**20, data
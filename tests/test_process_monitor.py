@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+from ipyexperiments import ProcessMonitor
+
+def test_process_monitor():
+    code = "import sys; x = bytearray(50*2**20); x[::4096] = b'x'*len(x[::4096]); sys.stdin.readline()"
+    proc = subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE)
+    try:
+        monitor = ProcessMonitor(proc.pid, interval=0.01, gpu=False, verbose=False).start()
+        # wait for the child to allocate
+        while monitor.checkpoint().cpu.used_total < 50*2**20 and proc.poll() is None: pass
+        proc.stdin.write(b"\n")
+        proc.stdin.flush()
+        proc.wait()
+        data = monitor.stop()
+    finally:
+        proc.kill()
+
+    assert not monitor.alive
+    assert data.cpu.used_total == 0 and data.cpu.used_delta < -50*2**20
+    assert data.process is not None and data.threads is None
+
+def test_report_matches_cell_logger(capsys):
+    # the monitor's report lines are formatted by the same helpers as the cell logger's
+    from ipyexperiments.cell_logger import CellLogger
+    cl = CellLogger(gc_pauses=False, leak_runs=0)
+    cl.measure_start()
+    cl.measure_stop()
+    cl.pressure_data = None # the monitor doesn't report the swap
+    monitor = ProcessMonitor(os.getpid(), include_children=False, gpu=False, verbose=False)
+    monitor.data = cl.data
+    for compact in (False, True):
+        cl.compact = monitor.compact = compact
+        cl.print_report()
+        cell = capsys.readouterr().out.splitlines()
+        monitor.print_report()
+        proc = capsys.readouterr().out.splitlines()
+        if compact:
+            assert proc[0].split(" | ", 1)[1] == cell[0]
+        else:
+            assert proc[1:] == [line.replace("Exec time", "Elapsed time") for line in cell]
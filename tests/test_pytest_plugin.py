@@ -0,0 +1,56 @@
+import pytest
+
+pytest_plugins = "pytester"
+
+@pytest.fixture
+def plugin_args():
+    # the plugin isn't auto-loaded, the runs enable it like the users do
+    return ("-p", "ipyexperiments.pytest_plugin")
+
+def test_budgets(pytester, plugin_args):
+    pytester.makepyfile("""
+        import pytest
+
+        @pytest.mark.ipyexp(max_peak_mb=10000, max_time=100)
+        def test_within():
+            x = bytearray(8*2**20)
+
+        @pytest.mark.ipyexp(max_peak_mb=16)
+        def test_over():
+            x = bytearray(64*2**20)
+
+        @pytest.mark.ipyexp(max_mem=1)
+        def test_bad_marker():
+            pass
+
+        def test_unmeasured(record_property):
+            pass
+    """)
+    result = pytester.runpytest_inprocess(*plugin_args)
+    result.assert_outcomes(passed=2, failed=1, errors=1)
+    result.stdout.fnmatch_lines(["*ipyexperiments budget exceeded:*", "peak * MB > max_peak_mb=16"])
+    # the summary is only printed with --ipyexp
+    assert "ipyexperiments: top" not in result.stdout.str()
+
+def test_summary(pytester, plugin_args):
+    pytester.makepyfile("""
+        def test_small():
+            pass
+
+        def test_big():
+            x = bytearray(64*2**20)
+    """)
+    result = pytester.runpytest_inprocess(*plugin_args, "--ipyexp", "--ipyexp-top=1")
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["*ipyexperiments: top 1 of 2 tests by peak*", "*MB*test_summary.py::test_big"])
+
+def test_user_properties(pytester, plugin_args):
+    pytester.makepyfile("""
+        def test_one():
+            pass
+    """)
+    reprec = pytester.inline_run(*plugin_args, "--ipyexp")
+    report, = [r for r in reprec.getreports("pytest_runtest_logreport") if r.when == "call"]
+    props = dict(report.user_properties)
+    assert set(props) == {"ipyexp_time", "ipyexp_cpu_time", "ipyexp_consumed", "ipyexp_peak"}
+    assert props["ipyexp_time"] >= 0
@@ -0,0 +1,32 @@
+import threading
+from ipyexperiments.subscribers import Dispatcher
+
+def test_dispatcher():
+    dispatcher = Dispatcher(maxsize=2)
+    dispatcher.publish('cell') # nothing subscribed, nothing queued
+    assert dispatcher.thread is None and dispatcher.queue.empty()
+
+    # a sink slower than the cells: the queue fills up and the rest is dropped, never blocking
+    release, events = threading.Event(), []
+    def slow_sink(event):
+        release.wait()
+        events.append(event)
+    def failing_sink(event): raise RuntimeError("sink failed")
+    dispatcher.subscribe(slow_sink)
+    dispatcher.subscribe(failing_sink)
+    for i in range(10): dispatcher.publish('cell', record=i)
+    release.set()
+    assert dispatcher.flush(timeout=5)
+
+    assert dispatcher.dropped > 0
+    assert len(events) == 10 - dispatcher.dropped
+    assert [e.record for e in events] == sorted(e.record for e in events)
+    assert dispatcher.errors == len(events)
+
+    dispatcher.unsubscribe(failing_sink)
+    dispatcher.close()
+    dispatcher.publish('cell', record=10) # ignored once closed
+    assert dispatcher.flush(timeout=5) and len(events) == 10 - dispatcher.dropped
+    thread = dispatcher.thread
+    if thread is not None: thread.join(timeout=5)
+    assert dispatcher.thread is None
@@ -0,0 +1,25 @@
+import json
+import time
+from ipyexperiments.trace_events import TraceEventWriter
+
+def test_trace_events(tmp_path):
+    path = tmp_path / "trace.json"
+    trace = TraceEventWriter(str(path))
+    start = time.perf_counter()
+    trace.memory(2**20, ts=start)
+    trace.complete("In [1]: x = 1", "cell", start, 0.5, trace.tid_cells, dict(cpu_used_delta_mb=1))
+    trace.memory(2**21, 2**20)
+    trace.flush()
+
+    # readable while still being written
+    events = json.loads(path.read_text() + "]")
+    assert events[-1]["name"] == "GPU RAM"
+
+    trace.close()
+    trace.complete("after close", "cell", start, 0, trace.tid_cells) # ignored
+    events = json.loads(path.read_text())
+    phases = [e["ph"] for e in events]
+    assert phases.count("M") == 3 and phases.count("X") == 1 and phases.count("C") == 3
+    cell = next(e for e in events if e["ph"] == "X")
+    assert cell["dur"] == 500000
+    assert cell["args"] == dict(cpu_used_delta_mb=1)
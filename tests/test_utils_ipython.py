@@ -1,5 +1,8 @@
 import pytest
-from ipyexperiments.utils.ipython import ipython_tb_clear_frames, ipython_tb_clear_frames_ctx
+import sys
+from IPython.core.interactiveshell import InteractiveShell
+from ipyexperiments.utils.ipython import (ipython_tb_clear_frames, ipython_tb_clear_frames_ctx,
+                                         ipython_tb_clear_frames_hook, tb_frames)
 
 # at the moment just a syntax check, the test would be useless w/o ipython env
 
@@ -13,3 +16,37 @@ def test_decorator():
 def test_ctx():
     with ipython_tb_clear_frames_ctx():
         x = 10
+
+failing_cell = """
+def fail():
+    x = bytearray(64*2**20)
+    1/0
+fail()
+"""
+
+def test_hook():
+    shell = InteractiveShell.instance()
+    with ipython_tb_clear_frames_hook(shell, min_bytes=2**20, verbose=False) as hook:
+        shell.run_cell(failing_cell, silent=True)
+        assert hook.reclaimed[0] > 32*2**20, f"frames' locals not reclaimed: {hook.reclaimed}"
+
+        # small tracebacks are left alone
+        shell.run_cell("1/0", silent=True)
+        assert hook.reclaimed is None
+
+        hook.keep_frames = True
+        shell.run_cell(failing_cell, silent=True)
+        assert hook.reclaimed is None
+        assert any("x" in frame.f_locals for frame in tb_frames(sys.last_value))
+    assert shell.custom_exceptions == ()
+
+def test_exp_hook():
+    shell = InteractiveShell.instance()
+    shell.run_cell("from ipyexperiments import IPyExperimentsCPU")
+    shell.run_cell("exp = IPyExperimentsCPU(exp_tb_clear_frames=True, exp_tb_clear_bytes=2**20, exp_verbose=False, cl_enable=False)")
+    exp = shell.user_ns["exp"]
+    assert exp.tb_hook is not None
+    shell.run_cell(failing_cell, silent=True)
+    assert exp.tb_hook.reclaimed[0] > 32*2**20
+    exp.finish()
+    assert exp.tb_hook is None and shell.custom_exceptions == ()
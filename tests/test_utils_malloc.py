@@ -0,0 +1,32 @@
+import pytest
+import platform
+from ipyexperiments.cell_logger import CellLogger
+from ipyexperiments.utils.malloc import malloc_trim, is_malloc_trim_available
+
+glibc = pytest.mark.skipif(platform.libc_ver()[0] != "glibc", reason="requires glibc")
+
+def small_allocations(n):
+    " free n small allocations, which glibc keeps mapped, since the one allocated last pins the top of the heap "
+    x = [bytearray(1000) for i in range(n)]
+    keep = bytearray(1000)
+    del x
+    return keep
+
+@glibc
+def test_malloc_trim():
+    keep = small_allocations(10000)
+    assert malloc_trim() is True
+
+@glibc
+def test_available():
+    assert is_malloc_trim_available()
+
+@glibc
+def test_cell_trimmed(capsys):
+    cl = CellLogger(gc_pauses=False, leak_runs=0, malloc_trim=True)
+    cl.measure_start()
+    keep = small_allocations(50000)
+    cl.measure_stop()
+    assert cl.cpu_mem_trimmed > 0
+    cl.print_report()
+    assert f"malloc_trim returned {cl.cpu_mem_trimmed//2**20:,} MB" in capsys.readouterr().out
@@ -0,0 +1,25 @@
+import pytest
+import time
+from ipyexperiments.utils.min_mem import find_min_memory
+
+MB = 2**20
+
+def allocate(n):
+    x = bytearray(n * MB)
+    x[::4096] = b'x' * len(x[::4096]) # touch the pages
+    time.sleep(0.05) # hold it for the watchdog to see
+
+def test_find_min_memory():
+    result = find_min_memory(allocate, (64,), tolerance=8*MB, workers=2, verbose=False)
+    assert 56*MB <= result.budget <= 64*MB + 24*MB
+    assert result.probes[0].budget is None and result.probes[0].ok
+    assert any(not p.ok and p.error == "RSS exceeded the budget" for p in result.probes)
+
+def test_find_min_memory_fails():
+    with pytest.raises(RuntimeError):
+        find_min_memory("raise ValueError('not a memory issue')", verbose=False)
+
+def test_find_min_memory_fails_with_high():
+    # a failure unrelated to the memory doesn't double the given budget forever
+    with pytest.raises(RuntimeError, match="without a memory limit"):
+        find_min_memory("raise ValueError('not a memory issue')", high=16*MB, verbose=False)